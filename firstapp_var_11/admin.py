@@ -1,21 +1,37 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.http import HttpResponseRedirect
 from .models import *
+from . import inventory
+from .crossdb import prefetch_crossdb
+from .pagination import EstimatedCountPaginator
 
 # Регистрация моделей для админ-панели
 
+class EstimatedCountAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin для больших таблиц: количество строк в списке берётся из
+    статистики планировщика, а не из COUNT(*). Общее количество без
+    фильтров («N всего») тоже требует COUNT(*), поэтому отключено.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
 @admin.register(ClothesType)
 class ClothesTypeAdmin(admin.ModelAdmin):
     list_display = ['name', 'created_at']
     search_fields = ['name', 'description']
 
 @admin.register(Buyer)
-class BuyerAdmin(admin.ModelAdmin):
+class BuyerAdmin(EstimatedCountAdmin):
     list_display = ['last_name', 'first_name', 'email', 'phone', 'registration_date', 'is_vip']
     search_fields = ['first_name', 'last_name', 'email']
     list_filter = ['gender', 'is_vip']
 
 @admin.register(Purchase)
-class PurchaseAdmin(admin.ModelAdmin):
+class PurchaseAdmin(EstimatedCountAdmin):
     list_display = ['id', 'buyer', 'purchase_date', 'total_amount', 'payment_method']
     list_filter = ['payment_method', 'purchase_date']
     search_fields = ['buyer__first_name', 'buyer__last_name']
@@ -95,6 +111,50 @@ class BuyerProfileAdmin(admin.ModelAdmin):
     photo_preview.short_description = 'Предпросмотр фото'
 
 
+class CrossDbChangeList(ChangeList):
+    """Список объектов, подгружающий связи из другой базы одним запросом на модель"""
+
+    def get_results(self, request):
+        super().get_results(request)
+        prefetch_crossdb(self.result_list, *self.model_admin.crossdb_prefetch)
+
+
+class CrossDbPrefetchAdmin(EstimatedCountAdmin):
+    """
+    ModelAdmin для моделей со связями между PostgreSQL и SQLite.
+
+    Внешние ключи из crossdb_prefetch подгружаются через prefetch_crossdb,
+    поэтому list_select_related должен перечислять только связи той же базы
+    (иначе админка сама добавит JOIN по всем ForeignKey из list_display).
+    """
+    crossdb_prefetch = ()
+
+    def get_changelist(self, request, **kwargs):
+        return CrossDbChangeList
+
+
+class StockReservationAdmin(CrossDbPrefetchAdmin):
+    """
+    ModelAdmin заказов и позиций: позиции резервируют товар на складе так
+    же, как представления (inventory.reserve_items). Резервы отменяются,
+    если транзакция админки откатилась, а нехватка товара (ValidationError
+    из reserve_items или из возврата заказа из отмены) показывается
+    сообщением вместо ошибки 500.
+    """
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        try:
+            with inventory.release_on_rollback():
+                return super().changeform_view(request, object_id, form_url, extra_context)
+        except ValidationError as error:
+            self.message_user(request, ' '.join(error.messages), messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
+
+    def reserve_items(self, items):
+        if not inventory.reserve_items(items):
+            raise ValidationError('Недостаточно товара на складе')
+
+
 class OrderItemInline(admin.TabularInline):
     """Inline для позиций заказа"""
     model = OrderItem
@@ -104,13 +164,15 @@ class OrderItemInline(admin.TabularInline):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(StockReservationAdmin):
     list_display = ['order_number', 'buyer', 'seller', 'delivery_method', 'status', 
                     'order_date', 'total_amount', 'delivery_cost']
+    list_select_related = ['seller', 'delivery_method']
+    crossdb_prefetch = ['buyer']
     list_filter = ['status', 'order_date', 'delivery_method']
     search_fields = ['order_number', 'buyer__first_name', 'buyer__last_name', 
                      'delivery_address', 'contact_phone']
-    readonly_fields = ['order_date', 'order_time', 'created_at', 'updated_at', 
+    readonly_fields = ['order_number', 'order_date', 'order_time', 'total_amount', 'created_at', 'updated_at', 
                        'invoice_preview', 'delivery_photo_preview']
     inlines = [OrderItemInline]
     
@@ -154,13 +216,50 @@ class OrderAdmin(admin.ModelAdmin):
     delivery_photo_preview.allow_tags = True
     delivery_photo_preview.short_description = 'Фото подтверждения доставки'
 
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not OrderItem:
+            return super().save_formset(request, form, formset, change)
+        items = formset.save(commit=False)
+        self.reserve_items(items)
+        for item in formset.deleted_objects:
+            item.delete()
+        for item in items:
+            item.save()
+        formset.save_m2m()
+
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(StockReservationAdmin):
     list_display = ['order', 'assortment', 'quantity', 'unit_price', 'size', 'get_subtotal']
+    list_select_related = ['order']
+    # order__buyer нужен для Order.__str__
+    crossdb_prefetch = ['assortment', 'size', 'order__buyer']
     list_filter = ['order__status', 'size']
     search_fields = ['order__order_number', 'assortment__name']
+    # Флаг ставится вместе с резервом на складе
+    readonly_fields = ['reserved']
+
+    def save_model(self, request, obj, form, change):
+        self.reserve_items([obj])
+        super().save_model(request, obj, form, change)
     
     def get_subtotal(self, obj):
         return obj.get_subtotal()
-    get_subtotal.short_description = 'Подытог'
\ No newline at end of file
+    get_subtotal.short_description = 'Подытог'
+
+# ============================================================================
+# АНАЛИТИКА: АГРЕГАТНЫЕ ТАБЛИЦЫ
+# ============================================================================
+
+@admin.register(SalesDailyRollup)
+class SalesDailyRollupAdmin(EstimatedCountAdmin):
+    list_display = ['day', 'payment_method', 'purchase_count', 'total_amount', 'min_amount', 'max_amount']
+    list_filter = ['payment_method']
+    readonly_fields = ['day', 'payment_method', 'purchase_count', 'total_amount', 'min_amount', 'max_amount']
+
+
+@admin.register(ProductSalesDaily)
+class ProductSalesDailyAdmin(EstimatedCountAdmin):
+    list_display = ['day', 'assortment_id', 'units', 'revenue']
+    search_fields = ['assortment_id']
+    readonly_fields = ['day', 'assortment_id', 'units', 'revenue']
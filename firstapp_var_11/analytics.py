@@ -0,0 +1,727 @@
+"""
+Аналитические расчёты для страниц /analytics/*.
+
+Все функции строят результат минимальным числом запросов к БД:
+группировка выполняется на стороне базы, а Python только
+дополняет ряды нулями и форматирует результат. Итоги по дням
+берутся из SalesDailyRollup, а не из таблицы Purchase.
+"""
+from datetime import date, datetime, time, timedelta
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import (
+    Aggregate, Avg, Count, Func, Max, Min, Sum, Q, F, Value,
+    DateField, DateTimeField, DecimalField, FloatField, IntegerField,
+)
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .analytics_cache import cached_analytics
+from .crossdb import DEFAULT_BATCH_SIZE, iter_batches, join_batches
+from .models import Assortment, Buyer, ClothesType, Order, OrderItem, Purchase, ProductSalesDaily, SalesDailyRollup, Seller
+from .rollups import LINE_REVENUE
+
+
+# ============================================================================
+# ОТЧЁТ ПО ПРОДАЖАМ ЗА ПЕРИОД
+# ============================================================================
+
+# Допустимые шаги ряда и максимальная длина окна (в днях) для каждого из них
+SALES_GRANULARITIES = {
+    'hour': 31,
+    'day': 731,
+    'week': 1830,
+}
+DEFAULT_REPORT_DAYS = 7
+
+
+def _parse_date(value):
+    """Разбор даты в формате YYYY-MM-DD, None при ошибке"""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _parse_int(value, default):
+    """Разбор положительного целого из строки запроса"""
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return default
+    return number if number > 0 else default
+
+
+def parse_report_window(params, default_days=DEFAULT_REPORT_DAYS):
+    """
+    Окно отчёта из параметров запроса: ?days=, ?from=, ?to=, ?granularity=.
+
+    Возвращает (start, end, granularity), где start и end - даты включительно.
+    Некорректные значения заменяются значениями по умолчанию, а слишком
+    длинное окно обрезается до предела для выбранного шага.
+    """
+    granularity = params.get('granularity', 'day')
+    if granularity not in SALES_GRANULARITIES:
+        granularity = 'day'
+    max_days = SALES_GRANULARITIES[granularity]
+
+    today = timezone.localdate()
+    end = _parse_date(params.get('to')) or today
+    start = _parse_date(params.get('from'))
+    if start is None:
+        days = min(_parse_int(params.get('days'), default_days), max_days)
+        start = end - timedelta(days=days - 1)
+    if start > end:
+        start, end = end, start
+    if (end - start).days + 1 > max_days:
+        start = end - timedelta(days=max_days - 1)
+    return start, end, granularity
+
+
+def _bucket_expression(field, granularity, tz):
+    """Усечение даты до шага ряда в часовом поясе TIME_ZONE"""
+    if granularity == 'hour':
+        return Trunc(field, 'hour', output_field=DateTimeField(), tzinfo=tz)
+    return Trunc(field, granularity, output_field=DateField(), tzinfo=tz)
+
+
+def _bucket_start(day, granularity):
+    """Начало интервала ряда, в который попадает дата"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'quarter':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    return day
+
+
+def _next_bucket(key, granularity):
+    """Начало следующего интервала ряда"""
+    if granularity == 'hour':
+        return key + timedelta(hours=1)
+    if granularity == 'week':
+        return key + timedelta(weeks=1)
+    if granularity in ('month', 'quarter'):
+        months = 1 if granularity == 'month' else 3
+        month_index = key.year * 12 + key.month - 1 + months
+        return key.replace(year=month_index // 12, month=month_index % 12 + 1)
+    return key + timedelta(days=1)
+
+
+def _bucket_keys(start, end, granularity, tz):
+    """Все ключи ряда от start до end включительно"""
+    if granularity == 'hour':
+        current = timezone.make_aware(datetime.combine(start, time.min), tz)
+        stop = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz)
+    else:
+        current = _bucket_start(start, granularity)
+        stop = end + timedelta(days=1)
+
+    keys = []
+    while current < stop:
+        keys.append(current)
+        current = _next_bucket(current, granularity)
+    return keys
+
+
+def _rollup_rows(start, end, granularity, by_payment=False):
+    """Сгруппированные итоги из SalesDailyRollup за дни [start, end]"""
+    group_by = ['bucket', 'payment_method'] if by_payment else ['bucket']
+    return (
+        SalesDailyRollup.objects
+        .filter(day__range=(start, end))
+        .annotate(bucket=Trunc('day', granularity, output_field=DateField()))
+        .values(*group_by)
+        .annotate(count=Sum('purchase_count'), revenue=Sum('total_amount'))
+        .order_by(*group_by)
+    )
+
+
+@cached_analytics('sales_totals', depends_on=[Purchase])
+def sales_totals(since=None):
+    """Количество, выручка и средний чек по итогам дней (начиная с since)"""
+    rollups = SalesDailyRollup.objects.all()
+    if since is not None:
+        rollups = rollups.filter(day__gte=since)
+    totals = rollups.aggregate(count=Sum('purchase_count'), revenue=Sum('total_amount'))
+    count = totals['count'] or 0
+    revenue = totals['revenue'] or 0
+    return {
+        'count': count,
+        'revenue': revenue,
+        'average': revenue / count if count else 0,
+    }
+
+
+@cached_analytics('sales_series', depends_on=[Purchase])
+def sales_series(start, end, granularity='day'):
+    """
+    Ряд продаж (количество и выручка) за период одним GROUP BY запросом.
+
+    Пропущенные интервалы заполняются нулями, поэтому длина ряда
+    определяется только окном и шагом, а не количеством покупок.
+    """
+    tz = timezone.get_current_timezone()
+    if granularity == 'hour':
+        # Дневные итоги не подходят для почасового ряда, читаем покупки
+        start_dt = timezone.make_aware(datetime.combine(start, time.min), tz)
+        end_dt = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz)
+        rows = (
+            Purchase.objects
+            .filter(purchase_date__gte=start_dt, purchase_date__lt=end_dt)
+            .annotate(bucket=_bucket_expression('purchase_date', granularity, tz))
+            .values('bucket')
+            .annotate(count=Count('id'), revenue=Sum('total_amount'))
+            .order_by('bucket')
+        )
+    else:
+        rows = _rollup_rows(start, end, granularity)
+    totals = {row['bucket']: row for row in rows}
+
+    series = []
+    for key in _bucket_keys(start, end, granularity, tz):
+        row = totals.get(key)
+        series.append({
+            'date': key,
+            'count': row['count'] if row else 0,
+            'revenue': (row['revenue'] or 0) if row else 0,
+        })
+    return series
+
+
+# ============================================================================
+# ТРЕНДЫ ПОКУПОК
+# ============================================================================
+
+# Допустимые шаги тренда и максимальное количество интервалов в ряду
+TREND_GRANULARITIES = {
+    'day': 366,
+    'week': 260,
+    'month': 120,
+    'quarter': 40,
+}
+DEFAULT_TREND_PERIODS = 12
+
+
+def parse_trend_params(params):
+    """
+    Параметры тренда из строки запроса: ?granularity=, ?periods=, ?by=.
+
+    Возвращает (granularity, periods, by_payment).
+    """
+    granularity = params.get('granularity', 'month')
+    if granularity not in TREND_GRANULARITIES:
+        granularity = 'month'
+    periods = min(
+        _parse_int(params.get('periods'), DEFAULT_TREND_PERIODS),
+        TREND_GRANULARITIES[granularity],
+    )
+    by_payment = params.get('by') == 'payment_method'
+    return granularity, periods, by_payment
+
+
+@cached_analytics('purchase_trends', depends_on=[Purchase])
+def purchase_trends(granularity='month', periods=DEFAULT_TREND_PERIODS, by_payment=False):
+    """
+    Тренд покупок за последние periods интервалов.
+
+    Ряд строится по SalesDailyRollup, поэтому в память попадает не больше
+    periods * len(PAYMENT_METHODS) строк независимо от объёма истории.
+    """
+    tz = timezone.get_current_timezone()
+    end = timezone.localdate()
+
+    # Отсчитываем periods интервалов назад от текущего
+    start = _bucket_start(end, granularity)
+    for _ in range(periods - 1):
+        start = _bucket_start(start - timedelta(days=1), granularity)
+
+    rows = _rollup_rows(start, end, granularity, by_payment)
+
+    methods = [code for code, _ in Purchase.PAYMENT_METHODS]
+    series = {
+        key: {'period': key, 'count': 0, 'revenue': 0}
+        for key in _bucket_keys(start, end, granularity, tz)
+    }
+    if by_payment:
+        for point in series.values():
+            point['by_payment'] = {method: {'count': 0, 'revenue': 0} for method in methods}
+
+    for row in rows:
+        point = series.get(row['bucket'])
+        if point is None:
+            continue
+        revenue = row['revenue'] or 0
+        point['count'] += row['count']
+        point['revenue'] += revenue
+        if by_payment:
+            point['by_payment'].setdefault(
+                row['payment_method'], {'count': 0, 'revenue': 0}
+            ).update(count=row['count'], revenue=revenue)
+
+    if by_payment:
+        # Список в порядке PAYMENT_METHODS удобнее и для шаблона, и для JSON
+        for point in series.values():
+            point['by_payment'] = [
+                {'payment_method': method, **totals}
+                for method, totals in point['by_payment'].items()
+            ]
+
+    return {
+        'granularity': granularity,
+        'start': start,
+        'end': end,
+        'payment_methods': methods if by_payment else [],
+        'series': list(series.values()),
+    }
+
+
+@cached_analytics('payment_method_stats', depends_on=[Purchase])
+def payment_method_stats():
+    """Количество покупок по способам оплаты за всё время (по SalesDailyRollup)"""
+    return list(
+        SalesDailyRollup.objects
+        .values('payment_method')
+        .annotate(count=Sum('purchase_count'))
+        .order_by('-count')
+    )
+
+
+# ============================================================================
+# СЕГМЕНТАЦИЯ ПОКУПАТЕЛЕЙ
+# ============================================================================
+
+# Границы сегментов по сумме покупок (руб.), переопределяются в settings
+DEFAULT_SEGMENT_THRESHOLDS = (5000, 10000)
+
+
+def segment_thresholds(params=None):
+    """
+    Границы сегментов: ?thresholds=5000,10000 или CUSTOMER_SEGMENT_THRESHOLDS.
+
+    Возвращает отсортированный кортеж положительных чисел без повторов.
+    """
+    thresholds = getattr(settings, 'CUSTOMER_SEGMENT_THRESHOLDS', DEFAULT_SEGMENT_THRESHOLDS)
+    raw = params.get('thresholds') if params is not None else None
+    if raw:
+        try:
+            parsed = [int(value) for value in raw.split(',') if value.strip()]
+        except ValueError:
+            parsed = []
+        if parsed and all(value > 0 for value in parsed):
+            thresholds = parsed
+    return tuple(sorted(set(thresholds)))
+
+
+def _segment_label(low, high):
+    """Подпись сегмента для шаблона"""
+    if low is None:
+        return f'< {high} руб.'
+    if high is None:
+        return f'≥ {low} руб.'
+    return f'{low}-{high - 1} руб.'
+
+
+@cached_analytics('customer_segments', depends_on=[Buyer, Purchase])
+def customer_segments(thresholds=DEFAULT_SEGMENT_THRESHOLDS):
+    """
+    VIP/обычные покупатели и сегменты по сумме покупок одним запросом.
+
+    Сумма покупок считается один раз во вложенном GROUP BY, а все
+    сегменты получаются условной агрегацией поверх него.
+    """
+    buyers = Buyer.objects.annotate(
+        purchase_count=Count('purchases'),
+        total_spent=Sum('purchases__total_amount'),
+    ).order_by()
+
+    bounds = [None, *thresholds, None]
+    ranges = list(zip(bounds, bounds[1:]))
+    aggregates = {
+        'vip_customers': Count('id', filter=Q(is_vip=True)),
+        'regular_customers': Count('id', filter=Q(is_vip=False)),
+        'active_customers': Count('id', filter=Q(purchase_count__gt=0)),
+        'active_spent': Sum('total_spent', filter=Q(purchase_count__gt=0)),
+    }
+    for index, (low, high) in enumerate(ranges):
+        condition = Q(purchase_count__gt=0)
+        if low is not None:
+            condition &= Q(total_spent__gte=low)
+        if high is not None:
+            condition &= Q(total_spent__lt=high)
+        aggregates[f'segment_{index}_count'] = Count('id', filter=condition)
+        aggregates[f'segment_{index}_total'] = Sum('total_spent', filter=condition)
+
+    row = buyers.aggregate(**aggregates)
+
+    segments = []
+    for index, (low, high) in enumerate(ranges):
+        count = row[f'segment_{index}_count']
+        total = row[f'segment_{index}_total'] or 0
+        segments.append({
+            'label': _segment_label(low, high),
+            'min': low,
+            'max': high,
+            'count': count,
+            'total_spent': total,
+            'average_spent': total / count if count else 0,
+        })
+
+    active = row['active_customers']
+    active_spent = row['active_spent'] or 0
+    return {
+        'vip_customers': row['vip_customers'],
+        'regular_customers': row['regular_customers'],
+        'active_customers': active,
+        'total_spent': active_spent,
+        'average_spent': active_spent / active if active else 0,
+        'thresholds': thresholds,
+        # Сегменты от самого ценного к наименее ценному
+        'segments': segments[::-1],
+    }
+
+
+def buyer_purchase_summary(buyer_id):
+    """
+    Итоги покупок одного покупателя за всё время одним запросом:
+    количество, сумма, средний чек, первая и последняя покупка
+    и разбивка по способам оплаты.
+    """
+    aggregates = {
+        'count': Count('id'),
+        'total': Sum('total_amount'),
+        'average': Avg('total_amount'),
+        'first_purchase': Min('purchase_date'),
+        'last_purchase': Max('purchase_date'),
+    }
+    for method, _ in Purchase.PAYMENT_METHODS:
+        aggregates[f'{method}_count'] = Count('id', filter=Q(payment_method=method))
+        aggregates[f'{method}_total'] = Sum('total_amount', filter=Q(payment_method=method))
+
+    row = Purchase.objects.filter(buyer_id=buyer_id).aggregate(**aggregates)
+
+    return {
+        'count': row['count'],
+        'total': row['total'] or 0,
+        'average': row['average'] or 0,
+        'first_purchase': row['first_purchase'],
+        'last_purchase': row['last_purchase'],
+        'by_payment': [
+            {
+                'payment_method': method,
+                'label': label,
+                'count': row[f'{method}_count'],
+                'total': row[f'{method}_total'] or 0,
+            }
+            for method, label in Purchase.PAYMENT_METHODS
+            if row[f'{method}_count']
+        ],
+    }
+
+
+# ============================================================================
+# СТАТУС СКЛАДА
+# ============================================================================
+
+# Остаток, начиная с которого товар не считается заканчивающимся
+DEFAULT_LOW_STOCK_THRESHOLD = 5
+
+
+def low_stock_threshold(params=None):
+    """Порог низкого остатка: ?low_stock= или LOW_STOCK_THRESHOLD из settings"""
+    threshold = getattr(settings, 'LOW_STOCK_THRESHOLD', DEFAULT_LOW_STOCK_THRESHOLD)
+    if params is not None:
+        threshold = _parse_int(params.get('low_stock'), threshold)
+    return threshold
+
+
+STOCK_TOTAL_FIELDS = (
+    'total_items', 'in_stock', 'out_of_stock', 'low_stock', 'total_units', 'total_value',
+)
+
+
+def _empty_stock_totals():
+    """Нулевые итоги склада"""
+    return {field: 0 for field in STOCK_TOTAL_FIELDS}
+
+
+def _add_stock_totals(target, row):
+    """Прибавить к итогам строку сгруппированного запроса"""
+    for field in STOCK_TOTAL_FIELDS:
+        target[field] += row[field] or 0
+
+
+@cached_analytics('inventory_status', depends_on=[Assortment, ClothesType])
+def inventory_status(threshold=DEFAULT_LOW_STOCK_THRESHOLD):
+    """
+    Остатки и стоимость склада одним запросом.
+
+    Условная агрегация сгруппирована по (категория, тип одежды); общие
+    итоги и разбивки по категориям и типам складываются из этих строк.
+    Стоимость склада считается как сумма price * stock_quantity.
+    """
+    in_stock = Q(stock_quantity__gt=0)
+    rows = (
+        Assortment.objects
+        .values('category', 'clothes_type_id', 'clothes_type__name')
+        .annotate(
+            total_items=Count('id'),
+            in_stock=Count('id', filter=in_stock),
+            out_of_stock=Count('id', filter=~in_stock),
+            low_stock=Count('id', filter=in_stock & Q(stock_quantity__lte=threshold)),
+            total_units=Sum('stock_quantity', filter=in_stock),
+            total_value=Sum(
+                F('price') * F('stock_quantity'),
+                filter=in_stock,
+                output_field=DecimalField(max_digits=16, decimal_places=2),
+            ),
+        )
+        .order_by()
+    )
+
+    category_names = dict(Assortment.CATEGORIES)
+    totals = _empty_stock_totals()
+    by_category = {}
+    by_type = {}
+    for row in rows:
+        _add_stock_totals(totals, row)
+
+        category = by_category.setdefault(row['category'], {
+            'category': row['category'],
+            'name': category_names.get(row['category'], row['category']),
+            **_empty_stock_totals(),
+        })
+        _add_stock_totals(category, row)
+
+        clothes_type = by_type.setdefault(row['clothes_type_id'], {
+            'clothes_type_id': row['clothes_type_id'],
+            'name': row['clothes_type__name'],
+            **_empty_stock_totals(),
+        })
+        _add_stock_totals(clothes_type, row)
+
+    return {
+        **totals,
+        'low_stock_threshold': threshold,
+        'by_category': sorted(by_category.values(), key=lambda item: -item['total_value']),
+        'by_type': sorted(by_type.values(), key=lambda item: -item['total_value']),
+    }
+
+
+# ============================================================================
+# ТОП ТОВАРОВ
+# ============================================================================
+
+# Окна рейтинга (в днях) и метрики сортировки
+TOP_PRODUCT_WINDOWS = (7, 30, 365)
+TOP_PRODUCT_METRICS = ('units', 'revenue')
+
+
+def parse_top_products_params(params):
+    """Окно и метрика рейтинга из ?window= и ?metric="""
+    window = _parse_int(params.get('window'), 30)
+    if window not in TOP_PRODUCT_WINDOWS:
+        window = 30
+    metric = params.get('metric', 'units')
+    if metric not in TOP_PRODUCT_METRICS:
+        metric = 'units'
+    return window, metric
+
+
+@cached_analytics('top_products', depends_on=[Order, OrderItem, Assortment, ClothesType])
+def top_products(window=30, metric='units', limit=10):
+    """
+    Самые продаваемые товары за последние window дней.
+
+    Рейтинг строится по ProductSalesDaily (не больше window строк на товар),
+    а товары подгружаются из SQLite одним in_bulk.
+    """
+    since = timezone.localdate() - timedelta(days=window - 1)
+    if metric == 'revenue':
+        ordering = ['-total_revenue', '-total_units', 'assortment_id']
+    else:
+        ordering = ['-total_units', '-total_revenue', 'assortment_id']
+    rows = list(
+        ProductSalesDaily.objects
+        .filter(day__gte=since)
+        .values('assortment_id')
+        .annotate(total_units=Sum('units'), total_revenue=Sum('revenue'))
+        .filter(total_units__gt=0)
+        .order_by(*ordering)[:limit]
+    )
+    products = Assortment.objects.select_related('clothes_type').in_bulk(
+        [row['assortment_id'] for row in rows]
+    )
+    return [
+        {
+            'rank': rank,
+            'assortment_id': row['assortment_id'],
+            'product': products.get(row['assortment_id']),
+            'units': row['total_units'],
+            'revenue': row['total_revenue'],
+        }
+        for rank, row in enumerate(rows, start=1)
+    ]
+
+
+# ============================================================================
+# ЭФФЕКТИВНОСТЬ ПРОДАВЦОВ
+# ============================================================================
+
+# Периоды отчёта в днях (0 - за всё время)
+SELLER_PERFORMANCE_PERIODS = (30, 90, 365, 0)
+
+
+class DaysBetween(Func):
+    """Количество дней между двумя датами (date - date в PostgreSQL)"""
+    arg_joiner = ' - '
+    template = '(%(expressions)s)'
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(',
+            **extra_context
+        )
+
+
+class Median(Aggregate):
+    """Медиана через PERCENTILE_CONT (только PostgreSQL)"""
+    function = 'PERCENTILE_CONT'
+    name = 'Median'
+    template = '%(function)s(0.5) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+
+def parse_seller_period(params):
+    """Период отчёта по продавцам из ?days="""
+    try:
+        days = int(params.get('days', 30))
+    except (TypeError, ValueError):
+        return 30
+    return days if days in SELLER_PERFORMANCE_PERIODS else 30
+
+
+@cached_analytics('seller_performance', depends_on=[Seller, Order])
+def seller_performance(days=30):
+    """Метрики продавцов за последние days дней (0 - за всё время) одним запросом к PostgreSQL"""
+    period = Q()
+    if days:
+        period = Q(orders__order_date__gte=timezone.localdate() - timedelta(days=days - 1))
+    completed = period & ~Q(orders__status='cancelled')
+    delivered = completed & Q(orders__delivery_date__isnull=False)
+
+    aggregates = {
+        'order_count': Count('orders', filter=period),
+        'completed_count': Count('orders', filter=completed),
+        'cancelled_count': Count('orders', filter=period & Q(orders__status='cancelled')),
+        'gross_revenue': Sum('orders__total_amount', filter=completed),
+        'net_revenue': Sum(
+            F('orders__total_amount') * (100 - F('orders__discount_percent')) * Value(Decimal('0.01')),
+            filter=completed,
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        ),
+    }
+    # Медиана считается только в PostgreSQL, где живут заказы
+    if connections[router.db_for_read(Seller)].vendor == 'postgresql':
+        aggregates['median_delivery_days'] = Median(
+            DaysBetween('orders__delivery_date', 'orders__order_date'), filter=delivered
+        )
+
+    rows = (
+        Seller.objects
+        .values('id', 'first_name', 'last_name', 'email')
+        .annotate(**aggregates)
+        .order_by(F('net_revenue').desc(nulls_last=True), 'last_name', 'first_name')
+    )
+
+    result = []
+    for row in rows:
+        net_revenue = row['net_revenue'] or 0
+        result.append({
+            'seller_id': row['id'],
+            'full_name': f"{row['last_name']} {row['first_name']}",
+            'email': row['email'],
+            'order_count': row['order_count'],
+            'cancelled_count': row['cancelled_count'],
+            'gross_revenue': row['gross_revenue'] or 0,
+            'net_revenue': net_revenue,
+            'average_order_value': (
+                net_revenue / row['completed_count'] if row['completed_count'] else 0
+            ),
+            'cancellation_rate': (
+                row['cancelled_count'] * 100 / row['order_count'] if row['order_count'] else 0
+            ),
+            'median_delivery_days': row.get('median_delivery_days'),
+        })
+    return result
+
+
+# ============================================================================
+# ПРОДАЖИ ПО ТИПАМ ОДЕЖДЫ
+# ============================================================================
+
+def _share_rows(groups, total_revenue):
+    """Группы продаж по убыванию выручки с долей от общей выручки в процентах"""
+    rows = sorted(groups.values(), key=lambda row: (-row['revenue'], row['name']))
+    for row in rows:
+        row['share'] = row['revenue'] * 100 / total_revenue if total_revenue else 0
+    return rows
+
+
+@cached_analytics('sales_by_type', depends_on=[Order, OrderItem, Assortment, ClothesType])
+def sales_by_type(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Продажи (единицы и выручка) по типам одежды и категориям.
+
+    Позиции неотменённых заказов группируются по assortment_id в PostgreSQL
+    и читаются пачками, а тип и категория товара берутся из кэшированной
+    карты каталога SQLite. Итого два запроса при любом размере каталога.
+    """
+    item_sales = (
+        OrderItem.objects
+        .exclude(order__status='cancelled')
+        .values('assortment_id')
+        .annotate(units=Sum('quantity'), revenue=Sum(LINE_REVENUE))
+        .order_by()
+    )
+    categories = dict(Assortment.CATEGORIES)
+    by_type = {}
+    by_category = {}
+    total_units = 0
+    total_revenue = Decimal('0')
+    for row, product in join_batches(iter_batches(item_sales, batch_size), 'assortment_id'):
+        if product is None:
+            # Товар удалён из каталога, но продажи по нему остаются
+            type_key, type_name, category = None, 'Неизвестный тип', None
+        else:
+            type_key, type_name, category = product
+        units = row['units'] or 0
+        revenue = row['revenue'] or Decimal('0')
+        for groups, key, name in (
+            (by_type, type_key, type_name),
+            (by_category, category, categories.get(category, 'Без категории')),
+        ):
+            group = groups.setdefault(key, {
+                'key': key, 'name': name, 'products': 0, 'units': 0, 'revenue': Decimal('0'),
+            })
+            group['products'] += 1
+            group['units'] += units
+            group['revenue'] += revenue
+        total_units += units
+        total_revenue += revenue
+
+    return {
+        'type_stats': _share_rows(by_type, total_revenue),
+        'category_stats': _share_rows(by_category, total_revenue),
+        'total_units': total_units,
+        'total_revenue': total_revenue,
+    }
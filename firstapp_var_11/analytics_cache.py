@@ -0,0 +1,156 @@
+"""
+Кэш результатов аналитики с версиями таблиц.
+
+У каждой модели, от которой зависят отчёты, есть счётчик версии в таблице
+TableVersion. Сигналы post_save/post_delete увеличивают его после фиксации
+транзакции, а ключ результата включает версии всех его таблиц. Поэтому
+после изменения данных старый результат просто перестаёт находиться, и
+очищать кэш вручную не нужно. Счётчики лежат в базе, а не в кэше: кэш по
+умолчанию (LocMemCache) у каждого процесса свой, и изменения, сделанные
+другим рабочим процессом или командой управления, иначе не были бы видны.
+
+Изменения через QuerySet.update(), bulk_create() и сырой SQL сигналов
+не вызывают; после них нужно вызвать bump_version() самостоятельно.
+"""
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .models import (
+    Assortment, AssortmentSize, Buyer, ClothesType, DeliveryMethod, Order, OrderItem, Purchase,
+    Seller, Size, TableVersion,
+)
+
+
+# Модели, изменения которых сбрасывают кэш зависящих от них отчётов
+# (и ETag ответов API каталога)
+VERSIONED_MODELS = (
+    Assortment, AssortmentSize, Buyer, ClothesType, DeliveryMethod, Order, OrderItem, Purchase,
+    Seller, Size,
+)
+
+# Время жизни результата (секунды)
+DEFAULT_ANALYTICS_CACHE_TIMEOUT = 3600
+
+# Зарегистрированные отчёты: имя -> модели, от которых он зависит
+_registry = {}
+
+_MISSING = object()
+
+
+def _version_label(model):
+    return model._meta.label_lower
+
+
+def _stats_key(name, kind):
+    return f'analytics:stats:{name}:{kind}'
+
+
+def _initial_version():
+    # Начальная версия зависит от времени: если таблицу версий пересоздали,
+    # а общий кэш остался, новая версия не совпадёт ни с одной из прежних
+    return time.time_ns() // 1000
+
+
+def table_versions(models):
+    """Текущие версии таблиц одним запросом к базе"""
+    labels = [_version_label(model) for model in models]
+    versions = dict(TableVersion.objects.filter(label__in=labels).values_list('label', 'version'))
+    missing = [label for label in labels if label not in versions]
+    if missing:
+        # Строку мог одновременно создать другой процесс - тогда берём его версию
+        TableVersion.objects.bulk_create(
+            [TableVersion(label=label, version=_initial_version()) for label in missing],
+            ignore_conflicts=True,
+        )
+        versions.update(TableVersion.objects.filter(label__in=missing).values_list('label', 'version'))
+    return [versions[label] for label in labels]
+
+
+def bump_version(model):
+    """Увеличить версию таблицы, сделав устаревшими все зависящие от неё результаты"""
+    label = _version_label(model)
+    if not TableVersion.objects.filter(label=label).update(version=F('version') + 1):
+        TableVersion.objects.bulk_create(
+            [TableVersion(label=label, version=_initial_version())], ignore_conflicts=True,
+        )
+
+
+def _count(name, kind):
+    key = _stats_key(name, kind)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def _result_key(name, models, args, kwargs):
+    # Дата входит в ключ, потому что многие отчёты считают окно от сегодняшнего дня
+    params = repr((args, sorted(kwargs.items()), timezone.localdate()))
+    digest = hashlib.md5(params.encode('utf-8')).hexdigest()
+    versions = '.'.join(str(version) for version in table_versions(models))
+    return f'analytics:result:{name}:{digest}:{versions}'
+
+
+def cached_analytics(name, depends_on):
+    """
+    Декоратор: кэшировать результат функции аналитики.
+
+    depends_on - модели, изменение которых должно сбрасывать результат.
+    Некэшированная функция остаётся доступной как func.uncached.
+    """
+    depends_on = tuple(depends_on)
+
+    def decorator(func):
+        _registry[name] = depends_on
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = _result_key(name, depends_on, args, kwargs)
+            result = cache.get(key, _MISSING)
+            if result is not _MISSING:
+                _count(name, 'hits')
+                return result
+            _count(name, 'misses')
+            result = func(*args, **kwargs)
+            timeout = getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', DEFAULT_ANALYTICS_CACHE_TIMEOUT)
+            cache.set(key, result, timeout)
+            return result
+
+        wrapper.uncached = func
+        return wrapper
+
+    return decorator
+
+
+def cache_stats():
+    """Попадания и промахи по каждому зарегистрированному отчёту"""
+    keys = [
+        _stats_key(name, kind) for name in _registry for kind in ('hits', 'misses')
+    ]
+    counters = cache.get_many(keys)
+    stats = []
+    for name, models in sorted(_registry.items()):
+        hits = counters.get(_stats_key(name, 'hits'), 0)
+        misses = counters.get(_stats_key(name, 'misses'), 0)
+        stats.append({
+            'name': name,
+            'depends_on': [model._meta.label for model in models],
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits * 100 / (hits + misses) if hits + misses else 0,
+        })
+    return stats
+
+
+def reset_cache_stats():
+    """Обнулить счётчики попаданий и промахов"""
+    cache.delete_many([
+        _stats_key(name, kind) for name in _registry for kind in ('hits', 'misses')
+    ])
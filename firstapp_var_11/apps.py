@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class FirstappVar11Config(AppConfig):
     name = 'firstapp_var_11'
+
+    def ready(self):
+        # Регистрация обработчиков сигналов
+        from . import signals  # noqa: F401
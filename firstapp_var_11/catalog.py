@@ -0,0 +1,148 @@
+"""
+Запросы каталога (список ассортимента).
+
+Список строится одним запросом: тип одежды подтягивается JOIN,
+а сводка наличия по размерам считается агрегатами по AssortmentSize
+в том же запросе. Фильтр по размеру оформлен через EXISTS, чтобы
+не размножать строки товара.
+
+Полнотекстовый поиск (search_catalog) добавляет к тому же запросу
+JOIN с поисковым индексом, поэтому работает вместе со всеми фильтрами.
+"""
+from django.db.models import Aggregate, CharField, Count, Exists, OuterRef, Q, Sum
+
+from .models import Assortment, AssortmentSize
+from .search import SearchRank, search_terms
+
+
+# Допустимые сортировки каталога; id в конце делает порядок однозначным
+CATALOG_SORTS = {
+    'name': ['name', 'id'],
+    'price': ['price', 'id'],
+    '-price': ['-price', 'id'],
+    '-created_at': ['-created_at', '-id'],
+}
+
+# Ценовые диапазоны (фасет «цена»): ключ, подпись, цена от (включительно), до
+PRICE_BUCKETS = [
+    ('0-1000', 'до 1 000 руб.', None, 1000),
+    ('1000-3000', '1 000 - 3 000 руб.', 1000, 3000),
+    ('3000-5000', '3 000 - 5 000 руб.', 3000, 5000),
+    ('5000-10000', '5 000 - 10 000 руб.', 5000, 10000),
+    ('10000-', 'от 10 000 руб.', 10000, None),
+]
+PRICE_BUCKET_BOUNDS = {key: (low, high) for key, _, low, high in PRICE_BUCKETS}
+
+
+# Разделитель в списке размеров из GroupConcat
+SIZE_SEPARATOR = ', '
+
+
+class GroupConcat(Aggregate):
+    """Склейка строк группы через разделитель (GROUP_CONCAT / STRING_AGG)"""
+    function = 'GROUP_CONCAT'
+    name = 'GroupConcat'
+    template = "%(function)s(%(expressions)s, '" + SIZE_SEPARATOR + "')"
+    output_field = CharField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='STRING_AGG', **extra_context)
+
+
+def _size_summary():
+    """Агрегаты наличия по размерам для строки товара"""
+    in_stock = Q(assortmentsize__quantity__gt=0)
+    return {
+        'sizes_total': Count('assortmentsize'),
+        'sizes_in_stock': Count('assortmentsize', filter=in_stock),
+        'sized_quantity': Sum('assortmentsize__quantity'),
+        'in_stock_sizes': GroupConcat('assortmentsize__size__size_value', filter=in_stock),
+    }
+
+
+def filter_catalog(queryset, filters):
+    """Применить к queryset товаров фильтры формы AssortmentFilterForm"""
+    if filters.get('category'):
+        queryset = queryset.filter(category=filters['category'])
+    if filters.get('clothes_type'):
+        queryset = queryset.filter(clothes_type=filters['clothes_type'])
+    if filters.get('min_price') is not None:
+        queryset = queryset.filter(price__gte=filters['min_price'])
+    if filters.get('max_price') is not None:
+        queryset = queryset.filter(price__lte=filters['max_price'])
+    if filters.get('price_range') in PRICE_BUCKET_BOUNDS:
+        low, high = PRICE_BUCKET_BOUNDS[filters['price_range']]
+        if low is not None:
+            queryset = queryset.filter(price__gte=low)
+        if high is not None:
+            queryset = queryset.filter(price__lt=high)
+    if filters.get('size'):
+        queryset = queryset.filter(Exists(
+            AssortmentSize.objects.filter(
+                assortment=OuterRef('pk'), size=filters['size'], quantity__gt=0
+            )
+        ))
+    if filters.get('size_values'):
+        queryset = queryset.filter(Exists(
+            AssortmentSize.objects.filter(
+                assortment=OuterRef('pk'), size__size_value__in=filters['size_values'], quantity__gt=0
+            )
+        ))
+    return queryset
+
+
+def catalog_queryset(filters=None):
+    """
+    Товары каталога с типом одежды и сводкой наличия по размерам.
+
+    filters - cleaned_data формы AssortmentFilterForm. Каждая строка
+    получает sizes_total (размеров заведено), sizes_in_stock (из них
+    в наличии), sized_quantity (штук по всем размерам) и in_stock_sizes
+    (размеры в наличии через запятую).
+    """
+    filters = filters or {}
+    queryset = Assortment.objects.select_related('clothes_type').annotate(**_size_summary())
+    queryset = filter_catalog(queryset, filters)
+    return queryset.order_by(*CATALOG_SORTS.get(filters.get('sort'), CATALOG_SORTS['name']))
+
+
+def search_catalog(text, filters=None):
+    """
+    Полнотекстовый поиск по каталогу с фильтрами AssortmentFilterForm.
+
+    Ищутся товары, в названии, типе или описании которых есть все слова
+    text (по префиксу). Каждая строка получает rank; без выбранной
+    в filters сортировки результаты идут по убыванию релевантности.
+    Если слов в text нет, возвращается отфильтрованный каталог.
+
+    Сводки по размерам здесь нет: группировка всех найденных строк ради
+    одной страницы слишком дорога, её добавляет attach_size_summary().
+    """
+    filters = filters or {}
+    queryset = filter_catalog(Assortment.objects.select_related('clothes_type'), filters)
+    ordering = CATALOG_SORTS.get(filters.get('sort'))
+    if search_terms(text):
+        queryset = (
+            queryset
+            .filter(search_entry__document__matches=text)
+            .annotate(rank=SearchRank('search_entry__document', text))
+        )
+        ordering = ordering or ['-rank', 'id']
+    return queryset.order_by(*(ordering or CATALOG_SORTS['name']))
+
+
+def attach_size_summary(items):
+    """Добавить товарам (например, странице поиска) сводку наличия по размерам одним запросом"""
+    items = list(items)
+    summary = {
+        row['id']: row
+        for row in Assortment.objects.filter(pk__in=[item.pk for item in items])
+        .values('id').annotate(**_size_summary()).order_by()
+    }
+    for item in items:
+        row = summary.get(item.pk, {})
+        item.sizes_total = row.get('sizes_total', 0)
+        item.sizes_in_stock = row.get('sizes_in_stock', 0)
+        item.sized_quantity = row.get('sized_quantity')
+        item.in_stock_sizes = row.get('in_stock_sizes')
+    return items
@@ -0,0 +1,126 @@
+"""
+Объединение данных из разных баз без JOIN на стороне ORM.
+
+Заказы и их позиции хранятся в PostgreSQL, а каталог (Assortment,
+ClothesType) - в SQLite, поэтому связать их одним запросом нельзя.
+Вместо этого сторона PostgreSQL заранее группируется по assortment_id
+и читается пачками, а каталог превращается в небольшой словарь
+assortment_id -> (тип, категория), который хранится в кэше под версиями
+таблиц Assortment и ClothesType.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+
+from .analytics_cache import table_versions
+from .models import Assortment, ClothesType
+
+
+# Ключ и время жизни (секунды) кэша карты каталога
+ASSORTMENT_MAP_CACHE_KEY = 'crossdb:assortment_map'
+DEFAULT_ASSORTMENT_MAP_TIMEOUT = 300
+
+# Размер пачки при потоковом чтении сгруппированных строк
+DEFAULT_BATCH_SIZE = 2000
+
+
+def iter_batches(queryset, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Читать queryset пачками по batch_size строк.
+
+    Используется iterator(), поэтому в PostgreSQL строки идут через
+    серверный курсор и весь результат не держится в памяти.
+    """
+    batch = []
+    for row in queryset.iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _load_assortment_map(ids=None):
+    """Строки каталога: assortment_id -> (id типа, название типа, категория)"""
+    rows = Assortment.objects.values_list('id', 'clothes_type_id', 'clothes_type__name', 'category')
+    if ids is not None:
+        rows = rows.filter(id__in=ids)
+    return {row[0]: row[1:] for row in rows}
+
+
+def assortment_map(missing=()):
+    """
+    Кэшированная карта assortment_id -> (id типа, название типа, категория).
+
+    Если в карте нет каких-то из missing (товар добавлен после заполнения
+    кэша), они догружаются одним запросом и кэш обновляется.
+    """
+    timeout = getattr(settings, 'ASSORTMENT_MAP_CACHE_TIMEOUT', DEFAULT_ASSORTMENT_MAP_TIMEOUT)
+    versions = '.'.join(str(version) for version in table_versions([Assortment, ClothesType]))
+    cache_key = f'{ASSORTMENT_MAP_CACHE_KEY}:{versions}'
+    mapping = cache.get(cache_key)
+    if mapping is None:
+        mapping = _load_assortment_map()
+        cache.set(cache_key, mapping, timeout)
+        return mapping
+    unknown = [pk for pk in missing if pk not in mapping]
+    if unknown:
+        mapping.update(_load_assortment_map(unknown))
+        cache.set(cache_key, mapping, timeout)
+    return mapping
+
+
+def join_batches(batches, key, mapping=None):
+    """
+    Сопоставить пачки строк со строками каталога по полю key.
+
+    Выдаёт пары (строка, запись каталога или None, если товара нет).
+    Карта каталога берётся из кэша один раз и догружается только
+    для ещё не известных ей идентификаторов.
+    """
+    checked = set()
+    for batch in batches:
+        ids = {row[key] for row in batch} - checked
+        if mapping is None or not ids.issubset(mapping):
+            mapping = assortment_map(ids)
+        # Удалённые товары не ищем повторно в следующих пачках
+        checked.update(ids)
+        for row in batch:
+            yield row, mapping.get(row[key])
+
+
+def prefetch_crossdb(instances, *field_names):
+    """
+    Подгрузить объекты по внешним ключам, ведущим в другую базу.
+
+    select_related не может сделать JOIN между PostgreSQL и SQLite, а обычное
+    обращение order.buyer выполняет отдельный запрос на каждую строку.
+    Здесь идентификаторы собираются со всех instances, каждая связанная
+    модель читается одним in_bulk из базы, которую выбирает маршрутизатор,
+    и объекты кладутся в кэш поля. Возвращает instances в виде списка.
+
+    Имя вида 'order__buyer' подгружает связь у уже загруженных объектов
+    (например, через select_related('order')).
+    """
+    instances = list(instances)
+    if not instances:
+        return instances
+    opts = instances[0]._meta
+    for name in field_names:
+        head, _, rest = name.partition('__')
+        if rest:
+            related = [getattr(obj, head) for obj in instances]
+            prefetch_crossdb([obj for obj in related if obj is not None], rest)
+            continue
+        field = opts.get_field(name)
+        model = field.related_model
+        ids = {getattr(obj, field.attname) for obj in instances} - {None}
+        related = model._default_manager.using(router.db_for_read(model)).in_bulk(ids) if ids else {}
+        for obj in instances:
+            value = getattr(obj, field.attname)
+            if value is None:
+                field.set_cached_value(obj, None)
+            elif value in related:
+                field.set_cached_value(obj, related[value])
+    return instances
@@ -1,56 +1,49 @@
+from . import tracing
+
+
 class PostgresRouter:
     """Маршрутизатор для моделей PostgreSQL"""
 
+    # Модели для PostgreSQL (задачи 2.4 и 3, агрегаты по заказам)
+    postgres_models = [
+        'seller', 'sellerprofile', 'deliverymethod', 'buyerprofile', 'order', 'orderitem',
+        'productsalesdaily', 'ordernumbercounter',
+    ]
+
     def db_for_read(self, model, **hints):
-        # #region agent log
-        import json
-        log_path = r'c:\Users\kiril\PycharmProjects\PythonProject_Kursovaya\.cursor\debug.log'
-        try:
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({'location': 'database_routers.py:5', 'message': 'db_for_read called', 'data': {'hypothesisId': 'B', 'model_name': model._meta.model_name}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-        except: pass
-        # #endregion
-        
-        # Модели для PostgreSQL (задачи 2.4 и 3)
-        postgres_models = ['seller', 'sellerprofile', 'deliverymethod', 'buyerprofile', 'order', 'orderitem']
-        if model._meta.model_name.lower() in postgres_models:
-            # #region agent log
-            try:
-                with open(log_path, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps({'location': 'database_routers.py:7', 'message': 'Routing to postgres', 'data': {'hypothesisId': 'B', 'model_name': model._meta.model_name}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-            except: pass
-            # #endregion
-            return 'postgres'
-        return None
+        # База задаётся явно: иначе Django взял бы базу объекта из подсказки
+        # instance, и связь между базами (OrderItem.assortment) проверялась бы не там
+        db = 'postgres' if model._meta.model_name.lower() in self.postgres_models else 'default'
+        tracing.event('router.db_for_read', model=model._meta.model_name, db=db)
+        return db
 
     def db_for_write(self, model, **hints):
-        # #region agent log
-        import json
-        log_path = r'c:\Users\kiril\PycharmProjects\PythonProject_Kursovaya\.cursor\debug.log'
-        try:
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({'location': 'database_routers.py:10', 'message': 'db_for_write called', 'data': {'hypothesisId': 'B', 'model_name': model._meta.model_name}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-        except: pass
-        # #endregion
-        
-        # Модели для PostgreSQL (задачи 2.4 и 3)
-        postgres_models = ['seller', 'sellerprofile', 'deliverymethod', 'buyerprofile', 'order', 'orderitem']
-        if model._meta.model_name.lower() in postgres_models:
-            return 'postgres'
-        return None
+        db = 'postgres' if model._meta.model_name.lower() in self.postgres_models else 'default'
+        tracing.event('router.db_for_write', model=model._meta.model_name, db=db)
+        return db
 
     def allow_relation(self, obj1, obj2, **hints):
         # Разрешаем связи между моделями одной БД
-        postgres_models = ['seller', 'sellerprofile', 'deliverymethod', 'buyerprofile', 'order', 'orderitem']
-        db1 = 'postgres' if obj1._meta.model_name.lower() in postgres_models else 'default'
-        db2 = 'postgres' if obj2._meta.model_name.lower() in postgres_models else 'default'
-        return db1 == db2
+        db1 = 'postgres' if obj1._meta.model_name.lower() in self.postgres_models else 'default'
+        db2 = 'postgres' if obj2._meta.model_name.lower() in self.postgres_models else 'default'
+        if db1 == db2:
+            return True
+        # и связи между базами, объявленные внешним ключом без ограничения
+        # в БД (db_constraint=False): Order.buyer, OrderItem.assortment и т.п.
+        return self._crossdb_fk(obj1, obj2) or self._crossdb_fk(obj2, obj1)
+
+    @staticmethod
+    def _crossdb_fk(obj, target):
+        target_model = target._meta.concrete_model
+        return any(
+            field.many_to_one and not field.db_constraint and field.related_model is target_model
+            for field in obj._meta.concrete_model._meta.concrete_fields
+        )
 
     def allow_migrate(self, db, app_label, model_name=None, **hints):
-        postgres_models = ['seller', 'sellerprofile', 'deliverymethod', 'buyerprofile', 'order', 'orderitem']
-        if model_name and model_name.lower() in postgres_models:
+        if model_name and model_name.lower() in self.postgres_models:
             return db == 'postgres'
         # Для остальных моделей используем SQLite
         if db == 'postgres':
-            return model_name and model_name.lower() in postgres_models
+            return model_name and model_name.lower() in self.postgres_models
         return db == 'default'
\ No newline at end of file
@@ -0,0 +1,416 @@
+"""
+Фасетный индекс каталога в памяти процесса.
+
+Для каждого значения фасета (категория, тип одежды, размер в наличии,
+ценовой диапазон) хранится битовая маска по id товаров - обычное целое
+Python, где бит N означает товар с id = N. Количество товаров в наличии
+при любом сочетании фильтров - пересечение масок (&) и подсчёт единиц
+(int.bit_count), без обращения к базе.
+
+Индекс строится двумя запросами при старте процесса (warm_up() из
+wsgi.py/asgi.py; AppConfig.ready к базе обращаться не должен), а если
+это не удалось - при первом обращении. Дальше он обновляется точечно по
+сигналам сохранения и удаления товаров и их размеров. Другие процессы
+узнают об изменениях по версиям таблиц в базе (см. analytics_cache) и
+перестраивают свой индекс в фоне; на случай пропущенных изменений
+(update(), сырой SQL) индекс перестраивается не реже раза в
+FACET_INDEX_MAX_AGE секунд.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Exists, F, IntegerField, OuterRef, Q, Value
+from django.db.models.functions import Cast, Round
+
+from .analytics_cache import table_versions
+from .catalog import PRICE_BUCKETS, PRICE_BUCKET_BOUNDS
+from .models import Assortment, AssortmentSize, ClothesType, Size
+
+
+# Фасеты в порядке вывода
+FACETS = ('category', 'clothes_type', 'size', 'price_range')
+FACET_TITLES = {
+    'category': 'Категория',
+    'clothes_type': 'Тип одежды',
+    'size': 'Размер в наличии',
+    'price_range': 'Цена',
+}
+
+# Таблицы, изменение которых должно попадать в индекс
+FACET_MODELS = (Assortment, AssortmentSize, ClothesType, Size)
+
+# Версии каких таблиц увеличивают сигналы при сохранении или удалении
+# модели (bump_stock_total_version и bump_analytics_version)
+OWN_VERSION_BUMPS = {
+    Assortment: (Assortment,),
+    AssortmentSize: (AssortmentSize, Assortment),
+    ClothesType: (ClothesType,),
+    Size: (Size,),
+}
+
+DEFAULT_FACET_INDEX_MAX_AGE = 300
+
+# Сколько масок произвольных диапазонов цены (цена от/до) держать готовыми
+PRICE_MASK_CACHE_SIZE = 32
+
+
+# Границы ценовых диапазонов в копейках для bisect: диапазон i - [BOUNDS[i-1], BOUNDS[i])
+_BUCKET_KEYS = [key for key, _, _, _ in PRICE_BUCKETS]
+_BUCKET_BOUNDS = [low * 100 for _, _, low, _ in PRICE_BUCKETS[1:]]
+
+# Цена в копейках целым числом прямо из базы, без Decimal на каждую строку
+PRICE_CENTS = Cast(Round(F('price') * Value(100)), IntegerField())
+
+
+def _bucket(cents):
+    return _BUCKET_KEYS[bisect_right(_BUCKET_BOUNDS, cents)]
+
+
+def _price_bounds(low, high):
+    """Диапазон [low, high] в рублях (None - без границы) -> (больше, не больше) в копейках"""
+    return -1 if low is None else int(low * 100) - 1, None if high is None else int(high * 100)
+
+
+def _price_in(price, bounds):
+    low, high = bounds
+    return price > low and (high is None or price <= high)
+
+
+def _mask_from_ids(ids):
+    """Битовая маска из набора id"""
+    if not ids:
+        return 0
+    bits = bytearray(max(ids) // 8 + 1)
+    for pk in ids:
+        bits[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def _in_stock_q():
+    """Товар в наличии: есть остаток на складе или размер с остатком"""
+    return Q(stock_quantity__gt=0) | Exists(
+        AssortmentSize.objects.filter(assortment=OuterRef('pk'), quantity__gt=0)
+    )
+
+
+class FacetIndex:
+    """Маски значений фасетов и товаров в наличии"""
+
+    def __init__(self, versions):
+        self.versions = versions
+        self.built_at = time.monotonic()
+        self.in_stock = 0
+        self.masks = {facet: defaultdict(int) for facet in FACETS}
+        # Цена в копейках по id товара (-1 - товара нет) для диапазонов «от/до»
+        self.prices = array('q')
+        self.labels = {
+            'category': dict(Assortment.CATEGORIES),
+            'clothes_type': dict(ClothesType.objects.values_list('id', 'name')),
+            'size': {size.pk: str(size) for size in Size.objects.all()},
+            'price_range': {key: label for key, label, _, _ in PRICE_BUCKETS},
+        }
+        self._price_masks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, versions):
+        index = cls(versions)
+        ids = defaultdict(lambda: defaultdict(list))
+        sized_in_stock = set()
+        sizes = AssortmentSize.objects.filter(quantity__gt=0).values_list('size_id', 'assortment_id')
+        for size_id, pk in sizes.order_by().iterator(chunk_size=5000):
+            ids['size'][size_id].append(pk)
+            sized_in_stock.add(pk)
+
+        in_stock = []
+        prices = {}
+        rows = Assortment.objects.values_list('id', 'category', 'clothes_type_id', PRICE_CENTS, 'stock_quantity')
+        for pk, category, type_id, cents, stock in rows.order_by().iterator(chunk_size=5000):
+            prices[pk] = cents
+            if stock <= 0 and pk not in sized_in_stock:
+                continue
+            in_stock.append(pk)
+            ids['category'][category].append(pk)
+            ids['clothes_type'][type_id].append(pk)
+            ids['price_range'][_bucket(cents)].append(pk)
+
+        index.in_stock = _mask_from_ids(in_stock)
+        for facet, values in ids.items():
+            for value, pks in values.items():
+                index.masks[facet][value] = _mask_from_ids(pks)
+        index.prices = array('q', [-1]) * (max(prices, default=0) + 1)
+        for pk, price in prices.items():
+            index.prices[pk] = price
+        return index
+
+    # ------------------------------------------------------------------
+    # Точечные обновления
+    # ------------------------------------------------------------------
+
+    def _clear(self, pk):
+        bit = 1 << pk
+        if not self.in_stock & bit:
+            return
+        self.in_stock &= ~bit
+        for masks in self.masks.values():
+            for value, mask in masks.items():
+                if mask & bit:
+                    masks[value] = mask & ~bit
+
+    def refresh_item(self, pk):
+        """Перечитать один товар из базы (после сохранения или удаления)"""
+        row = (
+            Assortment.objects.filter(pk=pk).annotate(available=_in_stock_q())
+            .values_list('category', 'clothes_type_id', PRICE_CENTS, 'available').first()
+        )
+        size_ids = list(
+            AssortmentSize.objects.filter(assortment_id=pk, quantity__gt=0).values_list('size_id', flat=True)
+        )
+        bit = 1 << pk
+        with self._lock:
+            self._clear(pk)
+            if pk >= len(self.prices):
+                self.prices.extend([-1] * (pk + 1 - len(self.prices)))
+            cents = -1 if row is None else row[2]
+            self.prices[pk] = cents
+            # В готовых масках цены меняется только бит этого товара
+            for key, mask in self._price_masks.items():
+                in_range = _price_in(cents, _price_bounds(*key))
+                self._price_masks[key] = mask | bit if in_range else mask & ~bit
+            if row is None:
+                return
+            category, type_id, cents, available = row
+            if not available:
+                return
+            self.in_stock |= bit
+            self.masks['category'][category] |= bit
+            self.masks['clothes_type'][type_id] |= bit
+            self.masks['price_range'][_bucket(cents)] |= bit
+            for size_id in size_ids:
+                self.masks['size'][size_id] |= bit
+
+    def set_label(self, facet, value, label):
+        self.labels[facet][value] = label
+
+    # ------------------------------------------------------------------
+    # Запросы
+    # ------------------------------------------------------------------
+
+    def _price_mask(self, low, high):
+        """Маска товаров с ценой в [low, high] (в рублях, None - без границы)"""
+        key = (low, high)
+        # Под блокировкой: иначе маска, посчитанная по ценам до refresh_item,
+        # могла бы попасть в кэш уже после его сброса
+        with self._lock:
+            mask = self._price_masks.get(key)
+            if mask is None:
+                bounds = _price_bounds(low, high)
+                mask = _mask_from_ids([pk for pk, price in enumerate(self.prices) if _price_in(price, bounds)])
+                if len(self._price_masks) >= PRICE_MASK_CACHE_SIZE:
+                    self._price_masks.clear()
+                self._price_masks[key] = mask
+        return mask
+
+    def _selected_masks(self, selection):
+        masks = {}
+        for facet, values in selection.items():
+            if values:
+                union = 0
+                for value in values:
+                    union |= self.masks[facet].get(value, 0)
+                masks[facet] = union
+        return masks
+
+    def counts(self, selection, min_price=None, max_price=None):
+        """
+        Количество товаров в наличии для выбранных значений фасетов.
+
+        selection - {фасет: набор значений}; значения одного фасета
+        объединяются (ИЛИ), разные фасеты пересекаются (И). Счётчики
+        фасета считаются без учёта выбора в нём самом, чтобы было видно,
+        сколько товаров даст переключение на другое значение.
+
+        Возвращает (всего товаров, {фасет: [(значение, подпись, количество)]}).
+        """
+        base = self.in_stock
+        if min_price is not None or max_price is not None:
+            base &= self._price_mask(min_price, max_price)
+        selected = self._selected_masks(selection)
+
+        total = base
+        for mask in selected.values():
+            total &= mask
+
+        facets = {}
+        for facet in FACETS:
+            scope = base
+            for other, mask in selected.items():
+                if other != facet:
+                    scope &= mask
+            labels = self.labels[facet]
+            facets[facet] = [
+                (value, labels.get(value, value), (scope & mask).bit_count())
+                for value, mask in list(self.masks[facet].items())
+                if mask
+            ]
+        return total.bit_count(), facets
+
+
+# ============================================================================
+# ИНДЕКС ПРОЦЕССА
+# ============================================================================
+
+_index = None
+_build_lock = threading.Lock()
+_rebuilding = False
+
+
+def _max_age():
+    return getattr(settings, 'FACET_INDEX_MAX_AGE', DEFAULT_FACET_INDEX_MAX_AGE)
+
+
+def _is_current(index, versions):
+    return (
+        index is not None
+        and index.versions == versions
+        and time.monotonic() - index.built_at < _max_age()
+    )
+
+
+def _rebuild(versions):
+    global _index, _rebuilding
+    try:
+        _index = FacetIndex.build(versions)
+    finally:
+        _rebuilding = False
+        # У потока свои соединения с базой, закрываем их
+        connections.close_all()
+
+
+def get_facet_index():
+    """
+    Индекс процесса. Первый раз строится сразу; если таблицы изменились
+    в другом процессе или индекс устарел, новый строится в фоновом потоке,
+    а до его готовности запросы получают прежний.
+    """
+    global _index, _rebuilding
+    versions = table_versions(FACET_MODELS)
+    index = _index
+    if _is_current(index, versions):
+        return index
+    with _build_lock:
+        if _index is None:
+            _index = FacetIndex.build(versions)
+            return _index
+        if not _rebuilding:
+            _rebuilding = True
+            threading.Thread(
+                target=_rebuild, args=(versions,), name='facet-index-rebuild', daemon=True
+            ).start()
+    return index
+
+
+def warm_up():
+    """
+    Построить индекс процесса при старте, чтобы первый запрос к каталогу
+    его не ждал. Если база ещё недоступна (или нет таблиц до migrate),
+    индекс построится при первом обращении.
+    """
+    global _index
+    with _build_lock:
+        if _index is not None:
+            return
+        try:
+            _index = FacetIndex.build(table_versions(FACET_MODELS))
+        except DatabaseError:
+            pass
+
+
+def _own_change_versions(index, sender):
+    """
+    Версии таблиц, которые были бы в базе, если после построения индекса
+    их меняли только сигналы этого процесса (версия растёт на 1 за
+    каждое сохранение или удаление sender).
+    """
+    versions = list(index.versions)
+    for model in OWN_VERSION_BUMPS[sender]:
+        versions[FACET_MODELS.index(model)] += 1
+    return versions
+
+
+def _track_own_change(index, sender, observed):
+    """
+    Запомнить в индексе версии после изменения, сделанного этим процессом.
+    observed прочитаны до обновления индекса: если они совпали с
+    ожидаемыми, других изменений не было и перестраивать индекс не нужно.
+    Иначе таблицы менял и другой процесс - версии индекса остаются
+    прежними, и следующий запрос перестроит его в фоне.
+    """
+    if observed == _own_change_versions(index, sender):
+        index.versions = observed
+
+
+def refresh_item(pk, sender=Assortment):
+    """Обновить товар в индексе процесса (если он уже построен)"""
+    index = _index
+    if index is not None:
+        observed = table_versions(FACET_MODELS)
+        index.refresh_item(pk)
+        _track_own_change(index, sender, observed)
+
+
+def set_label(facet, value, label):
+    index = _index
+    if index is not None:
+        observed = table_versions(FACET_MODELS)
+        index.set_label(facet, value, label)
+        _track_own_change(index, ClothesType if facet == 'clothes_type' else Size, observed)
+
+
+def _sorted_values(facet, rows):
+    """Значения фасета в порядке вывода"""
+    if facet == 'price_range':
+        order = {key: i for i, (key, _, _, _) in enumerate(PRICE_BUCKETS)}
+        return sorted(rows, key=lambda row: order.get(row[0], len(order)))
+    if facet == 'category':
+        order = {key: i for i, (key, _) in enumerate(Assortment.CATEGORIES)}
+        return sorted(rows, key=lambda row: order.get(row[0], len(order)))
+    return sorted(rows, key=lambda row: str(row[1]))
+
+
+def catalog_facets(filters=None):
+    """
+    Счётчики фасетов для фильтров формы AssortmentFilterForm.
+
+    Возвращает {'total': товаров в наличии, 'facets': [{'name', 'title',
+    'values': [{'value', 'label', 'count', 'selected'}]}]}.
+    """
+    filters = filters or {}
+    selection = {
+        'category': {filters['category']} if filters.get('category') else set(),
+        'clothes_type': {filters['clothes_type'].pk} if filters.get('clothes_type') else set(),
+        'size': {filters['size'].pk} if filters.get('size') else set(),
+        'price_range': {filters['price_range']} if filters.get('price_range') in PRICE_BUCKET_BOUNDS else set(),
+    }
+    total, facets = get_facet_index().counts(
+        selection, filters.get('min_price'), filters.get('max_price')
+    )
+    return {
+        'total': total,
+        'facets': [
+            {
+                'name': facet,
+                'title': FACET_TITLES[facet],
+                'values': [
+                    {'value': value, 'label': label, 'count': count, 'selected': value in selection[facet]}
+                    for value, label, count in _sorted_values(facet, facets[facet])
+                ],
+            }
+            for facet in FACETS
+        ],
+    }
@@ -1,4 +1,6 @@
 from django import forms
+from django.db.models import Q
+from .catalog import PRICE_BUCKETS
 from .models import *
 
 # Простая форма для добавления покупателя
@@ -109,6 +111,79 @@ class FilterForm(forms.Form):
     )
 
 
+# Фильтры и сортировка каталога (список ассортимента)
+class AssortmentFilterForm(forms.Form):
+    SORT_CHOICES = [
+        ('name', 'По названию'),
+        ('price', 'Сначала дешёвые'),
+        ('-price', 'Сначала дорогие'),
+        ('-created_at', 'Сначала новые'),
+    ]
+
+    category = forms.ChoiceField(
+        label='Категория',
+        choices=[('', 'Все категории')] + Assortment.CATEGORIES,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    clothes_type = forms.ModelChoiceField(
+        label='Тип одежды',
+        queryset=ClothesType.objects.all(),
+        empty_label='Все типы',
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    min_price = forms.DecimalField(
+        label='Цена от',
+        min_value=0,
+        required=False,
+        widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+    max_price = forms.DecimalField(
+        label='Цена до',
+        min_value=0,
+        required=False,
+        widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+    price_range = forms.ChoiceField(
+        label='Ценовой диапазон',
+        choices=[('', 'Любая цена')] + [(key, label) for key, label, _, _ in PRICE_BUCKETS],
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    size = forms.ModelChoiceField(
+        label='Размер в наличии',
+        queryset=Size.objects.all(),
+        empty_label='Любой размер',
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    sort = forms.ChoiceField(
+        label='Сортировка',
+        choices=SORT_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+
+
+class AssortmentSearchForm(AssortmentFilterForm):
+    """Полнотекстовый поиск с фильтрами каталога; пустая сортировка - по релевантности"""
+    field_order = ['name']
+
+    name = forms.CharField(
+        label='Поиск',
+        max_length=200,
+        required=False,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Название, тип или описание'})
+    )
+    sort = forms.ChoiceField(
+        label='Сортировка',
+        choices=[('', 'По релевантности')] + AssortmentFilterForm.SORT_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+
+
 # ============================================================================
 # ЗАДАЧА 3: ФОРМЫ ДЛЯ POSTGRESQL МОДЕЛЕЙ
 # ============================================================================
@@ -173,8 +248,8 @@ class OrderForm(forms.ModelForm):
     class Meta:
         model = Order
         fields = [
-            'buyer', 'seller', 'delivery_method', 'order_number', 'delivery_date', 
-            'delivery_time', 'status', 'total_amount', 'delivery_cost', 
+            'buyer', 'seller', 'delivery_method', 'delivery_date', 
+            'delivery_time', 'status', 'delivery_cost', 
             'discount_percent', 'delivery_address', 'contact_phone', 'notes',
             'invoice_file', 'delivery_confirmation_photo'
         ]
@@ -182,15 +257,9 @@ class OrderForm(forms.ModelForm):
             'buyer': forms.Select(attrs={'class': 'form-control'}),
             'seller': forms.Select(attrs={'class': 'form-control'}),
             'delivery_method': forms.Select(attrs={'class': 'form-control'}),
-            'order_number': forms.TextInput(attrs={
-                'class': 'form-control', 
-                'placeholder': 'ORD-YYYY-NNNNNN',
-                'pattern': 'ORD-\\d{4}-\\d{6}'
-            }),
             'delivery_date': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
             'delivery_time': forms.TimeInput(attrs={'type': 'time', 'class': 'form-control'}),
             'status': forms.Select(attrs={'class': 'form-control'}),
-            'total_amount': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'min': '0'}),
             'delivery_cost': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'min': '0'}),
             'discount_percent': forms.NumberInput(attrs={'class': 'form-control', 'min': '0', 'max': '100'}),
             'delivery_address': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
@@ -207,11 +276,9 @@ class OrderForm(forms.ModelForm):
             'buyer': 'Покупатель',
             'seller': 'Продавец',
             'delivery_method': 'Способ доставки',
-            'order_number': 'Номер заказа',
             'delivery_date': 'Дата доставки',
             'delivery_time': 'Время доставки',
             'status': 'Статус заказа',
-            'total_amount': 'Общая сумма заказа',
             'delivery_cost': 'Стоимость доставки',
             'discount_percent': 'Скидка (%)',
             'delivery_address': 'Адрес доставки',
@@ -228,14 +295,6 @@ class OrderForm(forms.ModelForm):
         self.fields['seller'].queryset = Seller.objects.all().order_by('last_name', 'first_name')
         self.fields['delivery_method'].queryset = DeliveryMethod.objects.filter(is_active=True)
 
-    def clean_order_number(self):
-        """Валидация номера заказа"""
-        order_number = self.cleaned_data.get('order_number')
-        import re
-        if not re.match(r'^ORD-\d{4}-\d{6}$', order_number):
-            raise forms.ValidationError('Номер заказа должен быть в формате ORD-YYYY-NNNNNN')
-        return order_number
-
     def clean_contact_phone(self):
         """Валидация телефона"""
         phone = self.cleaned_data.get('contact_phone')
@@ -290,7 +349,9 @@ class OrderItemForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Заполняем списки для выбора
-        self.fields['assortment'].queryset = Assortment.objects.filter(stock_quantity__gt=0).order_by('name')
+        # Товар изменяемой позиции остаётся в списке, даже если весь остаток в резерве
+        in_stock = Q(stock_quantity__gt=0) | Q(pk=self.instance.assortment_id)
+        self.fields['assortment'].queryset = Assortment.objects.filter(in_stock).order_by('name')
         self.fields['size'].queryset = Size.objects.all().order_by('size_value')
 
     def clean_quantity(self):
@@ -301,17 +362,11 @@ class OrderItemForm(forms.ModelForm):
         return quantity
 
     def clean(self):
-        """Валидация позиции заказа"""
+        """Товар с размерами резервируется по размеру, поэтому размер обязателен"""
         cleaned_data = super().clean()
         assortment = cleaned_data.get('assortment')
-        quantity = cleaned_data.get('quantity')
-        
-        if assortment and quantity:
-            if assortment.stock_quantity < quantity:
-                raise forms.ValidationError({
-                    'quantity': f'Недостаточно товара на складе. Доступно: {assortment.stock_quantity}'
-                })
-        
+        if assortment and not cleaned_data.get('size') and assortment.assortmentsize_set.exists():
+            self.add_error('size', 'Выберите размер: остаток этого товара ведётся по размерам')
         return cleaned_data
 
 
@@ -0,0 +1,380 @@
+"""
+Остатки на складе и резервирование товара под позиции заказов.
+
+Источник истины - остатки по размерам (AssortmentSize.quantity). Общий
+остаток товара с размерами (Assortment.stock_quantity) ведут триггеры
+базы: вставка, изменение и удаление строки размера прибавляют к нему
+разность, а первая строка размера заменяет прежний общий остаток.
+Триггеры срабатывают и при bulk_create, update() и сыром SQL. Товары
+без размеров (аксессуары) хранят остаток только в stock_quantity.
+
+Резерв - это один условный UPDATE: quantity = quantity - n WHERE
+quantity >= n по строке размера (или по stock_quantity у товара без
+размеров). Проверка и списание выполняются базой атомарно, блокировка
+строки держится только на время UPDATE, а не на время заполнения формы,
+поэтому параллельные оформления не могут продать больше, чем есть.
+
+Позиции заказов хранятся в PostgreSQL, а склад - в SQLite, общей
+транзакции у них нет. Поэтому товар резервируется до сохранения позиции
+(reserve_items), а сохранение идёт внутри release_on_rollback: если
+транзакция заказа откатилась, резерв возвращается. Позиция с резервом
+отмечается флагом OrderItem.reserved, и при удалении позиции или отмене
+заказа на склад возвращаются только такие позиции.
+
+Миграции SQLite, изменяющие таблицу размеров, пересоздают её и теряют
+триггеры; после них нужно выполнить manage.py rebuild_stock_totals.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.db import NotSupportedError, router, transaction
+from django.db.models import Exists, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from . import facets
+from .analytics_cache import bump_version
+from .models import Assortment, AssortmentSize, Order, OrderItem
+
+
+ASSORTMENT_TABLE = Assortment._meta.db_table
+SIZE_TABLE = AssortmentSize._meta.db_table
+
+# Резервы, сделанные внутри release_on_rollback: [(lines, release)]
+_journal = contextvars.ContextVar('inventory_journal', default=None)
+
+
+# ============================================================================
+# ТРИГГЕРЫ ОБЩЕГО ОСТАТКА
+# ============================================================================
+
+SQLITE_INSTALL = [
+    f"""CREATE TRIGGER IF NOT EXISTS assortmentsize_stock_insert
+        AFTER INSERT ON {SIZE_TABLE}
+    BEGIN
+        UPDATE {ASSORTMENT_TABLE} SET stock_quantity = CASE
+            WHEN EXISTS (
+                SELECT 1 FROM {SIZE_TABLE} WHERE assortment_id = new.assortment_id AND id <> new.id
+            ) THEN stock_quantity + new.quantity
+            ELSE new.quantity
+        END
+        WHERE id = new.assortment_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS assortmentsize_stock_update
+        AFTER UPDATE OF quantity, assortment_id ON {SIZE_TABLE}
+    BEGIN
+        UPDATE {ASSORTMENT_TABLE} SET stock_quantity = stock_quantity - old.quantity
+        WHERE id = old.assortment_id;
+        UPDATE {ASSORTMENT_TABLE} SET stock_quantity = stock_quantity + new.quantity
+        WHERE id = new.assortment_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS assortmentsize_stock_delete
+        AFTER DELETE ON {SIZE_TABLE}
+    BEGIN
+        UPDATE {ASSORTMENT_TABLE} SET stock_quantity = stock_quantity - old.quantity
+        WHERE id = old.assortment_id;
+    END""",
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS assortmentsize_stock_insert",
+    "DROP TRIGGER IF EXISTS assortmentsize_stock_update",
+    "DROP TRIGGER IF EXISTS assortmentsize_stock_delete",
+]
+
+POSTGRES_INSTALL = [
+    f"""CREATE OR REPLACE FUNCTION assortmentsize_stock_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE {ASSORTMENT_TABLE} SET stock_quantity = stock_quantity - OLD.quantity
+            WHERE id = OLD.assortment_id;
+        END IF;
+        IF TG_OP = 'INSERT' AND NOT EXISTS (
+            SELECT 1 FROM {SIZE_TABLE} WHERE assortment_id = NEW.assortment_id AND id <> NEW.id
+        ) THEN
+            UPDATE {ASSORTMENT_TABLE} SET stock_quantity = NEW.quantity WHERE id = NEW.assortment_id;
+        ELSIF TG_OP IN ('INSERT', 'UPDATE') THEN
+            UPDATE {ASSORTMENT_TABLE} SET stock_quantity = stock_quantity + NEW.quantity
+            WHERE id = NEW.assortment_id;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""",
+    f"DROP TRIGGER IF EXISTS assortmentsize_stock_sync ON {SIZE_TABLE}",
+    f"""CREATE TRIGGER assortmentsize_stock_sync
+        AFTER INSERT OR DELETE OR UPDATE OF quantity, assortment_id ON {SIZE_TABLE}
+        FOR EACH ROW EXECUTE FUNCTION assortmentsize_stock_sync()""",
+]
+
+POSTGRES_UNINSTALL = [
+    f"DROP TRIGGER IF EXISTS assortmentsize_stock_sync ON {SIZE_TABLE}",
+    "DROP FUNCTION IF EXISTS assortmentsize_stock_sync()",
+]
+
+
+def _statements(connection, sqlite, postgres):
+    if connection.vendor == 'sqlite':
+        return sqlite
+    if connection.vendor == 'postgresql':
+        return postgres
+    raise NotSupportedError(f'Триггеры остатков не поддерживаются для {connection.vendor}')
+
+
+def install_stock_triggers(connection):
+    """Создать триггеры общего остатка (повторный вызов безопасен)"""
+    with connection.cursor() as cursor:
+        for sql in _statements(connection, SQLITE_INSTALL, POSTGRES_INSTALL):
+            cursor.execute(sql)
+
+
+def uninstall_stock_triggers(connection):
+    with connection.cursor() as cursor:
+        for sql in _statements(connection, SQLITE_UNINSTALL, POSTGRES_UNINSTALL):
+            cursor.execute(sql)
+
+
+def _has_sizes():
+    return Exists(AssortmentSize.objects.filter(assortment=OuterRef('pk')))
+
+
+def recount_stock_totals(assortment_ids=None, using=None):
+    """
+    Пересчитать общий остаток товаров с размерами как сумму по размерам
+    одним UPDATE. Возвращает число обновлённых товаров.
+    """
+    sized_total = (
+        AssortmentSize.objects.filter(assortment=OuterRef('pk'))
+        .order_by().values('assortment').annotate(total=Sum('quantity')).values('total')
+    )
+    queryset = Assortment.objects.using(using or router.db_for_write(Assortment)).filter(_has_sizes())
+    if assortment_ids is not None:
+        queryset = queryset.filter(pk__in=assortment_ids)
+    return queryset.update(stock_quantity=Coalesce(Subquery(sized_total), 0))
+
+
+# ============================================================================
+# НАЛИЧИЕ
+# ============================================================================
+
+def availability(pairs):
+    """
+    Остатки для многих пар (товар, размер), например для корзины или
+    значков «есть в наличии» в каталоге.
+
+    Пары с размером проверяются одним запросом по уникальному индексу
+    (assortment_id, size_id), пары без размера (None) - одним запросом
+    общего остатка по первичному ключу. Возвращает {(товар, размер):
+    остаток}; для несуществующих пар остаток 0.
+    """
+    pairs = set(pairs)
+    result = dict.fromkeys(pairs, 0)
+    sized = {(pk, size_id) for pk, size_id in pairs if size_id is not None}
+    if sized:
+        rows = AssortmentSize.objects.filter(
+            assortment_id__in={pk for pk, _ in sized},
+            size_id__in={size_id for _, size_id in sized},
+        ).values_list('assortment_id', 'size_id', 'quantity')
+        for pk, size_id, quantity in rows:
+            if (pk, size_id) in result:
+                result[pk, size_id] = quantity
+    totals = {pk for pk, size_id in pairs if size_id is None}
+    if totals:
+        rows = Assortment.objects.filter(pk__in=totals).values_list('pk', 'stock_quantity')
+        for pk, quantity in rows:
+            result[pk, None] = quantity
+    return result
+
+
+# ============================================================================
+# РЕЗЕРВИРОВАНИЕ
+# ============================================================================
+
+class _Shortage(Exception):
+    """Внутренний сигнал отката: одной из строк не хватило остатка"""
+
+
+def item_line(item):
+    """Строка резерва позиции заказа: (товар, размер, количество)"""
+    return item.assortment_id, item.size_id, item.quantity
+
+
+def order_lines(order_id, reserved=None):
+    """Строки резерва позиций заказа (reserved - только с резервом или только без)"""
+    items = OrderItem.objects.filter(order_id=order_id)
+    if reserved is not None:
+        items = items.filter(reserved=reserved)
+    return list(items.values_list('assortment_id', 'size_id', 'quantity'))
+
+
+def _take(assortment_id, size_id, quantity):
+    """
+    Списать quantity штук, если их хватает; False - не хватает. Товар
+    с размерами списывается только по размеру (общий остаток меняет
+    триггер), без размера можно списать лишь товар без размеров.
+    """
+    if size_id is not None:
+        rows = AssortmentSize.objects.filter(
+            assortment_id=assortment_id, size_id=size_id, quantity__gte=quantity,
+        )
+        return bool(rows.update(quantity=F('quantity') - quantity))
+    rows = Assortment.objects.filter(
+        ~_has_sizes(), pk=assortment_id, stock_quantity__gte=quantity,
+    )
+    return bool(rows.update(stock_quantity=F('stock_quantity') - quantity))
+
+
+def _put_back(assortment_id, size_id, quantity):
+    if size_id is not None:
+        AssortmentSize.objects.filter(
+            assortment_id=assortment_id, size_id=size_id,
+        ).update(quantity=F('quantity') + quantity)
+        return
+    # Позиции без размера у товара, которому потом завели размеры, вернуть
+    # некуда: общий остаток такого товара - сумма по размерам
+    Assortment.objects.filter(~_has_sizes(), pk=assortment_id).update(
+        stock_quantity=F('stock_quantity') + quantity
+    )
+
+
+def _changed(assortment_ids):
+    """
+    update() не вызывает сигналов: после фиксации сами сбрасываем версии
+    таблиц (кэш аналитики, ETag API) и обновляем фасетный индекс
+    """
+    def callback():
+        bump_version(Assortment)
+        bump_version(AssortmentSize)
+        for pk in assortment_ids:
+            facets.refresh_item(pk)
+
+    transaction.on_commit(callback, using=router.db_for_write(Assortment))
+
+
+def reserve_lines(lines, release=()):
+    """
+    Зарезервировать товар по строкам lines, сначала вернув на склад
+    строки release (например, прежнее состояние изменяемой позиции).
+
+    Всё выполняется в одной транзакции: если хоть одной строке не
+    хватило остатка, ничего не меняется и возвращается False.
+    """
+    lines = [line for line in lines if line[2] > 0]
+    release = [line for line in release if line[2] > 0]
+    if not lines and not release:
+        return True
+    try:
+        with transaction.atomic(using=router.db_for_write(Assortment)):
+            for line in release:
+                _put_back(*line)
+            for line in lines:
+                if not _take(*line):
+                    raise _Shortage
+            _changed({line[0] for line in [*release, *lines]})
+    except _Shortage:
+        return False
+    return True
+
+
+def reserve(assortment_id, quantity, size_id=None):
+    """Зарезервировать quantity штук товара (и размера); False - не хватает на складе"""
+    return reserve_lines([(assortment_id, size_id, quantity)])
+
+
+def release_lines(lines):
+    """Вернуть на склад товар по строкам (отмена заказа, удаление позиции)"""
+    reserve_lines([], release=lines)
+
+
+def release(assortment_id, quantity, size_id=None):
+    release_lines([(assortment_id, size_id, quantity)])
+
+
+def _remember(lines, release=()):
+    """Записать резерв в журнал открытого release_on_rollback"""
+    journal = _journal.get()
+    if journal is not None:
+        journal.append((lines, release))
+
+
+def undo(lines, release=()):
+    """Вернуть склад к состоянию до reserve_lines(lines, release)"""
+    if not reserve_lines(release, release=lines):
+        # Возвращённый товар уже зарезервировали другие - снимаем хотя бы новый резерв
+        release_lines(lines)
+
+
+@contextmanager
+def release_on_rollback():
+    """
+    Отменить резервы (reserve_items, reserve_order), сделанные внутри
+    блока, если из него вышло исключение. Блок должен охватывать
+    transaction.atomic, в которой сохраняются заказ и позиции: склад
+    в другой базе и с ней не откатывается. Вложенный блок без ошибки
+    передаёт свои резервы внешнему.
+    """
+    outer = _journal.get()
+    journal = []
+    token = _journal.set(journal)
+    try:
+        yield
+    except BaseException:
+        for lines, release in reversed(journal):
+            undo(lines, release)
+        raise
+    finally:
+        _journal.reset(token)
+    if outer is not None:
+        outer.extend(journal)
+
+
+def reserve_items(items):
+    """
+    Зарезервировать товар под новые и изменённые позиции заказа до их
+    сохранения: прежний резерв позиций возвращается, новый берётся одной
+    транзакцией склада, флаг reserved ставится по статусу заказа. False -
+    товара не хватает, склад не меняется.
+    """
+    previous = list(
+        OrderItem.objects.filter(pk__in=[item.pk for item in items if item.pk], reserved=True)
+        .values_list('assortment_id', 'size_id', 'quantity')
+    )
+    reserves = {}
+    lines = []
+    for item in items:
+        if item.order_id not in reserves:
+            reserves[item.order_id] = order_reserves_stock(item.order_id)
+        item.reserved = reserves[item.order_id]
+        if item.reserved:
+            lines.append(item_line(item))
+    if not reserve_lines(lines, release=previous):
+        return False
+    _remember(lines, previous)
+    return True
+
+
+def reserve_order(order_id):
+    """
+    Зарезервировать все позиции заказа без резерва (возврат заказа
+    из отмены); False - товара не хватает, ничего не меняется
+    """
+    lines = order_lines(order_id, reserved=False)
+    if not reserve_lines(lines):
+        return False
+    _remember(lines)
+    OrderItem.objects.filter(order_id=order_id, reserved=False).update(reserved=True)
+    return True
+
+
+def release_order(order_id):
+    """
+    Снять резерв с позиций заказа (отмена заказа). Флаг снимается в текущей
+    транзакции, товар возвращается на склад после её фиксации.
+    """
+    lines = order_lines(order_id, reserved=True)
+    OrderItem.objects.filter(order_id=order_id, reserved=True).update(reserved=False)
+    transaction.on_commit(lambda: release_lines(lines), using=router.db_for_write(OrderItem))
+
+
+def order_reserves_stock(order_id):
+    """Держат ли позиции заказа товар: у отменённых заказов резерва нет"""
+    status = Order.objects.filter(pk=order_id).values_list('status', flat=True).first()
+    return status is not None and status != 'cancelled'
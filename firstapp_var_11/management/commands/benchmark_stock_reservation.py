@@ -0,0 +1,139 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections, router
+from django.db.models import Q
+
+from firstapp_var_11 import inventory
+from firstapp_var_11.analytics_cache import bump_version
+from firstapp_var_11.models import Assortment, AssortmentSize, ClothesType, Size
+
+
+BENCHMARK_NAME = "Бенчмарк резервирования"
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест резервирования товара: N потоков одновременно "
+        "резервируют один товар, затем проверяется, что продано не больше остатка"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8, help="Число потоков (по умолчанию 8)")
+        parser.add_argument("--attempts", type=int, default=2000, help="Всего попыток резерва (по умолчанию 2000)")
+        parser.add_argument("--stock", type=int, default=1000, help="Начальный остаток товара (по умолчанию 1000)")
+        parser.add_argument("--quantity", type=int, default=1, help="Штук в одном резерве (по умолчанию 1)")
+        parser.add_argument("--with-size", action="store_true", help="Резервировать ещё и остаток по размеру")
+        parser.add_argument(
+            "--naive", action="store_true",
+            help="Для сравнения: прочитать остаток, проверить в Python и сохранить (как проверка в форме)",
+        )
+
+    def handle(self, *args, **options):
+        threads = options["threads"]
+        attempts = options["attempts"]
+        stock = options["stock"]
+        quantity = options["quantity"]
+        if threads < 1 or attempts < 1 or quantity < 1 or stock < 0:
+            raise CommandError("--threads, --attempts и --quantity должны быть больше 0, --stock - не меньше 0")
+
+        item, size = self._create_item(stock, options["with_size"])
+        size_id = size.pk if size else None
+        reserve = self._naive_reserve if options["naive"] else inventory.reserve
+        mode = "чтение-проверка-запись" if options["naive"] else "условный UPDATE"
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"=== Резервирование ({mode}): {threads} потоков, {attempts} попыток, остаток {stock} ==="
+        ))
+
+        results = {"reserved": 0, "rejected": 0, "errors": 0}
+        lock = threading.Lock()
+        per_thread = [attempts // threads + (1 if i < attempts % threads else 0) for i in range(threads)]
+
+        def worker(count):
+            local = {"reserved": 0, "rejected": 0, "errors": 0}
+            try:
+                for _ in range(count):
+                    try:
+                        ok = reserve(item.pk, quantity, size_id)
+                    except DatabaseError:
+                        local["errors"] += 1
+                        continue
+                    local["reserved" if ok else "rejected"] += 1
+            finally:
+                connections.close_all()
+            with lock:
+                for key, value in local.items():
+                    results[key] += value
+
+        workers = [threading.Thread(target=worker, args=(count,)) for count in per_thread]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            self._report(item, size, stock, quantity, results, attempts, elapsed)
+        finally:
+            self._delete_item(item, size)
+
+    def _create_item(self, stock, with_size):
+        clothes_type, _ = ClothesType.objects.get_or_create(name=BENCHMARK_NAME)
+        item = Assortment.objects.create(
+            name=BENCHMARK_NAME, clothes_type=clothes_type, category="accessories",
+            price=1, stock_quantity=stock,
+        )
+        size = None
+        if with_size:
+            size, _ = Size.objects.get_or_create(
+                size_value="BENCH", system="int", defaults={"description": BENCHMARK_NAME},
+            )
+            AssortmentSize.objects.create(assortment=item, size=size, quantity=stock)
+        return item, size
+
+    def _delete_item(self, item, size):
+        # Без ORM-удаления: оно искало бы позиции заказов (PROTECT) в базе
+        # товара, а они хранятся в PostgreSQL
+        AssortmentSize.objects.filter(Q(assortment=item) | Q(size=size)).delete()
+        with connections[router.db_for_write(Assortment)].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {Assortment._meta.db_table} WHERE id = %s", [item.pk])
+            if size:
+                cursor.execute(f"DELETE FROM {Size._meta.db_table} WHERE id = %s", [size.pk])
+        bump_version(Assortment)
+
+    def _naive_reserve(self, assortment_id, quantity, size_id=None):
+        item = Assortment.objects.get(pk=assortment_id)
+        if item.stock_quantity < quantity:
+            return False
+        item.stock_quantity -= quantity
+        item.save(update_fields=["stock_quantity"])
+        return True
+
+    def _report(self, item, size, stock, quantity, results, attempts, elapsed):
+        item.refresh_from_db(fields=["stock_quantity"])
+        sold = results["reserved"] * quantity
+        self.stdout.write(f"Время: {elapsed:.2f} с, {attempts / elapsed:.0f} попыток/с, "
+                          f"{results['reserved'] / elapsed:.0f} резервов/с")
+        self.stdout.write(f"Зарезервировано: {results['reserved']}, отказано: {results['rejected']}, "
+                          f"ошибок БД: {results['errors']}")
+        self.stdout.write(f"Остаток: было {stock}, стало {item.stock_quantity}, продано {sold} шт.")
+
+        problems = []
+        if item.stock_quantity < 0:
+            problems.append(f"остаток ушёл в минус ({item.stock_quantity})")
+        if sold != stock - item.stock_quantity:
+            problems.append(f"продано {sold} шт., а со склада списано {stock - item.stock_quantity}")
+        if size:
+            sized = AssortmentSize.objects.get(assortment=item, size=size).quantity
+            if sized != item.stock_quantity:
+                problems.append(f"остаток размера {sized} не совпадает с остатком товара")
+        if results["rejected"] and item.stock_quantity >= quantity:
+            problems.append("были отказы, хотя товар ещё оставался")
+
+        if problems:
+            for problem in problems:
+                self.stdout.write(self.style.ERROR(f"Ошибка: {problem}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Продажи сошлись с остатком, перепродаж нет"))
@@ -0,0 +1,83 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from firstapp_var_11.order_import import DEFAULT_CHUNK_SIZE, import_orders, read_orders
+
+
+class Command(BaseCommand):
+    help = (
+        "Массовый импорт заказов из выгрузки CSV или JSON Lines порциями "
+        "с контрольными точками для продолжения после сбоя"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="Файл выгрузки (.jsonl или .csv)")
+        parser.add_argument("--format", choices=["jsonl", "csv"], help="Формат файла (по умолчанию - по расширению)")
+        parser.add_argument(
+            "--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+            help=f"Заказов в порции и транзакции (по умолчанию {DEFAULT_CHUNK_SIZE})",
+        )
+        parser.add_argument("--checkpoint", help="Файл контрольной точки (по умолчанию <файл>.checkpoint)")
+        parser.add_argument("--restart", action="store_true", help="Начать с начала, не читая контрольную точку")
+
+    def handle(self, *args, **options):
+        path = options["file"]
+        if not os.path.exists(path):
+            raise CommandError(f"Файл не найден: {path}")
+        fmt = options["format"] or os.path.splitext(path)[1].lstrip(".").lower()
+        if fmt not in ("jsonl", "csv"):
+            raise CommandError("Не удалось определить формат по расширению, укажите --format")
+        chunk_size = options["chunk_size"]
+        if chunk_size < 1:
+            raise CommandError("--chunk-size должен быть больше 0")
+
+        checkpoint = options["checkpoint"] or f"{path}.checkpoint"
+        skip = 0 if options["restart"] else self._read_checkpoint(checkpoint)
+        self.stdout.write(self.style.MIGRATE_HEADING(f"=== Импорт заказов из {path} ==="))
+        if skip:
+            self.stdout.write(f"Продолжение с контрольной точки: пропускаются первые {skip} записей")
+
+        def on_chunk(stats):
+            # Позиция пишется только после фиксации порции: при сбое
+            # порция повторится целиком, а уже вставленные заказы
+            # пропустятся по номеру
+            self._write_checkpoint(checkpoint, stats.position)
+            elapsed = stats.elapsed
+            self.stdout.write(
+                f"Записей: {stats.position}, заказов: {stats.orders}, позиций: {stats.items} "
+                f"({stats.orders / elapsed:.0f} заказов/с, {stats.items / elapsed:.0f} позиций/с)"
+            )
+
+        encoding = "utf-8-sig" if fmt == "csv" else "utf-8"
+        with open(path, encoding=encoding, newline="") as stream:
+            stats = import_orders(read_orders(stream, fmt), chunk_size=chunk_size, skip=skip, on_chunk=on_chunk)
+
+        for number, message in stats.errors:
+            self.stdout.write(self.style.WARNING(f"Запись {number}: {message}"))
+        if stats.failed > len(stats.errors):
+            self.stdout.write(self.style.WARNING(f"... и ещё {stats.failed - len(stats.errors)} ошибок"))
+
+        elapsed = stats.elapsed
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {elapsed:.1f} с: импортировано {stats.orders} заказов и {stats.items} позиций "
+            f"({(stats.orders + stats.items) / elapsed:.0f} строк/с), "
+            f"пропущено существующих {stats.skipped}, с ошибками {stats.failed}"
+        ))
+
+    def _read_checkpoint(self, checkpoint):
+        if not os.path.exists(checkpoint):
+            return 0
+        try:
+            with open(checkpoint, encoding="utf-8") as stream:
+                return int(json.load(stream)["position"])
+        except (ValueError, KeyError, TypeError) as error:
+            raise CommandError(f"Повреждена контрольная точка {checkpoint}: {error}. Запустите с --restart")
+
+    def _write_checkpoint(self, checkpoint, position):
+        # Через временный файл, чтобы обрыв записи не испортил точку
+        temporary = f"{checkpoint}.tmp"
+        with open(temporary, "w", encoding="utf-8") as stream:
+            json.dump({"position": position}, stream)
+        os.replace(temporary, checkpoint)
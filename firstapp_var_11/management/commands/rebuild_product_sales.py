@@ -0,0 +1,48 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min, Max
+
+from firstapp_var_11.models import Order
+from firstapp_var_11.rollups import rebuild_product_sales
+
+
+class Command(BaseCommand):
+    help = "Перестраивает таблицу продаж товаров по дням (ProductSalesDaily) порциями по N дней"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", help="Первый день (YYYY-MM-DD), по умолчанию - первый заказ")
+        parser.add_argument("--to", dest="date_to", help="Последний день (YYYY-MM-DD), по умолчанию - последний заказ")
+        parser.add_argument("--chunk-days", type=int, default=31, help="Размер порции в днях (по умолчанию 31)")
+
+    def _parse_date(self, value, option):
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f"Некорректная дата для {option}: {value}")
+
+    def handle(self, *args, **options):
+        chunk_days = options["chunk_days"]
+        if chunk_days < 1:
+            raise CommandError("--chunk-days должен быть больше 0")
+
+        bounds = Order.objects.aggregate(first=Min("order_date"), last=Max("order_date"))
+        if bounds["first"] is None and not (options["date_from"] and options["date_to"]):
+            self.stdout.write(self.style.WARNING("Заказов нет, пересчитывать нечего"))
+            return
+        start = self._parse_date(options["date_from"], "--from") if options["date_from"] else bounds["first"]
+        end = self._parse_date(options["date_to"], "--to") if options["date_to"] else bounds["last"]
+        if start > end:
+            raise CommandError("--from не может быть позже --to")
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"=== Пересчёт продаж товаров за {start} - {end} ==="))
+        total_rows = 0
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+            written = rebuild_product_sales(chunk_start, chunk_end)
+            total_rows += written
+            self.stdout.write(f"{chunk_start} - {chunk_end}: {written} строк")
+            chunk_start = chunk_end + timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f"Готово: записано {total_rows} строк продаж"))
@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min, Max
+from django.utils import timezone
+
+from firstapp_var_11.models import Purchase
+from firstapp_var_11.rollups import rebuild_range
+
+
+class Command(BaseCommand):
+    help = "Перестраивает таблицу итогов продаж по дням (SalesDailyRollup) порциями по N дней"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", help="Первый день (YYYY-MM-DD), по умолчанию - первая покупка")
+        parser.add_argument("--to", dest="date_to", help="Последний день (YYYY-MM-DD), по умолчанию - последняя покупка")
+        parser.add_argument("--chunk-days", type=int, default=31, help="Размер порции в днях (по умолчанию 31)")
+
+    def _parse_date(self, value, option):
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f"Некорректная дата для {option}: {value}")
+
+    def handle(self, *args, **options):
+        chunk_days = options["chunk_days"]
+        if chunk_days < 1:
+            raise CommandError("--chunk-days должен быть больше 0")
+
+        bounds = Purchase.objects.aggregate(first=Min("purchase_date"), last=Max("purchase_date"))
+        if options["date_from"]:
+            start = self._parse_date(options["date_from"], "--from")
+        elif bounds["first"]:
+            start = timezone.localdate(bounds["first"])
+        else:
+            self.stdout.write(self.style.WARNING("Покупок нет, пересчитывать нечего"))
+            return
+        if options["date_to"]:
+            end = self._parse_date(options["date_to"], "--to")
+        else:
+            end = timezone.localdate(bounds["last"]) if bounds["last"] else timezone.localdate()
+        if start > end:
+            raise CommandError("--from не может быть позже --to")
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"=== Пересчёт итогов продаж за {start} - {end} ==="))
+        total_rows = 0
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+            written = rebuild_range(chunk_start, chunk_end)
+            total_rows += written
+            self.stdout.write(f"{chunk_start} - {chunk_end}: {written} строк")
+            chunk_start = chunk_end + timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f"Готово: записано {total_rows} строк итогов"))
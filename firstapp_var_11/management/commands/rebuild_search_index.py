@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+
+from firstapp_var_11.models import Assortment
+from firstapp_var_11.search import install_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Пересоздаёт триггеры поискового индекса ассортимента и заново заполняет его"
+
+    def handle(self, *args, **options):
+        using = router.db_for_write(Assortment)
+        connection = connections[using]
+        self.stdout.write(self.style.MIGRATE_HEADING(f"=== Перестройка поискового индекса ({using}) ==="))
+        with transaction.atomic(using=using):
+            # Триггеры пропадают, когда миграция SQLite пересоздаёт таблицу ассортимента
+            install_search_index(connection)
+            rebuild_search_index(connection)
+        count = Assortment.objects.using(using).count()
+        self.stdout.write(self.style.SUCCESS(f"Готово: в индексе {count} товаров"))
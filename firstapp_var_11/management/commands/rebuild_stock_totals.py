@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+
+from firstapp_var_11.analytics_cache import bump_version
+from firstapp_var_11.inventory import install_stock_triggers, recount_stock_totals
+from firstapp_var_11.models import Assortment, AssortmentSize
+
+
+class Command(BaseCommand):
+    help = "Пересоздаёт триггеры общего остатка и пересчитывает остаток товаров с размерами по размерам"
+
+    def handle(self, *args, **options):
+        using = router.db_for_write(AssortmentSize)
+        self.stdout.write(self.style.MIGRATE_HEADING(f"=== Пересчёт общих остатков ({using}) ==="))
+        with transaction.atomic(using=using):
+            # Триггеры пропадают, когда миграция SQLite пересоздаёт таблицу размеров
+            install_stock_triggers(connections[using])
+            updated = recount_stock_totals(using=using)
+        bump_version(Assortment)
+        self.stdout.write(self.style.SUCCESS(f"Готово: пересчитано товаров с размерами: {updated}"))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+
+from firstapp_var_11.analytics_cache import bump_version
+from firstapp_var_11.models import Order
+from firstapp_var_11.rollups import recompute_order_totals
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает суммы заказов (Order.total_amount) по позициям порциями по N заказов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Заказов в порции (по умолчанию 10000)")
+        parser.add_argument("--from-id", type=int, help="Начать с заказа с этим id (продолжение прерванного пересчёта)")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        if chunk_size < 1:
+            raise CommandError("--chunk-size должен быть больше 0")
+
+        bounds = Order.objects.aggregate(first=Min("id"), last=Max("id"))
+        if bounds["first"] is None:
+            self.stdout.write(self.style.WARNING("Заказов нет, пересчитывать нечего"))
+            return
+        start = max(options["from_id"] or bounds["first"], bounds["first"])
+        last = bounds["last"]
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"=== Пересчёт сумм заказов с id {start} по {last} ==="))
+        started = time.perf_counter()
+        total = 0
+        # Порции по диапазону первичного ключа: каждая - один UPDATE в своей транзакции
+        while start <= last:
+            end = start + chunk_size - 1
+            updated = recompute_order_totals(start, end)
+            total += updated
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"id {start} - {min(end, last)}: {updated} заказов ({total / elapsed:.0f} заказов/с)")
+            start = end + 1
+
+        bump_version(Order)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Готово: пересчитано {total} заказов за {elapsed:.1f} с"))
@@ -5,7 +5,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 
 from firstapp_var_11.models import (
-    ClothesType, Size, Assortment, Buyer, Seller,
+    ClothesType, Size, Assortment, AssortmentSize, Buyer, Seller,
     DeliveryMethod, BuyerProfile, Order, OrderItem
 )
 
@@ -63,11 +63,13 @@ class Command(BaseCommand):
                     "category": category,
                     "description": name,
                     "price": price,
-                    "stock_quantity": random.randint(5, 40),
                 },
             )
-            # Привязываем размеры через M2M
-            obj.available_sizes.set(random.sample(sizes, k=min(3, len(sizes))))
+            # Остатки заводим по размерам, общий остаток товара считают триггеры
+            for size in random.sample(sizes, k=min(3, len(sizes))):
+                AssortmentSize.objects.get_or_create(
+                    assortment=obj, size=size, defaults={"quantity": random.randint(2, 15)}
+                )
             assortments.append(obj)
         self.stdout.write(self.style.SUCCESS(f"Ассортимент: {len(assortments)} товаров"))
 
@@ -150,10 +152,11 @@ class Command(BaseCommand):
             seller = random.choice(sellers)
             method = random.choice(methods)
             order_date = today - timedelta(days=random.randint(0, 10))
-            order_number = f"ORD-{order_date.year}-{i:06d}"
 
+            # Номер заказа выдаёт order_numbers при сохранении, поэтому
+            # повторный запуск находит демо-заказ по метке в примечании
             order, created = Order.objects.using("postgres").get_or_create(
-                order_number=order_number,
+                notes=f"Демо-заказ {i}",
                 defaults={
                     "buyer": buyer,
                     "seller": seller,
@@ -163,7 +166,6 @@ class Command(BaseCommand):
                     "delivery_date": order_date + timedelta(days=method.delivery_time_days),
                     "delivery_time": (timezone.now() + timedelta(hours=2)).time(),
                     "status": random.choice([s[0] for s in Order.STATUS_CHOICES]),
-                    "total_amount": 0,
                     "delivery_cost": method.cost,
                     "discount_percent": random.choice([0, 5, 10, 15]),
                     "delivery_address": "г. Минск, ул. Ленина, д. 10",
@@ -171,10 +173,9 @@ class Command(BaseCommand):
                 },
             )
 
-            # Позиции заказа
+            # Позиции заказа; сумму заказа пересчитывают сигналы позиций
             if created:
                 items_count = random.randint(1, 4)
-                total_amount = 0
                 for _ in range(items_count):
                     assortment = random.choice(assortments)
                     quantity = random.randint(1, 3)
@@ -182,7 +183,7 @@ class Command(BaseCommand):
                     discount = random.choice([0, 5, 10])
                     size = random.choice(sizes)
 
-                    item = OrderItem.objects.using("postgres").create(
+                    OrderItem.objects.using("postgres").create(
                         order=order,
                         assortment=assortment,
                         quantity=quantity,
@@ -190,10 +191,6 @@ class Command(BaseCommand):
                         discount_percent=discount,
                         size=size,
                     )
-                    total_amount += item.get_subtotal()
-
-                order.total_amount = total_amount
-                order.save(using="postgres")
 
         self.stdout.write(self.style.SUCCESS("Заказы и позиции заказов (PostgreSQL) созданы"))
         self.stdout.write(self.style.SUCCESS("=== Демоданные успешно добавлены ==="))
@@ -0,0 +1,139 @@
+# Generated by Django 6.0 on 2026-10-18 14:56
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Модели, которые хранятся в PostgreSQL, в порядке создания таблиц
+POSTGRES_MODELS = ['DeliveryMethod', 'BuyerProfile', 'Order', 'OrderItem']
+
+
+def create_missing_tables(apps, schema_editor):
+    """
+    Таблицы заказов могли быть созданы до того, как модели попали в историю
+    миграций, - такие таблицы не пересоздаются.
+    """
+    existing = set(schema_editor.connection.introspection.table_names())
+    for name in POSTGRES_MODELS:
+        model = apps.get_model('firstapp_var_11', name)
+        if model._meta.db_table not in existing:
+            schema_editor.create_model(model)
+
+
+def drop_tables(apps, schema_editor):
+    existing = set(schema_editor.connection.introspection.table_names())
+    for name in reversed(POSTGRES_MODELS):
+        model = apps.get_model('firstapp_var_11', name)
+        if model._meta.db_table in existing:
+            schema_editor.delete_model(model)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstapp_var_11', '0001_initial'),
+    ]
+
+    operations = [
+        # Покупатели, товары и размеры хранятся в SQLite, поэтому связи с ними
+        # без ограничений внешнего ключа (db_constraint=False). Таблицы
+        # создаются отдельной операцией, только если их ещё нет.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='BuyerProfile',
+                    fields=[
+                        ('buyer', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='buyer_profile', serialize=False, to='firstapp_var_11.buyer', verbose_name='Покупатель')),
+                        ('photo', models.ImageField(blank=True, help_text='Загрузите фото покупателя', null=True, upload_to='buyer_photos/', verbose_name='Фото покупателя')),
+                        ('passport_scan', models.FileField(blank=True, help_text='PDF или изображение паспорта', null=True, upload_to='buyer_documents/', verbose_name='Скан паспорта')),
+                        ('address', models.TextField(blank=True, verbose_name='Адрес доставки')),
+                        ('birth_date', models.DateField(blank=True, null=True, verbose_name='Дата рождения')),
+                        ('preferred_delivery_time', models.TimeField(blank=True, help_text='Время, когда удобно получать заказы', null=True, verbose_name='Предпочтительное время доставки')),
+                        ('notes', models.TextField(blank=True, verbose_name='Дополнительные заметки')),
+                        ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания профиля')),
+                        ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                    ],
+                    options={
+                        'verbose_name': 'Профиль покупателя',
+                        'verbose_name_plural': 'Профили покупателей',
+                        'db_table': 'buyer_profiles',
+                    },
+                ),
+                migrations.CreateModel(
+                    name='DeliveryMethod',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('name', models.CharField(max_length=100, unique=True, verbose_name='Название способа доставки')),
+                        ('description', models.TextField(blank=True, verbose_name='Описание')),
+                        ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Стоимость доставки')),
+                        ('delivery_time_days', models.IntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(365)], verbose_name='Срок доставки (дней)')),
+                        ('is_active', models.BooleanField(default=True, verbose_name='Активен')),
+                        ('icon', models.ImageField(blank=True, null=True, upload_to='delivery_icons/', verbose_name='Иконка')),
+                    ],
+                    options={
+                        'verbose_name': 'Способ доставки',
+                        'verbose_name_plural': 'Способы доставки',
+                        'db_table': 'delivery_methods',
+                        'ordering': ['name'],
+                    },
+                ),
+                migrations.CreateModel(
+                    name='Order',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('order_number', models.CharField(max_length=20, unique=True, validators=[django.core.validators.RegexValidator(message='Номер заказа должен быть в формате ORD-YYYY-NNNNNN', regex='^ORD-\\d{4}-\\d{6}$')], verbose_name='Номер заказа')),
+                        ('order_date', models.DateField(auto_now_add=True, verbose_name='Дата заказа')),
+                        ('order_time', models.TimeField(auto_now_add=True, verbose_name='Время заказа')),
+                        ('delivery_date', models.DateField(blank=True, null=True, verbose_name='Дата доставки')),
+                        ('delivery_time', models.TimeField(blank=True, null=True, verbose_name='Время доставки')),
+                        ('status', models.CharField(choices=[('pending', 'Ожидает обработки'), ('processing', 'В обработке'), ('shipped', 'Отправлен'), ('delivered', 'Доставлен'), ('cancelled', 'Отменен')], default='pending', max_length=20, verbose_name='Статус заказа')),
+                        ('total_amount', models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Общая сумма заказа')),
+                        ('delivery_cost', models.DecimalField(decimal_places=2, default=0, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Стоимость доставки')),
+                        ('discount_percent', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)], verbose_name='Скидка (%)')),
+                        ('delivery_address', models.TextField(verbose_name='Адрес доставки')),
+                        ('contact_phone', models.CharField(max_length=20, validators=[django.core.validators.RegexValidator(message='Телефон должен быть в формате +1234567890', regex='^\\+?1?\\d{9,15}$')], verbose_name='Контактный телефон')),
+                        ('notes', models.TextField(blank=True, verbose_name='Примечания к заказу')),
+                        ('invoice_file', models.FileField(blank=True, null=True, upload_to='order_invoices/', verbose_name='Файл счета')),
+                        ('delivery_confirmation_photo', models.ImageField(blank=True, null=True, upload_to='delivery_confirmations/', verbose_name='Фото подтверждения доставки')),
+                        ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                        ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                        ('buyer', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='firstapp_var_11.buyer', verbose_name='Покупатель')),
+                        ('delivery_method', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='firstapp_var_11.deliverymethod', verbose_name='Способ доставки')),
+                        ('seller', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='firstapp_var_11.seller', verbose_name='Продавец')),
+                    ],
+                    options={
+                        'verbose_name': 'Заказ',
+                        'verbose_name_plural': 'Заказы',
+                        'db_table': 'orders',
+                        'ordering': ['-order_date', '-order_time'],
+                    },
+                ),
+                migrations.CreateModel(
+                    name='OrderItem',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('quantity', models.IntegerField(validators=[django.core.validators.MinValueValidator(1)], verbose_name='Количество')),
+                        ('unit_price', models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Цена за единицу')),
+                        ('discount_percent', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)], verbose_name='Скидка на позицию (%)')),
+                        ('notes', models.TextField(blank=True, verbose_name='Примечания к позиции')),
+                        ('assortment', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, related_name='order_items', to='firstapp_var_11.assortment', verbose_name='Товар')),
+                        ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='firstapp_var_11.order', verbose_name='Заказ')),
+                        ('size', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='firstapp_var_11.size', verbose_name='Размер')),
+                    ],
+                    options={
+                        'verbose_name': 'Позиция заказа',
+                        'verbose_name_plural': 'Позиции заказов',
+                        'db_table': 'order_items',
+                        'unique_together': {('order', 'assortment', 'size')},
+                    },
+                ),
+                migrations.AddField(
+                    model_name='order',
+                    name='items',
+                    field=models.ManyToManyField(related_name='orders', through='firstapp_var_11.OrderItem', to='firstapp_var_11.assortment', verbose_name='Товары в заказе'),
+                ),
+            ],
+        ),
+        migrations.RunPython(create_missing_tables, drop_tables, hints={'model_name': 'order'}),
+    ]
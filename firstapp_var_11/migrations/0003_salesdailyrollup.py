@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstapp_var_11', '0002_postgres_models'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('payment_method', models.CharField(choices=[('cash', 'Наличные'), ('card', 'Банковская карта'), ('online', 'Онлайн оплата')], max_length=20, verbose_name='Способ оплаты')),
+                ('purchase_count', models.IntegerField(default=0, verbose_name='Количество покупок')),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Сумма покупок')),
+                ('min_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Минимальная покупка')),
+                ('max_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Максимальная покупка')),
+            ],
+            options={
+                'verbose_name': 'Итог продаж за день',
+                'verbose_name_plural': 'Итоги продаж по дням',
+                'ordering': ['-day', 'payment_method'],
+                'unique_together': {('day', 'payment_method')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstapp_var_11', '0003_salesdailyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('assortment_id', models.IntegerField(verbose_name='ID товара')),
+                ('units', models.IntegerField(default=0, verbose_name='Продано единиц')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+            ],
+            options={
+                'verbose_name': 'Продажи товара за день',
+                'verbose_name_plural': 'Продажи товаров по дням',
+                'db_table': 'product_sales_daily',
+                'ordering': ['-day'],
+                'unique_together': {('day', 'assortment_id')},
+            },
+        ),
+    ]
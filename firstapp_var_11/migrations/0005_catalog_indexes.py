@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstapp_var_11', '0004_productsalesdaily'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assortment',
+            index=models.Index(fields=['category', 'price'], name='assortment_category_price'),
+        ),
+        migrations.AddIndex(
+            model_name='assortment',
+            index=models.Index(fields=['clothes_type', 'price'], name='assortment_type_price'),
+        ),
+        migrations.AddIndex(
+            model_name='assortment',
+            index=models.Index(fields=['price'], name='assortment_price'),
+        ),
+        migrations.AddIndex(
+            model_name='assortmentsize',
+            index=models.Index(fields=['size', 'quantity'], name='assortmentsize_size_qty'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstapp_var_11', '0005_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['buyer', '-purchase_date', '-id'], name='purchase_buyer_date'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstapp_var_11', '0006_purchase_buyer_date_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assortment',
+            index=models.Index(fields=['stock_quantity'], name='assortment_stock'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-order_date', '-order_time', '-id'], name='order_date_time'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'order_date'], name='order_status_date'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['-purchase_date', '-id'], name='purchase_date_id'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-18 20:05
+
+import django.db.models.deletion
+import firstapp_var_11.search
+from django.db import migrations, models
+
+
+def install_search(apps, schema_editor):
+    firstapp_var_11.search.install_search_index(schema_editor.connection)
+    firstapp_var_11.search.rebuild_search_index(schema_editor.connection)
+
+
+def uninstall_search(apps, schema_editor):
+    firstapp_var_11.search.uninstall_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstapp_var_11', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssortmentSearch',
+            fields=[
+                ('assortment', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='firstapp_var_11.assortment', verbose_name='Товар')),
+                ('document', firstapp_var_11.search.SearchDocumentField(verbose_name='Поисковый документ')),
+            ],
+            options={
+                'verbose_name': 'Поисковый индекс товара',
+                'verbose_name_plural': 'Поисковый индекс ассортимента',
+                'db_table': 'assortment_search',
+                'managed': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='assortment',
+            index=models.Index(fields=['name', 'id'], name='assortment_name'),
+        ),
+        # Таблица индекса и триггеры - в базе ассортимента
+        migrations.RunPython(install_search, uninstall_search, hints={'model_name': 'assortment'}),
+    ]
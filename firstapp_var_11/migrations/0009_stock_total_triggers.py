@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-18 20:40
+
+import firstapp_var_11.inventory
+from django.db import migrations
+
+
+def install_triggers(apps, schema_editor):
+    firstapp_var_11.inventory.install_stock_triggers(schema_editor.connection)
+    firstapp_var_11.inventory.recount_stock_totals(using=schema_editor.connection.alias)
+
+
+def uninstall_triggers(apps, schema_editor):
+    firstapp_var_11.inventory.uninstall_stock_triggers(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstapp_var_11', '0008_assortment_search'),
+    ]
+
+    operations = [
+        # Триггеры общего остатка - в базе ассортимента
+        migrations.RunPython(install_triggers, uninstall_triggers, hints={'model_name': 'assortmentsize'}),
+    ]
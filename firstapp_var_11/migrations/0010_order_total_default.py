@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 21:15
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstapp_var_11', '0009_stock_total_triggers'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Общая сумма заказа'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-18 21:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstapp_var_11', '0010_order_total_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumberCounter',
+            fields=[
+                ('year', models.PositiveSmallIntegerField(primary_key=True, serialize=False, verbose_name='Год')),
+                ('last_number', models.IntegerField(default=0, verbose_name='Последний выданный номер')),
+            ],
+            options={
+                'verbose_name': 'Счётчик номеров заказов',
+                'verbose_name_plural': 'Счётчики номеров заказов',
+                'db_table': 'order_number_counter',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstapp_var_11', '0012_table_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='reserved',
+            field=models.BooleanField(default=False, verbose_name='Товар зарезервирован'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 23:30
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstapp_var_11', '0013_orderitem_reserved'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='buyer',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='buyer_email_lower'),
+        ),
+    ]
@@ -1,9 +1,13 @@
 from django.db import models
+from django.db.models.functions import Lower
 from django.urls import reverse
 from django.core.validators import MinValueValidator, MaxValueValidator, RegexValidator
 from django.core.exceptions import ValidationError
+from decimal import Decimal
 import os
 
+from .search import SearchDocumentField
+
 
 # ============================================================================
 # ЗАДАЧА 2.1: ОДНА ТАБЛИЦА (без связей)
@@ -85,6 +89,10 @@ class Buyer(models.Model):
         verbose_name = 'Покупатель'
         verbose_name_plural = 'Покупатели'
         ordering = ['last_name', 'first_name']
+        indexes = [
+            # Поиск покупателя по email без учёта регистра (импорт заказов)
+            models.Index(Lower('email'), name='buyer_email_lower'),
+        ]
 
     def __str__(self):
         return f"{self.last_name} {self.first_name}"
@@ -134,6 +142,12 @@ class Purchase(models.Model):
         verbose_name = 'Покупка'
         verbose_name_plural = 'Покупки'
         ordering = ['-purchase_date']
+        indexes = [
+            # История покупок покупателя с keyset-пагинацией по (purchase_date, id)
+            models.Index(fields=['buyer', '-purchase_date', '-id'], name='purchase_buyer_date'),
+            # Общий список покупок и выборки по диапазону дат (графики, пересчёт итогов)
+            models.Index(fields=['-purchase_date', '-id'], name='purchase_date_id'),
+        ]
 
     def __str__(self):
         return f"Покупка #{self.id} - {self.buyer.get_full_name()}"
@@ -236,10 +250,37 @@ class Assortment(models.Model):
         verbose_name = 'Товар'
         verbose_name_plural = 'Ассортимент'
         ordering = ['name']
+        indexes = [
+            # Фильтры каталога: категория/тип одежды вместе с диапазоном цены
+            models.Index(fields=['category', 'price'], name='assortment_category_price'),
+            models.Index(fields=['clothes_type', 'price'], name='assortment_type_price'),
+            models.Index(fields=['price'], name='assortment_price'),
+            # Товары в наличии (форма заказа) и с малым остатком
+            models.Index(fields=['stock_quantity'], name='assortment_stock'),
+            # Сортировка каталога и поиска без запроса по названию
+            models.Index(fields=['name', 'id'], name='assortment_name'),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.price} руб."
 
+    def save(self, *args, **kwargs):
+        """
+        Остаток товара с размерами - сумма остатков по размерам, его ведут
+        триггеры AssortmentSize (см. inventory.py). Сохранение карточки
+        такого товара не перезаписывает остаток значением, прочитанным
+        до параллельных резервов.
+        """
+        if (
+            not self._state.adding and kwargs.get('update_fields') is None
+            and self.assortmentsize_set.exists()
+        ):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'stock_quantity'
+            ]
+        super().save(*args, **kwargs)
+
     def is_available(self):
         return self.stock_quantity > 0
 
@@ -268,11 +309,40 @@ class AssortmentSize(models.Model):
         verbose_name = 'Наличие по размеру'
         verbose_name_plural = 'Наличие по размерам'
         unique_together = ['assortment', 'size']
+        indexes = [
+            # Фильтр каталога «размер в наличии»
+            models.Index(fields=['size', 'quantity'], name='assortmentsize_size_qty'),
+        ]
 
     def __str__(self):
         return f"{self.assortment.name} - {self.size} ({self.quantity} шт.)"
 
 
+class AssortmentSearch(models.Model):
+    """
+    Поисковый индекс ассортимента (FTS5 в SQLite, tsvector в PostgreSQL).
+
+    Таблицу создаёт миграция, а заполняют триггеры базы (см. search.py),
+    поэтому модель неуправляемая и используется только в запросах:
+    Assortment.objects.filter(search_entry__document__matches='платье').
+    """
+    assortment = models.OneToOneField(
+        Assortment,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        related_name='search_entry',
+        verbose_name='Товар'
+    )
+    document = SearchDocumentField(verbose_name='Поисковый документ')
+
+    class Meta:
+        managed = False
+        db_table = 'assortment_search'
+        verbose_name = 'Поисковый индекс товара'
+        verbose_name_plural = 'Поисковый индекс ассортимента'
+
+
 # ============================================================================
 # ЗАДАЧА 2.4: ДВЕ ТАБЛИЦЫ (1 к 1) - для PostgreSQL
 # ============================================================================
@@ -397,10 +467,12 @@ class DeliveryMethod(models.Model):
 
 class BuyerProfile(models.Model):
     """Расширенный профиль покупателя - связь 1:1 с Buyer"""
+    # Покупатели хранятся в SQLite: связь без ограничения внешнего ключа
     buyer = models.OneToOneField(
         Buyer,
         on_delete=models.CASCADE,
         primary_key=True,
+        db_constraint=False,
         related_name='buyer_profile',
         verbose_name='Покупатель'
     )
@@ -465,6 +537,43 @@ class BuyerProfile(models.Model):
         return reverse('buyer_profile_detail', args=[str(self.buyer.id)])
 
 
+# Денежное поле для вычисляемых сумм (умножение на 0.01 вместо деления
+# на 100, чтобы SQLite не делил целые числа нацело)
+MONEY_FIELD = models.DecimalField(max_digits=14, decimal_places=2)
+ONE_PERCENT = models.Value(Decimal('0.01'))
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Итог заказа со скидкой и доставкой (как get_total_with_discount) в SQL"""
+        return self.annotate(
+            discount_amount=models.ExpressionWrapper(
+                models.F('total_amount') * models.F('discount_percent') * ONE_PERCENT,
+                output_field=MONEY_FIELD,
+            ),
+            total_with_discount=models.ExpressionWrapper(
+                models.F('total_amount') * (100 - models.F('discount_percent')) * ONE_PERCENT
+                + models.F('delivery_cost'),
+                output_field=MONEY_FIELD,
+            ),
+        )
+
+
+class OrderItemQuerySet(models.QuerySet):
+    def with_amounts(self):
+        """Сумма позиции без скидки, скидка и подытог (как get_subtotal) в SQL"""
+        gross = models.F('unit_price') * models.F('quantity')
+        return self.annotate(
+            line_gross=models.ExpressionWrapper(gross, output_field=MONEY_FIELD),
+            line_discount=models.ExpressionWrapper(
+                gross * models.F('discount_percent') * ONE_PERCENT, output_field=MONEY_FIELD
+            ),
+            line_subtotal=models.ExpressionWrapper(
+                gross * (100 - models.F('discount_percent')) * ONE_PERCENT, output_field=MONEY_FIELD
+            ),
+        )
+
+
 class Order(models.Model):
     """Заказ - главная (промежуточная) таблица с связями M:1"""
     STATUS_CHOICES = [
@@ -476,9 +585,11 @@ class Order(models.Model):
     ]
 
     # Связи M:1 к справочникам
+    # Покупатели хранятся в SQLite: связь без ограничения внешнего ключа
     buyer = models.ForeignKey(
         Buyer,
         on_delete=models.PROTECT,  # Нельзя удалить покупателя с заказами
+        db_constraint=False,
         related_name='orders',
         verbose_name='Покупатель'
     )
@@ -533,10 +644,12 @@ class Order(models.Model):
         verbose_name='Статус заказа',
         default='pending'
     )
+    # Сумма подытогов позиций; ведётся сигналами OrderItem (rollups.refresh_order_total)
     total_amount = models.DecimalField(
         max_digits=10,
         decimal_places=2,
         verbose_name='Общая сумма заказа',
+        default=0,
         validators=[MinValueValidator(0)]
     )
     delivery_cost = models.DecimalField(
@@ -602,15 +715,39 @@ class Order(models.Model):
         verbose_name='Дата обновления'
     )
 
+    objects = OrderQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
         ordering = ['-order_date', '-order_time']
         db_table = 'orders'
+        indexes = [
+            # Список заказов с keyset-пагинацией и выборки по диапазону дат
+            models.Index(fields=['-order_date', '-order_time', '-id'], name='order_date_time'),
+            # Заказы в заданном статусе за период
+            models.Index(fields=['status', 'order_date'], name='order_status_date'),
+        ]
 
     def __str__(self):
         return f"Заказ {self.order_number} - {self.buyer.get_full_name()}"
 
+    def save(self, *args, **kwargs):
+        """
+        Сумму заказа пересчитывают сигналы позиций; сохранение заказа
+        не перезаписывает её значением, прочитанным до изменения позиций.
+        Новому заказу без номера номер выдаёт order_numbers.
+        """
+        if self._state.adding and not self.order_number:
+            from .order_numbers import next_order_number
+            self.order_number = next_order_number()
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'total_amount'
+            ]
+        super().save(*args, **kwargs)
+
     def clean(self):
         """Валидация данных заказа"""
         if self.delivery_date and self.order_date:
@@ -641,9 +778,11 @@ class OrderItem(models.Model):
         related_name='order_items',
         verbose_name='Заказ'
     )
+    # Товары и размеры хранятся в SQLite: связи без ограничений внешнего ключа
     assortment = models.ForeignKey(
         Assortment,
         on_delete=models.PROTECT,
+        db_constraint=False,
         related_name='order_items',
         verbose_name='Товар'
     )
@@ -665,6 +804,7 @@ class OrderItem(models.Model):
     size = models.ForeignKey(
         Size,
         on_delete=models.PROTECT,
+        db_constraint=False,
         verbose_name='Размер',
         blank=True,
         null=True
@@ -673,6 +813,14 @@ class OrderItem(models.Model):
         verbose_name='Примечания к позиции',
         blank=True
     )
+    # Держит ли позиция товар на складе: возвращается только то, что было
+    # зарезервировано (позиции из импорта и созданные мимо резерва - нет)
+    reserved = models.BooleanField(
+        verbose_name='Товар зарезервирован',
+        default=False
+    )
+
+    objects = OrderItemQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Позиция заказа'
@@ -700,9 +848,133 @@ class OrderItem(models.Model):
             raise ValidationError({
                 'unit_price': 'Цена не может быть отрицательной'
             })
-        
-        # Проверка наличия товара на складе
-        if self.assortment.stock_quantity < self.quantity:
-            raise ValidationError({
-                'quantity': f'Недостаточно товара на складе. Доступно: {self.assortment.stock_quantity}'
-            })
\ No newline at end of file
+        # Наличие на складе здесь не проверяется: проверка и списание
+        # выполняются атомарно при резервировании (inventory.reserve_lines)
+
+# ============================================================================
+# АНАЛИТИКА: АГРЕГАТНЫЕ ТАБЛИЦЫ
+# ============================================================================
+
+class SalesDailyRollup(models.Model):
+    """Дневной итог продаж по способу оплаты (поддерживается сигналами Purchase)"""
+    day = models.DateField(
+        verbose_name='День'
+    )
+    payment_method = models.CharField(
+        max_length=20,
+        choices=Purchase.PAYMENT_METHODS,
+        verbose_name='Способ оплаты'
+    )
+    purchase_count = models.IntegerField(
+        verbose_name='Количество покупок',
+        default=0
+    )
+    total_amount = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        verbose_name='Сумма покупок',
+        default=0
+    )
+    min_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        verbose_name='Минимальная покупка',
+        blank=True,
+        null=True
+    )
+    max_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        verbose_name='Максимальная покупка',
+        blank=True,
+        null=True
+    )
+
+    class Meta:
+        verbose_name = 'Итог продаж за день'
+        verbose_name_plural = 'Итоги продаж по дням'
+        ordering = ['-day', 'payment_method']
+        unique_together = ['day', 'payment_method']
+
+    def __str__(self):
+        return f"{self.day} {self.get_payment_method_display()}: {self.purchase_count} шт."
+
+
+class ProductSalesDaily(models.Model):
+    """Дневные продажи товара по позициям заказов (поддерживается сигналами OrderItem)"""
+    day = models.DateField(
+        verbose_name='День'
+    )
+    # Товар хранится в SQLite, поэтому ссылка без внешнего ключа
+    assortment_id = models.IntegerField(
+        verbose_name='ID товара'
+    )
+    units = models.IntegerField(
+        verbose_name='Продано единиц',
+        default=0
+    )
+    revenue = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        verbose_name='Выручка',
+        default=0
+    )
+
+    class Meta:
+        verbose_name = 'Продажи товара за день'
+        verbose_name_plural = 'Продажи товаров по дням'
+        ordering = ['-day']
+        unique_together = ['day', 'assortment_id']
+        db_table = 'product_sales_daily'
+
+    def __str__(self):
+        return f"{self.day} товар #{self.assortment_id}: {self.units} шт."
+
+
+class OrderNumberCounter(models.Model):
+    """
+    Последний выданный номер заказа за год. Используется, только если
+    заказы хранятся в SQLite; в PostgreSQL номера выдают последовательности
+    (см. order_numbers).
+    """
+    year = models.PositiveSmallIntegerField(
+        primary_key=True,
+        verbose_name='Год'
+    )
+    last_number = models.IntegerField(
+        verbose_name='Последний выданный номер',
+        default=0
+    )
+
+    class Meta:
+        verbose_name = 'Счётчик номеров заказов'
+        verbose_name_plural = 'Счётчики номеров заказов'
+        db_table = 'order_number_counter'
+
+    def __str__(self):
+        return f"{self.year}: {self.last_number}"
+
+
+class TableVersion(models.Model):
+    """
+    Версия таблицы для кэша аналитики и ETag API каталога. Хранится в базе,
+    а не в кэше процесса, чтобы изменения, сделанные одним процессом
+    (в том числе командами управления), видели все остальные.
+    """
+    label = models.CharField(
+        max_length=100,
+        primary_key=True,
+        verbose_name='Модель'
+    )
+    version = models.BigIntegerField(
+        verbose_name='Версия',
+        default=0
+    )
+
+    class Meta:
+        verbose_name = 'Версия таблицы'
+        verbose_name_plural = 'Версии таблиц'
+        db_table = 'table_version'
+
+    def __str__(self):
+        return f"{self.label}: {self.version}"
@@ -0,0 +1,410 @@
+"""
+Массовый импорт заказов из выгрузок маркетплейсов.
+
+Файл читается потоком: JSON Lines (один заказ в строке, позиции - список
+items) или CSV (строка на позицию, поля заказа повторяются; строки одного
+заказа идут подряд). Заказы обрабатываются порциями: покупатели (SQLite),
+товары и уже импортированные номера ищутся одним запросом на порцию,
+справочники (размеры, способы доставки, продавцы) загружаются один раз,
+а заказы и позиции вставляются в PostgreSQL через bulk_create в одной
+транзакции на порцию.
+
+bulk_create не вызывает сигналов, поэтому суммы заказов и продажи
+товаров по дням порция обновляет сама, теми же функциями rollups.
+Остатки на складе импорт не трогает: в выгрузках - уже исполненные
+заказы, и их позиции сохраняются без резерва (OrderItem.reserved), чтобы
+удаление позиции или отмена заказа не вернули на склад то, что с него
+не списывалось. Заказ с уже существующим номером пропускается, поэтому
+повторный запуск с той же позиции безопасен.
+"""
+import csv
+import json
+import re
+import time
+from collections import defaultdict
+from datetime import date, time as dt_time
+from decimal import Decimal, InvalidOperation
+
+from django.db import router, transaction
+from django.db.models import Sum
+from django.db.models.functions import Lower
+
+from . import rollups
+from .analytics_cache import bump_version
+from .models import Assortment, Buyer, DeliveryMethod, Order, OrderItem, Seller, Size
+from .order_numbers import reserve_through
+
+
+DEFAULT_CHUNK_SIZE = 1000
+# Сколько ошибок разбора хранить в отчёте
+MAX_REPORTED_ERRORS = 100
+
+ORDER_NUMBER_RE = re.compile(r'^ORD-\d{4}-\d{6}$')
+PHONE_RE = re.compile(r'^\+?1?\d{9,15}$')
+STATUSES = {key for key, _ in Order.STATUS_CHOICES}
+
+# Поля CSV: поля заказа без префикса, поля позиции - с префиксом item_
+CSV_ITEM_PREFIX = 'item_'
+
+
+class RecordError(ValueError):
+    """Заказ из файла не может быть импортирован"""
+
+
+# ============================================================================
+# ЧТЕНИЕ ФАЙЛОВ
+# ============================================================================
+
+def read_jsonl(stream):
+    """Заказы из JSON Lines: (номер записи, dict заказа со списком items)"""
+    number = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as error:
+            record = RecordError(f'неверный JSON: {error}')
+        yield number, record
+
+
+def read_csv(stream):
+    """
+    Заказы из CSV: подряд идущие строки с одним order_number собираются
+    в один заказ, поля item_* каждой строки - его позиции.
+    """
+    number = 0
+    current = None
+    for row in csv.DictReader(stream):
+        item = {key[len(CSV_ITEM_PREFIX):]: value for key, value in row.items() if key.startswith(CSV_ITEM_PREFIX)}
+        if current is None or row.get('order_number') != current['order_number']:
+            if current is not None:
+                yield number, current
+            number += 1
+            current = {key: value for key, value in row.items() if not key.startswith(CSV_ITEM_PREFIX)}
+            current['items'] = []
+        current['items'].append(item)
+    if current is not None:
+        yield number, current
+
+
+def read_orders(stream, fmt):
+    if fmt == 'jsonl':
+        return read_jsonl(stream)
+    if fmt == 'csv':
+        return read_csv(stream)
+    raise ValueError(f'Неизвестный формат: {fmt}')
+
+
+# ============================================================================
+# РАЗБОР ЗАПИСЕЙ
+# ============================================================================
+
+def _text(record, key, required=True):
+    value = record.get(key)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RecordError(f'не заполнено поле {key}')
+    return value
+
+
+def _int(record, key, default=None):
+    value = _text(record, key, required=default is None)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise RecordError(f'{key}: ожидается целое число, получено {value!r}')
+
+
+def _decimal(record, key, default=None):
+    value = _text(record, key, required=default is None)
+    if not value:
+        return default
+    try:
+        return Decimal(value).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise RecordError(f'{key}: ожидается число, получено {value!r}')
+
+
+def _date(record, key):
+    value = _text(record, key, required=False)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        raise RecordError(f'{key}: ожидается дата YYYY-MM-DD, получено {value!r}')
+
+
+def _time(record, key):
+    value = _text(record, key, required=False)
+    if not value:
+        return None
+    try:
+        return dt_time.fromisoformat(value)
+    except ValueError:
+        raise RecordError(f'{key}: ожидается время HH:MM[:SS], получено {value!r}')
+
+
+class Directory:
+    """Небольшие справочники, загружаемые один раз на импорт"""
+
+    def __init__(self):
+        self.delivery_methods = {}
+        for method in DeliveryMethod.objects.all():
+            self.delivery_methods[str(method.pk)] = method
+            self.delivery_methods[method.name.lower()] = method
+        self.sellers = {email.lower(): pk for pk, email in Seller.objects.values_list('pk', 'email')}
+        self.sizes = {}
+        for pk, value, system in Size.objects.values_list('pk', 'size_value', 'system'):
+            self.sizes[str(pk)] = pk
+            self.sizes[f'{value.lower()}:{system}'] = pk
+
+    def delivery_method(self, record):
+        key = _text(record, 'delivery_method').lower()
+        if key not in self.delivery_methods:
+            raise RecordError(f'неизвестный способ доставки {key!r}')
+        return self.delivery_methods[key]
+
+    def seller_id(self, record):
+        email = _text(record, 'seller_email', required=False).lower()
+        if email and email not in self.sellers:
+            raise RecordError(f'неизвестный продавец {email!r}')
+        return self.sellers.get(email)
+
+    def size_id(self, item):
+        size_id = _text(item, 'size_id', required=False)
+        if size_id:
+            key = size_id
+        else:
+            value = _text(item, 'size', required=False)
+            if not value:
+                return None
+            key = f"{value.lower()}:{_text(item, 'size_system', required=False) or 'int'}"
+        if key not in self.sizes:
+            raise RecordError(f'неизвестный размер {key!r}')
+        return self.sizes[key]
+
+
+def _parse(record, directory):
+    """Заказ и позиции без ссылок, которые ищутся запросом на порцию"""
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise RecordError('запись должна быть объектом')
+    order_number = _text(record, 'order_number')
+    if not ORDER_NUMBER_RE.match(order_number):
+        raise RecordError(f'номер заказа {order_number!r} не в формате ORD-YYYY-NNNNNN')
+    status = _text(record, 'status', required=False) or 'pending'
+    if status not in STATUSES:
+        raise RecordError(f'неизвестный статус {status!r}')
+    phone = _text(record, 'contact_phone')
+    if not PHONE_RE.match(phone):
+        raise RecordError(f'телефон {phone!r} не в формате +1234567890')
+    discount = _int(record, 'discount_percent', 0)
+    if not 0 <= discount <= 100:
+        raise RecordError('discount_percent должен быть от 0 до 100')
+    method = directory.delivery_method(record)
+
+    order = Order(
+        order_number=order_number,
+        seller_id=directory.seller_id(record),
+        delivery_method=method,
+        order_date=_date(record, 'order_date'),
+        order_time=_time(record, 'order_time'),
+        delivery_date=_date(record, 'delivery_date'),
+        delivery_time=_time(record, 'delivery_time'),
+        status=status,
+        delivery_cost=_decimal(record, 'delivery_cost', method.cost),
+        discount_percent=discount,
+        delivery_address=_text(record, 'delivery_address'),
+        contact_phone=phone,
+        notes=_text(record, 'notes', required=False),
+    )
+
+    items = record.get('items')
+    if not isinstance(items, list) or not items:
+        raise RecordError('в заказе нет позиций')
+    lines = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise RecordError('позиция должна быть объектом')
+        assortment_id = _int(item, 'assortment_id')
+        size_id = directory.size_id(item)
+        quantity = _int(item, 'quantity')
+        if quantity < 1:
+            raise RecordError('quantity должно быть больше 0')
+        line_discount = _int(item, 'discount_percent', 0)
+        if not 0 <= line_discount <= 100:
+            raise RecordError('discount_percent позиции должен быть от 0 до 100')
+        if (assortment_id, size_id) in lines:
+            raise RecordError(f'товар {assortment_id} с одним размером указан дважды')
+        lines[assortment_id, size_id] = OrderItem(
+            assortment_id=assortment_id,
+            size_id=size_id,
+            quantity=quantity,
+            unit_price=_decimal(item, 'unit_price', Decimal('-1')),
+            discount_percent=line_discount,
+            notes=_text(item, 'notes', required=False),
+            # Товар со склада не списывался, возвращать при отмене нечего
+            reserved=False,
+        )
+    return order, _text(record, 'buyer_email').lower(), list(lines.values())
+
+
+# ============================================================================
+# ИМПОРТ
+# ============================================================================
+
+class ImportStats:
+    """Счётчики импорта; position - последняя обработанная запись файла"""
+
+    def __init__(self, position=0):
+        self.position = position
+        self.orders = 0
+        self.items = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def fail(self, number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((number, message))
+
+
+def _import_chunk(chunk, directory, stats):
+    """Разобрать, проверить и вставить одну порцию записей"""
+    parsed = []
+    for number, record in chunk:
+        try:
+            parsed.append((number, *_parse(record, directory)))
+        except RecordError as error:
+            stats.fail(number, str(error))
+
+    # Ссылки на другие таблицы - одним запросом на порцию
+    emails = {email for _, _, email, _ in parsed}
+    # Email в записях приведены к нижнему регистру, в базе - как ввели (индекс buyer_email_lower)
+    buyers = dict(
+        Buyer.objects.annotate(email_lower=Lower('email')).filter(email_lower__in=emails)
+        .order_by().values_list('email_lower', 'pk')
+    )
+    assortment_ids = {item.assortment_id for _, _, _, items in parsed for item in items}
+    prices = dict(Assortment.objects.filter(pk__in=assortment_ids).values_list('pk', 'price'))
+    existing = set(
+        Order.objects.filter(order_number__in=[order.order_number for _, order, _, _ in parsed])
+        .values_list('order_number', flat=True)
+    )
+
+    orders, order_items = [], []
+    seen = set()
+    for number, order, email, items in parsed:
+        if order.order_number in existing or order.order_number in seen:
+            stats.skipped += 1
+            continue
+        try:
+            if email not in buyers:
+                raise RecordError(f'неизвестный покупатель {email!r}')
+            order.buyer_id = buyers[email]
+            for item in items:
+                if item.assortment_id not in prices:
+                    raise RecordError(f'неизвестный товар {item.assortment_id}')
+                if item.unit_price < 0:
+                    item.unit_price = prices[item.assortment_id]
+        except RecordError as error:
+            stats.fail(number, str(error))
+            continue
+        seen.add(order.order_number)
+        orders.append(order)
+        order_items.append(items)
+
+    if orders:
+        _insert(orders, order_items)
+        # Номера из файла больше не должен выдать счётчик номеров
+        last_numbers = defaultdict(int)
+        for order in orders:
+            _, year, number = order.order_number.split('-')
+            last_numbers[int(year)] = max(last_numbers[int(year)], int(number))
+        for year, number in last_numbers.items():
+            reserve_through(year, number)
+        stats.orders += len(orders)
+        stats.items += sum(len(items) for items in order_items)
+
+
+def _insert(orders, order_items):
+    # order_date и order_time - auto_now_add: bulk_create заменит их
+    # текущими, даты из файла возвращаются отдельным bulk_update
+    dated = [(order, order.order_date, order.order_time) for order in orders]
+    using = router.db_for_write(Order)
+    with transaction.atomic(using=using):
+        Order.objects.bulk_create(orders)
+        restore = []
+        for order, order_date, order_time in dated:
+            if order_date or order_time:
+                order.order_date = order_date or order.order_date
+                order.order_time = order_time or order.order_time
+                restore.append(order)
+        if restore:
+            Order.objects.bulk_update(restore, ['order_date', 'order_time'])
+
+        items = []
+        for order, lines in zip(orders, order_items):
+            for item in lines:
+                item.order_id = order.pk
+                items.append(item)
+        OrderItem.objects.bulk_create(items)
+
+        order_ids = [order.pk for order in orders]
+        Order.objects.filter(pk__in=order_ids).update(total_amount=rollups.order_total())
+        sales = (
+            OrderItem.objects.filter(order_id__in=order_ids).exclude(order__status='cancelled')
+            .values('order__order_date', 'assortment_id')
+            .annotate(units=Sum('quantity'), revenue=Sum(rollups.LINE_REVENUE))
+            .order_by()
+        )
+        for row in sales:
+            rollups.apply_product_sales(
+                row['order__order_date'], row['assortment_id'], row['units'], row['revenue'] or 0,
+            )
+
+
+def import_orders(records, chunk_size=DEFAULT_CHUNK_SIZE, skip=0, on_chunk=None):
+    """
+    Импортировать заказы из итератора (номер записи, запись).
+
+    skip - сколько записей с начала уже импортировано (продолжение по
+    контрольной точке). on_chunk(stats) вызывается после фиксации каждой
+    порции - например, чтобы сохранить stats.position. Возвращает ImportStats.
+    """
+    directory = Directory()
+    stats = ImportStats(position=skip)
+    chunk = []
+
+    def flush():
+        _import_chunk(chunk, directory, stats)
+        stats.position = chunk[-1][0]
+        chunk.clear()
+        if on_chunk:
+            on_chunk(stats)
+
+    for number, record in records:
+        if number <= skip:
+            continue
+        chunk.append((number, record))
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    if stats.orders:
+        bump_version(Order)
+        bump_version(OrderItem)
+    return stats
@@ -0,0 +1,185 @@
+"""
+Выдача номеров заказов ORD-YYYY-NNNNNN на сервере.
+
+Номера выдаются блоками (hi/lo): процесс берёт из базы сразу BLOCK_SIZE
+номеров и раздаёт их из памяти под блокировкой потока, так что частое
+создание заказов обращается к общему счётчику раз в BLOCK_SIZE заказов.
+В PostgreSQL счётчик блоков - последовательность на каждый год
+(order_number_YYYY): nextval не блокирует строк и не откатывается,
+поэтому параллельные процессы никогда не получат один блок. В SQLite
+вместо последовательности - таблица OrderNumberCounter, в которую
+пишет один процесс за раз. Блок, который может откатиться вместе
+с внешней транзакцией (новая последовательность, изменение счётчика),
+в памяти не остаётся.
+
+Номера уникальны, но не сплошные: остаток блока пропадает при перезапуске
+процесса, номер отменённой транзакции не возвращается. Номера, пришедшие
+извне (импорт выгрузок), нужно пропустить через reserve_through, иначе
+счётчик однажды выдаст их повторно.
+"""
+import os
+import threading
+
+from django.db import connections, router, transaction
+from django.db.models import F, Max, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Order, OrderNumberCounter
+
+
+# Номеров в блоке; менять только вместе со сбросом последовательностей
+BLOCK_SIZE = 50
+MAX_NUMBER = 999999
+
+ORDER_NUMBER_FORMAT = 'ORD-{year}-{number:06d}'
+
+_lock = threading.Lock()
+# (база, год) -> [следующий номер, последний номер блока]
+_blocks = {}
+_blocks_pid = os.getpid()
+# Последовательности, которые этот процесс уже создал или видел
+_sequences = set()
+
+
+class OrderNumbersExhausted(RuntimeError):
+    """За год выданы все номера до 999999"""
+
+
+def format_order_number(year, number):
+    return ORDER_NUMBER_FORMAT.format(year=year, number=number)
+
+
+def _sequence_name(year):
+    return f'order_number_{int(year)}'
+
+
+def _last_used(year, using):
+    """Наибольший номер года среди существующих заказов (по индексу order_number)"""
+    last = (
+        Order.objects.using(using).filter(order_number__startswith=f'ORD-{year}-')
+        .aggregate(last=Max('order_number'))['last']
+    )
+    return int(last.rsplit('-', 1)[1]) if last else 0
+
+
+# ============================================================================
+# СЧЁТЧИК БЛОКОВ
+# ============================================================================
+
+def _first_free_block(last_number):
+    """
+    Первый блок, все номера которого больше last_number: блок N - это
+    номера (N-1)*BLOCK_SIZE+1 .. N*BLOCK_SIZE
+    """
+    return (last_number + BLOCK_SIZE - 1) // BLOCK_SIZE + 1
+
+
+def _ensure_sequence(connection, year):
+    """
+    Создать последовательность года, начиная после уже занятых номеров.
+    Рекомендательная блокировка не даёт двум процессам создавать её
+    одновременно.
+    """
+    if (connection.alias, year) in _sequences:
+        return
+    name = _sequence_name(year)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [name])
+        cursor.execute("SELECT to_regclass(%s)", [name])
+        if cursor.fetchone()[0] is None:
+            start = _first_free_block(_last_used(year, connection.alias))
+            cursor.execute(f"CREATE SEQUENCE {name} START WITH {start} MINVALUE 1")
+    # Внутри внешней транзакции создание ещё может откатиться
+    transaction.on_commit(lambda: _sequences.add((connection.alias, year)), using=connection.alias)
+
+
+def _postgres_block(connection, year):
+    """
+    Блок из последовательности. Последовательность, созданная во внешней
+    транзакции, откатится вместе с ней и начнёт выдавать те же блоки
+    заново, поэтому блок из неё не запоминается, пока её создание
+    не зафиксировано.
+    """
+    reusable = not connection.in_atomic_block or (connection.alias, year) in _sequences
+    _ensure_sequence(connection, year)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(%s)", [_sequence_name(year)])
+        block = cursor.fetchone()[0]
+    return (block - 1) * BLOCK_SIZE + 1, block * BLOCK_SIZE, reusable
+
+
+def _counter_block(connection, year):
+    """
+    Блок из таблицы-счётчика. Внутри внешней транзакции изменение счётчика
+    может откатиться вместе с ней, а выданный блок остался бы в памяти -
+    поэтому там берётся один номер, который не запоминается.
+    """
+    size = 1 if connection.in_atomic_block else BLOCK_SIZE
+    counters = OrderNumberCounter.objects.using(connection.alias)
+    with transaction.atomic(using=connection.alias):
+        # UPDATE первым: с него транзакция SQLite получает блокировку записи
+        if not counters.filter(year=year).update(last_number=F('last_number') + size):
+            counters.create(year=year, last_number=_last_used(year, connection.alias) + size)
+        last = counters.filter(year=year).values_list('last_number', flat=True).get()
+    return last - size + 1, last, size == BLOCK_SIZE
+
+
+def _new_block(connection, year):
+    """Новый блок: (первый номер, последний номер, можно ли раздавать его дальше)"""
+    if connection.vendor == 'postgresql':
+        return _postgres_block(connection, year)
+    return _counter_block(connection, year)
+
+
+# ============================================================================
+# ВЫДАЧА НОМЕРОВ
+# ============================================================================
+
+def next_order_number(year=None):
+    """Следующий свободный номер заказа за год (по умолчанию - текущий)"""
+    global _blocks_pid
+    year = year or timezone.localdate().year
+    connection = connections[router.db_for_write(Order)]
+    key = (connection.alias, year)
+    with _lock:
+        # Блоки родительского процесса после fork раздавались бы дважды
+        if _blocks_pid != os.getpid():
+            _blocks.clear()
+            _blocks_pid = os.getpid()
+        block = _blocks.get(key)
+        if block is None or block[0] > block[1]:
+            first, last, reusable = _new_block(connection, year)
+            if first > MAX_NUMBER:
+                raise OrderNumbersExhausted(f'Номера заказов за {year} год закончились')
+            block = [first, min(last, MAX_NUMBER)]
+            if reusable:
+                _blocks[key] = block
+            else:
+                _blocks.pop(key, None)
+        number = block[0]
+        block[0] += 1
+    return format_order_number(year, number)
+
+
+def reserve_through(year, number):
+    """
+    Не выдавать номера года до number включительно (после импорта заказов
+    с готовыми номерами). Счётчик только растёт. Блоки, которые другие
+    процессы уже взяли, это не отзывает, поэтому импортировать номера
+    текущего года лучше до запуска приложения.
+    """
+    connection = connections[router.db_for_write(Order)]
+    with _lock:
+        _blocks.pop((connection.alias, year), None)
+    if connection.vendor == 'postgresql':
+        _ensure_sequence(connection, year)
+        block = (number - 1) // BLOCK_SIZE + 1
+        name = _sequence_name(year)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT setval(%s, %s) FROM {name} WHERE last_value < %s", [name, block, block])
+        return
+    counters = OrderNumberCounter.objects.using(connection.alias)
+    with transaction.atomic(using=connection.alias):
+        if not counters.filter(year=year).update(last_number=Greatest('last_number', Value(number))):
+            counters.create(year=year, last_number=max(number, _last_used(year, connection.alias)))
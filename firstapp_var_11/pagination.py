@@ -0,0 +1,276 @@
+"""
+Постраничный вывод: по ключу (keyset) вместо OFFSET и пагинатор
+с приблизительным количеством строк для больших таблиц.
+
+Страница выбирается условием «строки после последней строки предыдущей
+страницы» по полям сортировки, поэтому её стоимость не зависит от номера,
+а вставка новых строк не сдвигает уже показанные. Курсор - подписанный
+токен со значениями полей граничной строки и направлением.
+
+Точный COUNT(*) по большой таблице дороже самой страницы, поэтому для
+нефильтрованных списков EstimatedCountPaginator берёт оценку планировщика
+(pg_class.reltuples в PostgreSQL, sqlite_stat1 в SQLite после ANALYZE).
+"""
+from django.conf import settings
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import F, Q, QuerySet
+from django.utils.functional import cached_property
+
+
+CURSOR_PARAM = 'cursor'
+CURSOR_SALT = 'firstapp_var_11.pagination'
+
+# С какого размера таблицы точный COUNT(*) заменяется оценкой
+DEFAULT_ESTIMATED_COUNT_THRESHOLD = 100000
+
+
+class KeysetPage:
+    """Страница keyset-пагинации; интерфейс похож на django.core.paginator.Page"""
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+def _split(ordering):
+    """'-order_date' -> ('order_date', True)"""
+    return [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+
+def _field(model, name):
+    """Поле модели по имени из сортировки; 'pk' - первичный ключ"""
+    return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+
+def _nullable(model, keys):
+    """Поля сортировки, которые могут быть NULL"""
+    return {name for name, _ in keys if _field(model, name).null}
+
+
+def _order_by(keys, nullable, reverse=False):
+    """
+    Сортировка по keys. У полей с NULL порядок NULL задаётся явно (после
+    значений, а при reverse - перед ними): по умолчанию PostgreSQL и SQLite
+    ставят NULL по-разному, и условие _after не совпало бы с сортировкой.
+    """
+    ordering = []
+    for name, descending in keys:
+        descending = descending != reverse
+        if name not in nullable:
+            ordering.append(f'-{name}' if descending else name)
+            continue
+        nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+        ordering.append(F(name).desc(**nulls) if descending else F(name).asc(**nulls))
+    return ordering
+
+
+def _after(keys, values, reverse=False, nullable=()):
+    """
+    Условие «строка идёт после values» для сортировки keys:
+    (a > x) OR (a = x AND b > y) OR ...
+
+    Для полей из nullable NULL идёт после всех значений (см. _order_by),
+    поэтому сравнение дополняется проверками IS NULL / IS NOT NULL.
+    """
+    condition = Q()
+    for i, (name, descending) in enumerate(keys):
+        value = values[i]
+        if value is None:
+            # За NULL в прямом порядке ничего нет, в обратном перед ним все значения
+            if not reverse:
+                continue
+            step = Q(**{f'{name}__isnull': False})
+        else:
+            lookup = 'lt' if descending != reverse else 'gt'
+            step = Q(**{f'{name}__{lookup}': value})
+            if name in nullable and not reverse:
+                step |= Q(**{f'{name}__isnull': True})
+        for j in range(i):
+            previous = keys[j][0]
+            if values[j] is None:
+                step &= Q(**{f'{previous}__isnull': True})
+            else:
+                step &= Q(**{previous: values[j]})
+        condition |= step
+    return condition
+
+
+def encode_cursor(keys, obj, direction):
+    # None кодируется как null JSON: str() превратил бы его в строку 'None'
+    values = [
+        None if value is None else str(value)
+        for value in (getattr(obj, name) for name, _ in keys)
+    ]
+    return signing.dumps({'v': values, 'd': direction}, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(model, keys, token):
+    """Значения полей и направление из курсора; (None, None) для неверного токена"""
+    try:
+        data = signing.loads(token, salt=CURSOR_SALT)
+        values = [
+            None if value is None else _field(model, name).to_python(value)
+            for (name, _), value in zip(keys, data['v'], strict=True)
+        ]
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None, None
+    return values, data.get('d')
+
+
+def keyset_paginate(queryset, ordering, page_size, token=None):
+    """
+    Страница queryset размером page_size после (или перед) курсором token.
+
+    ordering должен однозначно упорядочивать строки, поэтому последним
+    полем обычно идёт первичный ключ.
+    """
+    keys = _split(ordering)
+    nullable = _nullable(queryset.model, keys)
+    values, direction = decode_cursor(queryset.model, keys, token) if token else (None, None)
+    backwards = direction == 'prev' and values is not None
+
+    if backwards:
+        rows = list(
+            queryset.filter(_after(keys, values, reverse=True, nullable=nullable))
+            .order_by(*_order_by(keys, nullable, reverse=True))[:page_size + 1]
+        )
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if values is not None:
+            queryset = queryset.filter(_after(keys, values, nullable=nullable))
+        rows = list(queryset.order_by(*_order_by(keys, nullable))[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_previous = values is not None
+
+    return KeysetPage(
+        rows,
+        has_next=has_next,
+        has_previous=has_previous and bool(rows),
+        next_cursor=encode_cursor(keys, rows[-1], 'next') if has_next and rows else None,
+        previous_cursor=encode_cursor(keys, rows[0], 'prev') if has_previous and rows else None,
+    )
+
+
+class KeysetPaginationMixin:
+    """
+    Примесь к ListView: keyset-пагинация по ?cursor= вместо ?page=.
+
+    keyset_ordering - поля сортировки; по умолчанию берётся ordering
+    представления с первичным ключом в конце. В шаблоне доступны page_obj
+    (KeysetPage с next_cursor/previous_cursor) и is_paginated.
+    """
+    keyset_ordering = None
+
+    def get_keyset_ordering(self):
+        if self.keyset_ordering:
+            return list(self.keyset_ordering)
+        ordering = list(self.get_ordering() or [])
+        if not any(name.lstrip('-') in ('pk', 'id') for name in ordering):
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-id' if descending else 'id')
+        return ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        page = keyset_paginate(
+            queryset, self.get_keyset_ordering(), page_size,
+            self.request.GET.get(CURSOR_PARAM),
+        )
+        return None, page, page.object_list, page.has_other_pages()
+
+
+# ============================================================================
+# ПРИБЛИЗИТЕЛЬНОЕ КОЛИЧЕСТВО СТРОК
+# ============================================================================
+
+def table_row_estimate(model, using):
+    """Оценка числа строк таблицы по статистике планировщика или None"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [table])
+            row = cursor.fetchone()
+            # -1 - таблица ещё ни разу не анализировалась
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+            except DatabaseError:
+                # sqlite_stat1 появляется только после ANALYZE
+                return None
+            # Первое число в stat - количество строк таблицы (или индекса)
+            counts = [int(stat.split()[0]) for (stat,) in cursor.fetchall() if stat]
+            return max(counts) if counts else None
+    return None
+
+
+def estimated_count(queryset):
+    """
+    Оценка размера queryset, если он не отфильтрован и таблица большая.
+
+    Для фильтрованных, срезанных и DISTINCT-запросов, а также для таблиц
+    меньше ESTIMATED_COUNT_THRESHOLD возвращает None - нужен точный COUNT.
+    """
+    if not isinstance(queryset, QuerySet):
+        return None
+    query = queryset.query
+    if query.has_filters() or query.distinct or query.is_sliced or query.combinator:
+        return None
+    rows = table_row_estimate(queryset.model, queryset.db)
+    threshold = getattr(settings, 'ESTIMATED_COUNT_THRESHOLD', DEFAULT_ESTIMATED_COUNT_THRESHOLD)
+    if rows is None or rows < threshold:
+        return None
+    return rows
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator, который для больших нефильтрованных таблиц берёт оценку
+    количества строк вместо COUNT(*).
+
+    count_is_estimate показывает, что число приблизительное; последняя
+    страница при этом может оказаться неполной или пустой.
+
+    count_queryset - queryset с теми же строками, что object_list, но без
+    лишних для подсчёта аннотаций (агрегаты с GROUP BY мешают COUNT
+    идти по индексам фильтров).
+    """
+    count_is_estimate = False
+
+    def __init__(self, object_list, per_page, *args, count_queryset=None, **kwargs):
+        super().__init__(object_list, per_page, *args, **kwargs)
+        self.count_queryset = count_queryset
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list if self.count_queryset is None else self.count_queryset
+        estimate = estimated_count(queryset)
+        if estimate is not None:
+            self.count_is_estimate = True
+            return estimate
+        if self.count_queryset is not None:
+            return self.count_queryset.count()
+        return super().count
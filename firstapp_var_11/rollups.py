@@ -0,0 +1,256 @@
+"""
+Поддержка агрегатных таблиц SalesDailyRollup и ProductSalesDaily.
+
+Создание покупки обновляет итог дня одним UPDATE с F-выражениями.
+Изменение и удаление пересчитывают только затронутый день и способ
+оплаты, потому что минимум и максимум нельзя уменьшить инкрементально.
+
+Продажи товаров по дням хранят только суммы, поэтому любое изменение
+позиции заказа применяется как разность старого и нового вклада.
+
+Сумма заказа (Order.total_amount) пересчитывается одним UPDATE с
+подзапросом SUM по его позициям в той же транзакции, что и изменение
+позиции; recompute_order_totals делает то же для диапазона заказов.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import (
+    Count, Sum, Min, Max, F, DateField, DecimalField, ExpressionWrapper, OuterRef, Subquery, Value,
+)
+from django.db.models.functions import Coalesce, Greatest, Least, Trunc
+from django.utils import timezone
+
+from .analytics_cache import bump_version
+from .models import Order, OrderItem, Purchase, ProductSalesDaily, SalesDailyRollup
+
+
+# Агрегаты покупок для строки итогов. Имена не совпадают с полями Purchase,
+# иначе Min('total_amount') сослался бы на уже вычисленную сумму
+ROLLUP_AGGREGATES = {
+    'rollup_count': Count('id'),
+    'rollup_total': Sum('total_amount'),
+    'rollup_min': Min('total_amount'),
+    'rollup_max': Max('total_amount'),
+}
+
+
+def _rollup_values(row):
+    """Поля SalesDailyRollup из строки с ROLLUP_AGGREGATES"""
+    return {
+        'purchase_count': row['rollup_count'],
+        'total_amount': row['rollup_total'],
+        'min_amount': row['rollup_min'],
+        'max_amount': row['rollup_max'],
+    }
+
+
+def rollup_day(purchase_date):
+    """День покупки в часовом поясе TIME_ZONE"""
+    return timezone.localdate(purchase_date)
+
+
+def _day_bounds(start, end):
+    """Границы [start, end] в виде aware datetime для фильтра по purchase_date"""
+    tz = timezone.get_current_timezone()
+    return (
+        timezone.make_aware(datetime.combine(start, time.min), tz),
+        timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz),
+    )
+
+
+def add_purchase(purchase):
+    """Учесть новую покупку в итоге её дня"""
+    day = rollup_day(purchase.purchase_date)
+    amount = purchase.total_amount
+    rows = SalesDailyRollup.objects.filter(day=day, payment_method=purchase.payment_method)
+    changes = {
+        'purchase_count': F('purchase_count') + 1,
+        'total_amount': F('total_amount') + amount,
+        'min_amount': Least('min_amount', amount),
+        'max_amount': Greatest('max_amount', amount),
+    }
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            SalesDailyRollup.objects.create(
+                day=day,
+                payment_method=purchase.payment_method,
+                purchase_count=1,
+                total_amount=amount,
+                min_amount=amount,
+                max_amount=amount,
+            )
+    except IntegrityError:
+        # Строку за этот день успел создать параллельный запрос
+        rows.update(**changes)
+
+
+def refresh_day(day, payment_method):
+    """Пересчитать итог одного дня и способа оплаты по таблице Purchase"""
+    start_dt, end_dt = _day_bounds(day, day)
+    totals = Purchase.objects.filter(
+        purchase_date__gte=start_dt,
+        purchase_date__lt=end_dt,
+        payment_method=payment_method,
+    ).aggregate(**ROLLUP_AGGREGATES)
+    totals = _rollup_values(totals)
+    if not totals['purchase_count']:
+        SalesDailyRollup.objects.filter(day=day, payment_method=payment_method).delete()
+        return
+    SalesDailyRollup.objects.update_or_create(
+        day=day, payment_method=payment_method, defaults=totals
+    )
+
+
+def rebuild_range(start, end):
+    """
+    Перестроить итоги за дни [start, end] одним GROUP BY запросом.
+
+    Возвращает количество записанных строк итогов.
+    """
+    tz = timezone.get_current_timezone()
+    start_dt, end_dt = _day_bounds(start, end)
+    rows = (
+        Purchase.objects
+        .filter(purchase_date__gte=start_dt, purchase_date__lt=end_dt)
+        .annotate(day=Trunc('purchase_date', 'day', output_field=DateField(), tzinfo=tz))
+        .values('day', 'payment_method')
+        .annotate(**ROLLUP_AGGREGATES)
+        .order_by()
+    )
+    rollups = [
+        SalesDailyRollup(day=row['day'], payment_method=row['payment_method'], **_rollup_values(row))
+        for row in rows
+    ]
+    with transaction.atomic():
+        SalesDailyRollup.objects.filter(day__range=(start, end)).delete()
+        SalesDailyRollup.objects.bulk_create(rollups)
+    # bulk_create не посылает сигналов, а отчёты по покупкам читают эти итоги
+    bump_version(Purchase)
+    return len(rollups)
+
+
+# ============================================================================
+# ПРОДАЖИ ТОВАРОВ ПО ДНЯМ (ProductSalesDaily)
+# ============================================================================
+
+# Выручка позиции с учётом скидки на позицию, как в OrderItem.get_subtotal()
+# (умножение на 0.01 вместо деления на 100, чтобы SQLite не делил нацело)
+LINE_REVENUE = ExpressionWrapper(
+    F('unit_price') * F('quantity') * (100 - F('discount_percent')) * Value(Decimal('0.01')),
+    output_field=DecimalField(max_digits=14, decimal_places=2),
+)
+
+
+def order_item_contribution(item, order_date=None, order_status=None):
+    """
+    Вклад позиции заказа в продажи: (день, товар, единицы, выручка).
+
+    Позиции отменённых заказов в продажи не входят, для них возвращается None.
+    """
+    if order_date is None or order_status is None:
+        order = Order.objects.filter(pk=item.order_id).values_list('order_date', 'status').first()
+        if order is None:
+            return None
+        order_date, order_status = order
+    if order_status == 'cancelled':
+        return None
+    return order_date, item.assortment_id, item.quantity, item.get_subtotal()
+
+
+def apply_product_sales(day, assortment_id, units, revenue):
+    """Прибавить (или вычесть при отрицательных значениях) продажи товара за день"""
+    if not units and not revenue:
+        return
+    rows = ProductSalesDaily.objects.filter(day=day, assortment_id=assortment_id)
+    changes = {'units': F('units') + units, 'revenue': F('revenue') + revenue}
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic(using=router.db_for_write(ProductSalesDaily)):
+            ProductSalesDaily.objects.create(
+                day=day, assortment_id=assortment_id, units=units, revenue=revenue
+            )
+    except IntegrityError:
+        # Строку за этот день успел создать параллельный запрос
+        rows.update(**changes)
+
+
+def apply_order_sales(order, sign, day=None):
+    """
+    Добавить (sign=1) или убрать (sign=-1) все позиции заказа из продаж
+    за день day (по умолчанию - день заказа)
+    """
+    rows = (
+        OrderItem.objects
+        .filter(order_id=order.pk)
+        .values('assortment_id')
+        .annotate(units=Sum('quantity'), revenue=Sum(LINE_REVENUE))
+        .order_by()
+    )
+    for row in rows:
+        apply_product_sales(
+            day or order.order_date, row['assortment_id'],
+            sign * row['units'], sign * (row['revenue'] or 0),
+        )
+
+
+def rebuild_product_sales(start, end):
+    """
+    Перестроить продажи товаров за дни [start, end] одним GROUP BY запросом.
+
+    Возвращает количество записанных строк.
+    """
+    rows = (
+        OrderItem.objects
+        .filter(order__order_date__range=(start, end))
+        .exclude(order__status='cancelled')
+        .values('order__order_date', 'assortment_id')
+        .annotate(units=Sum('quantity'), revenue=Sum(LINE_REVENUE))
+        .order_by()
+    )
+    sales = [
+        ProductSalesDaily(
+            day=row['order__order_date'],
+            assortment_id=row['assortment_id'],
+            units=row['units'],
+            revenue=row['revenue'] or 0,
+        )
+        for row in rows
+    ]
+    with transaction.atomic(using=router.db_for_write(ProductSalesDaily)):
+        ProductSalesDaily.objects.filter(day__range=(start, end)).delete()
+        ProductSalesDaily.objects.bulk_create(sales)
+    bump_version(OrderItem)
+    return len(sales)
+
+
+# ============================================================================
+# СУММА ЗАКАЗА (Order.total_amount)
+# ============================================================================
+
+def order_total():
+    """Сумма подытогов позиций заказа (как get_subtotal), подзапрос для UPDATE"""
+    total = (
+        OrderItem.objects.filter(order=OuterRef('pk'))
+        .order_by().values('order').annotate(total=Sum(LINE_REVENUE)).values('total')
+    )
+    return Coalesce(Subquery(total), Value(Decimal('0')), output_field=DecimalField(max_digits=10, decimal_places=2))
+
+
+def refresh_order_total(order_id):
+    """Пересчитать сумму одного заказа по его позициям"""
+    Order.objects.filter(pk=order_id).update(total_amount=order_total())
+
+
+def recompute_order_totals(first_id, last_id):
+    """
+    Пересчитать суммы заказов с id в [first_id, last_id] одним UPDATE.
+
+    Возвращает количество обновлённых заказов.
+    """
+    with transaction.atomic(using=router.db_for_write(Order)):
+        return Order.objects.filter(pk__range=(first_id, last_id)).update(total_amount=order_total())
@@ -0,0 +1,253 @@
+"""
+Полнотекстовый поиск по ассортименту.
+
+Индекс - отдельная таблица assortment_search, которую заполняют триггеры
+базы, Django в неё не пишет. В SQLite это виртуальная таблица FTS5
+(rowid = id товара; колонки name, type_name, description), в PostgreSQL -
+таблица с колонкой tsvector под GIN-индексом. ORM обращается к индексу
+через неуправляемую модель AssortmentSearch, поэтому поиск сочетается
+с фильтрами каталога в одном запросе.
+
+Миграции SQLite, изменяющие таблицу ассортимента, пересоздают её и
+теряют триггеры; после них нужно выполнить manage.py rebuild_search_index.
+"""
+import re
+
+from django.db import NotSupportedError, models
+
+
+SEARCH_TABLE = 'assortment_search'
+ASSORTMENT_TABLE = 'firstapp_var_11_assortment'
+CLOTHES_TYPE_TABLE = 'firstapp_var_11_clothestype'
+
+# Ранжирование FTS5: bm25 с весами колонок name, type_name, description
+SQLITE_RANK_FUNCTION = 'bm25(10.0, 5.0, 1.0)'
+# Конфигурация текстового поиска PostgreSQL
+POSTGRES_CONFIG = 'russian'
+
+# Из запроса берутся только слова, не больше MAX_TERMS
+MAX_TERMS = 8
+WORD_RE = re.compile(r'\w+')
+
+
+# ============================================================================
+# SQLITE: FTS5
+# ============================================================================
+
+SQLITE_INSTALL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        name, type_name, description, tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    # Функция ранжирования для скрытой колонки rank
+    f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', '{SQLITE_RANK_FUNCTION}')",
+    f"""CREATE TRIGGER IF NOT EXISTS assortment_search_insert
+        AFTER INSERT ON {ASSORTMENT_TABLE}
+    BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, name, type_name, description)
+        VALUES (
+            new.id, new.name,
+            (SELECT name FROM {CLOTHES_TYPE_TABLE} WHERE id = new.clothes_type_id),
+            new.description
+        );
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS assortment_search_update
+        AFTER UPDATE OF name, description, clothes_type_id ON {ASSORTMENT_TABLE}
+    BEGIN
+        UPDATE {SEARCH_TABLE} SET
+            name = new.name,
+            type_name = (SELECT name FROM {CLOTHES_TYPE_TABLE} WHERE id = new.clothes_type_id),
+            description = new.description
+        WHERE rowid = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS assortment_search_delete
+        AFTER DELETE ON {ASSORTMENT_TABLE}
+    BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS clothestype_search_update
+        AFTER UPDATE OF name ON {CLOTHES_TYPE_TABLE}
+    BEGIN
+        UPDATE {SEARCH_TABLE} SET type_name = new.name
+        WHERE rowid IN (SELECT id FROM {ASSORTMENT_TABLE} WHERE clothes_type_id = new.id);
+    END""",
+]
+
+SQLITE_REBUILD = [
+    f"DELETE FROM {SEARCH_TABLE}",
+    f"""INSERT INTO {SEARCH_TABLE} (rowid, name, type_name, description)
+        SELECT a.id, a.name, t.name, a.description
+        FROM {ASSORTMENT_TABLE} a JOIN {CLOTHES_TYPE_TABLE} t ON t.id = a.clothes_type_id""",
+    # Слить сегменты индекса в один - быстрее последующие запросы
+    f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')",
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS assortment_search_insert",
+    "DROP TRIGGER IF EXISTS assortment_search_update",
+    "DROP TRIGGER IF EXISTS assortment_search_delete",
+    "DROP TRIGGER IF EXISTS clothestype_search_update",
+    f"DROP TABLE IF EXISTS {SEARCH_TABLE}",
+]
+
+
+# ============================================================================
+# POSTGRESQL: TSVECTOR
+# ============================================================================
+
+POSTGRES_INSTALL = [
+    f"""CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} (
+        rowid bigint PRIMARY KEY REFERENCES {ASSORTMENT_TABLE} (id) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )""",
+    f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)",
+    f"""CREATE OR REPLACE FUNCTION {SEARCH_TABLE}_document(a_name text, a_type text, a_description text)
+    RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('{POSTGRES_CONFIG}', coalesce(a_name, '')), 'A')
+            || setweight(to_tsvector('{POSTGRES_CONFIG}', coalesce(a_type, '')), 'B')
+            || setweight(to_tsvector('{POSTGRES_CONFIG}', coalesce(a_description, '')), 'D')
+    $$ LANGUAGE sql IMMUTABLE""",
+    f"""CREATE OR REPLACE FUNCTION assortment_search_sync() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, document)
+        SELECT NEW.id, {SEARCH_TABLE}_document(NEW.name, t.name, NEW.description)
+        FROM {CLOTHES_TYPE_TABLE} t WHERE t.id = NEW.clothes_type_id
+        ON CONFLICT (rowid) DO UPDATE SET document = EXCLUDED.document;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""",
+    f"DROP TRIGGER IF EXISTS assortment_search_sync ON {ASSORTMENT_TABLE}",
+    f"""CREATE TRIGGER assortment_search_sync
+        AFTER INSERT OR UPDATE OF name, description, clothes_type_id ON {ASSORTMENT_TABLE}
+        FOR EACH ROW EXECUTE FUNCTION assortment_search_sync()""",
+    f"""CREATE OR REPLACE FUNCTION clothestype_search_sync() RETURNS trigger AS $$
+    BEGIN
+        UPDATE {SEARCH_TABLE} s
+        SET document = {SEARCH_TABLE}_document(a.name, NEW.name, a.description)
+        FROM {ASSORTMENT_TABLE} a
+        WHERE a.clothes_type_id = NEW.id AND s.rowid = a.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""",
+    f"DROP TRIGGER IF EXISTS clothestype_search_sync ON {CLOTHES_TYPE_TABLE}",
+    f"""CREATE TRIGGER clothestype_search_sync
+        AFTER UPDATE OF name ON {CLOTHES_TYPE_TABLE}
+        FOR EACH ROW EXECUTE FUNCTION clothestype_search_sync()""",
+]
+
+POSTGRES_REBUILD = [
+    f"TRUNCATE {SEARCH_TABLE}",
+    f"""INSERT INTO {SEARCH_TABLE} (rowid, document)
+        SELECT a.id, {SEARCH_TABLE}_document(a.name, t.name, a.description)
+        FROM {ASSORTMENT_TABLE} a JOIN {CLOTHES_TYPE_TABLE} t ON t.id = a.clothes_type_id""",
+]
+
+POSTGRES_UNINSTALL = [
+    f"DROP TRIGGER IF EXISTS assortment_search_sync ON {ASSORTMENT_TABLE}",
+    f"DROP TRIGGER IF EXISTS clothestype_search_sync ON {CLOTHES_TYPE_TABLE}",
+    "DROP FUNCTION IF EXISTS assortment_search_sync()",
+    "DROP FUNCTION IF EXISTS clothestype_search_sync()",
+    f"DROP TABLE IF EXISTS {SEARCH_TABLE}",
+    f"DROP FUNCTION IF EXISTS {SEARCH_TABLE}_document(text, text, text)",
+]
+
+
+def _statements(connection, sqlite, postgres):
+    if connection.vendor == 'sqlite':
+        return sqlite
+    if connection.vendor == 'postgresql':
+        return postgres
+    raise NotSupportedError(f'Полнотекстовый поиск не поддерживается для {connection.vendor}')
+
+
+def _execute(connection, statements):
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def install_search_index(connection):
+    """Создать таблицу индекса и триггеры (повторный вызов безопасен)"""
+    _execute(connection, _statements(connection, SQLITE_INSTALL, POSTGRES_INSTALL))
+
+
+def rebuild_search_index(connection):
+    """Заново заполнить индекс по всем товарам"""
+    _execute(connection, _statements(connection, SQLITE_REBUILD, POSTGRES_REBUILD))
+
+
+def uninstall_search_index(connection):
+    _execute(connection, _statements(connection, SQLITE_UNINSTALL, POSTGRES_UNINSTALL))
+
+
+# ============================================================================
+# ЗАПРОСЫ
+# ============================================================================
+
+def search_terms(text):
+    """Слова запроса в нижнем регистре; кавычки и операторы отбрасываются"""
+    return WORD_RE.findall((text or '').lower())[:MAX_TERMS]
+
+
+def fts5_query(text):
+    """'синее плат' -> '"синее"* "плат"*' (все слова, поиск по префиксу)"""
+    return ' '.join(f'"{term}"*' for term in search_terms(text))
+
+
+def tsquery_text(text):
+    """'синее плат' -> 'синее:* & плат:*' для to_tsquery"""
+    return ' & '.join(f'{term}:*' for term in search_terms(text))
+
+
+class SearchDocumentField(models.TextField):
+    """
+    Документ поискового индекса. Поддерживает только поиск (lookup matches)
+    и SearchRank; в SQLite такой колонки нет, запрос идёт к таблице FTS5.
+    """
+
+
+@SearchDocumentField.register_lookup
+class Matches(models.Lookup):
+    """document__matches='текст запроса' - все слова запроса, по префиксу"""
+    lookup_name = 'matches'
+    prepare_rhs = False
+
+    def as_sqlite(self, compiler, connection):
+        # MATCH в FTS5 применяется к скрытой колонке с именем таблицы
+        table = compiler.quote_name_unless_alias(self.lhs.alias)
+        return f'{table} MATCH %s', [fts5_query(self.rhs)]
+
+    def as_postgresql(self, compiler, connection):
+        document, params = compiler.compile(self.lhs)
+        return f"{document} @@ to_tsquery('{POSTGRES_CONFIG}', %s)", [*params, tsquery_text(self.rhs)]
+
+    def as_sql(self, compiler, connection):
+        raise NotSupportedError(f'Полнотекстовый поиск не поддерживается для {connection.vendor}')
+
+
+class SearchRank(models.Func):
+    """
+    Релевантность строки для запроса text (больше - лучше).
+
+    Используется вместе с фильтром document__matches по тому же полю:
+    в SQLite это bm25 с весами колонок, в PostgreSQL - ts_rank_cd().
+    """
+    output_field = models.FloatField()
+
+    def __init__(self, document, text):
+        self.text = text
+        super().__init__(document)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Скрытая колонка rank (SQLITE_RANK_FUNCTION), в отличие от вызова
+        # bm25(), допустима и в запросах с GROUP BY. bm25 отрицательна:
+        # чем меньше, тем релевантнее
+        table = compiler.quote_name_unless_alias(self.source_expressions[0].alias)
+        return f'-{table}.rank', []
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        document, params = compiler.compile(self.source_expressions[0])
+        sql = f"ts_rank_cd({document}, to_tsquery('{POSTGRES_CONFIG}', %s))"
+        return sql, [*params, tsquery_text(self.text)]
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f'Полнотекстовый поиск не поддерживается для {connection.vendor}')
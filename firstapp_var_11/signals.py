@@ -0,0 +1,234 @@
+"""
+Обработчики сигналов моделей приложения.
+
+Подключаются в FirstappVar11Config.ready().
+"""
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import facets, inventory, rollups
+from .analytics_cache import VERSIONED_MODELS, bump_version
+from .models import Assortment, AssortmentSize, ClothesType, Order, OrderItem, Purchase, Size
+
+
+# ============================================================================
+# ИТОГИ ПРОДАЖ ПО ДНЯМ (SalesDailyRollup)
+# ============================================================================
+
+@receiver(pre_save, sender=Purchase)
+def remember_purchase_rollup_key(sender, instance, **kwargs):
+    """Запоминаем день и способ оплаты до изменения покупки"""
+    instance._rollup_previous = None
+    if instance.pk:
+        instance._rollup_previous = (
+            Purchase.objects
+            .filter(pk=instance.pk)
+            .values_list('purchase_date', 'payment_method')
+            .first()
+        )
+
+
+@receiver(post_save, sender=Purchase)
+def update_rollup_on_purchase_save(sender, instance, created, raw=False, **kwargs):
+    """Новая покупка добавляется к итогу, изменённая - пересчитывает свои дни"""
+    if raw:
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    if created or previous is None:
+        rollups.add_purchase(instance)
+        return
+
+    affected = {(rollups.rollup_day(instance.purchase_date), instance.payment_method)}
+    affected.add((rollups.rollup_day(previous[0]), previous[1]))
+    for day, payment_method in affected:
+        rollups.refresh_day(day, payment_method)
+
+
+@receiver(post_delete, sender=Purchase)
+def update_rollup_on_purchase_delete(sender, instance, **kwargs):
+    """Удалённая покупка пересчитывает итог своего дня"""
+    rollups.refresh_day(rollups.rollup_day(instance.purchase_date), instance.payment_method)
+
+
+# ============================================================================
+# ПРОДАЖИ ТОВАРОВ ПО ДНЯМ (ProductSalesDaily)
+# ============================================================================
+
+@receiver(pre_save, sender=OrderItem)
+def remember_order_item_contribution(sender, instance, raw=False, **kwargs):
+    """Запоминаем вклад позиции в продажи до её изменения"""
+    instance._sales_previous = None
+    instance._order_previous = None
+    if raw or not instance.pk:
+        return
+    previous = OrderItem.objects.filter(pk=instance.pk).first()
+    if previous is not None:
+        instance._sales_previous = rollups.order_item_contribution(previous)
+        instance._order_previous = previous.order_id
+
+
+@receiver(post_save, sender=OrderItem)
+def update_product_sales_on_item_save(sender, instance, raw=False, **kwargs):
+    """Применяем разность между старым и новым вкладом позиции"""
+    if raw:
+        return
+    previous = getattr(instance, '_sales_previous', None)
+    if previous is not None:
+        day, assortment_id, units, revenue = previous
+        rollups.apply_product_sales(day, assortment_id, -units, -revenue)
+    current = rollups.order_item_contribution(instance)
+    if current is not None:
+        rollups.apply_product_sales(*current)
+
+
+@receiver(post_delete, sender=OrderItem)
+def update_product_sales_on_item_delete(sender, instance, **kwargs):
+    """Удалённая позиция вычитается из продаж"""
+    current = rollups.order_item_contribution(instance)
+    if current is not None:
+        day, assortment_id, units, revenue = current
+        rollups.apply_product_sales(day, assortment_id, -units, -revenue)
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_status(sender, instance, raw=False, **kwargs):
+    """Запоминаем статус и дату заказа до изменения"""
+    instance._status_previous = None
+    instance._order_date_previous = None
+    if not raw and instance.pk:
+        previous = Order.objects.filter(pk=instance.pk).values_list('status', 'order_date').first()
+        if previous is not None:
+            instance._status_previous, instance._order_date_previous = previous
+
+
+@receiver(post_save, sender=Order)
+def update_product_sales_on_cancel(sender, instance, created, raw=False, **kwargs):
+    """
+    Отмена заказа убирает его позиции из продаж, возврат из отмены -
+    добавляет. Смена даты заказа переносит продажи на новый день.
+    """
+    previous = getattr(instance, '_status_previous', None)
+    if raw or created or previous is None:
+        return
+    was_counted = previous != 'cancelled'
+    is_counted = instance.status != 'cancelled'
+    previous_date = instance._order_date_previous
+    if was_counted and (not is_counted or previous_date != instance.order_date):
+        rollups.apply_order_sales(instance, -1, day=previous_date)
+    if is_counted and (not was_counted or previous_date != instance.order_date):
+        rollups.apply_order_sales(instance, 1)
+
+
+# ============================================================================
+# СУММА ЗАКАЗА (Order.total_amount)
+# ============================================================================
+
+def _refresh_order_totals(*order_ids):
+    for order_id in set(order_ids):
+        rollups.refresh_order_total(order_id)
+    # update() сигналов не вызывает - отчёты по заказам сбрасываем сами
+    transaction.on_commit(lambda: bump_version(Order), using=router.db_for_write(Order))
+
+
+@receiver(post_save, sender=OrderItem)
+def update_order_total_on_item_save(sender, instance, raw=False, **kwargs):
+    """Сумма заказа пересчитывается в той же транзакции, что и позиция"""
+    if raw:
+        return
+    previous = getattr(instance, '_order_previous', None)
+    _refresh_order_totals(instance.order_id, *([previous] if previous else []))
+
+
+@receiver(post_delete, sender=OrderItem)
+def update_order_total_on_item_delete(sender, instance, **kwargs):
+    _refresh_order_totals(instance.order_id)
+
+# ============================================================================
+# РЕЗЕРВ ТОВАРА НА СКЛАДЕ
+# ============================================================================
+# Резерв под новую или изменённую позицию берут представления и админка
+# (inventory.reserve_items) до сохранения и отмечают его флагом
+# OrderItem.reserved; здесь - возврат товара отмеченных позиций
+# при удалении позиции и при отмене заказа. Общий остаток товара
+# по остаткам размеров пересчитывают триггеры базы (inventory.py)
+
+@receiver(post_delete, sender=OrderItem)
+def release_stock_on_item_delete(sender, instance, **kwargs):
+    """Удалённая позиция с резервом возвращает товар на склад"""
+    if not instance.reserved:
+        return
+    line = inventory.item_line(instance)
+    transaction.on_commit(lambda: inventory.release_lines([line]), using=router.db_for_write(OrderItem))
+
+
+@receiver([post_save, post_delete], sender=AssortmentSize)
+def bump_stock_total_version(sender, raw=False, **kwargs):
+    """Остаток по размеру меняет и общий остаток товара (триггер базы)"""
+    if raw:
+        return
+    transaction.on_commit(lambda: bump_version(Assortment), using=router.db_for_write(AssortmentSize))
+
+
+@receiver(post_save, sender=Order)
+def update_stock_on_cancel(sender, instance, created, raw=False, **kwargs):
+    """
+    Отмена заказа возвращает на склад товар позиций с резервом после
+    фиксации. Возврат из отмены резервирует все позиции заказа; если
+    товара не хватает, ValidationError откатывает смену статуса
+    (сохранение должно идти в transaction.atomic внутри
+    inventory.release_on_rollback, как в OrderUpdateView и админке).
+    """
+    previous = getattr(instance, '_status_previous', None)
+    if raw or created or previous is None:
+        return
+    was_cancelled = previous == 'cancelled'
+    is_cancelled = instance.status == 'cancelled'
+    if is_cancelled and not was_cancelled:
+        inventory.release_order(instance.pk)
+    elif was_cancelled and not is_cancelled:
+        if not inventory.reserve_order(instance.pk):
+            raise ValidationError('Недостаточно товара на складе, чтобы вернуть заказ из отмены')
+
+# ============================================================================
+# ВЕРСИИ ТАБЛИЦ ДЛЯ КЭША АНАЛИТИКИ
+# ============================================================================
+# Подключаются последними, чтобы версия менялась уже после обновления
+# агрегатных таблиц выше
+
+@receiver([post_save, post_delete])
+def bump_analytics_version(sender, **kwargs):
+    """Изменение данных делает устаревшими кэшированные отчёты по этой таблице"""
+    if sender not in VERSIONED_MODELS:
+        return
+    # После фиксации транзакции, иначе отчёт может быть пересчитан
+    # по старым данным и сохранён уже под новой версией
+    transaction.on_commit(lambda: bump_version(sender), using=router.db_for_write(sender))
+
+
+# ============================================================================
+# ФАСЕТНЫЙ ИНДЕКС КАТАЛОГА
+# ============================================================================
+# После bump_analytics_version: индекс сверяет уже новые версии таблиц
+
+@receiver([post_save, post_delete], sender=Assortment)
+@receiver([post_save, post_delete], sender=AssortmentSize)
+def update_facet_index(sender, instance, raw=False, **kwargs):
+    """Товар перечитывается в фасетный индекс процесса после фиксации"""
+    if raw:
+        return
+    pk = instance.pk if sender is Assortment else instance.assortment_id
+    transaction.on_commit(lambda: facets.refresh_item(pk, sender), using=router.db_for_write(sender))
+
+
+@receiver(post_save, sender=ClothesType)
+@receiver(post_save, sender=Size)
+def update_facet_labels(sender, instance, raw=False, **kwargs):
+    """Новое название типа одежды или размера в подписях фасетов"""
+    if raw:
+        return
+    facet, label = ('clothes_type', instance.name) if sender is ClothesType else ('size', str(instance))
+    transaction.on_commit(
+        lambda: facets.set_label(facet, instance.pk, label), using=router.db_for_write(sender)
+    )
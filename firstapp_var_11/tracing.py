@@ -0,0 +1,260 @@
+"""
+Трассировка запросов: решения маршрутизатора БД, SQL-запросы и участки view.
+
+Трасса создаётся TracingMiddleware для доли запросов TRACING_SAMPLE_RATE
+и хранится в contextvar. span() и event() без активной трассы сразу
+возвращаются, поэтому при выключенной трассировке (TRACING_ENABLED = False
+или запрос не попал в выборку) их цена - одно чтение contextvar.
+
+Завершённые трассы попадают в кольцевой буфер последних TRACING_BUFFER_SIZE
+трасс, а при заданном TRACING_LOG_FILE ещё и в очередь фонового потока,
+который дописывает их в файл в формате JSON Lines. Запрос к файлу
+никогда не обращается.
+"""
+import contextvars
+import json
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+DEFAULT_SAMPLE_RATE = 0.01
+DEFAULT_BUFFER_SIZE = 200
+
+# Длина SQL, сохраняемого в span запроса
+MAX_SQL_LENGTH = 500
+
+_current = contextvars.ContextVar('firstapp_trace', default=None)
+
+
+class Trace:
+    """Одна трасса: плоский список span с указанием родителя"""
+
+    def __init__(self, name):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.stack = []
+
+    def as_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'timestamp': self.started,
+            'spans': self.spans,
+        }
+
+
+class _Span:
+    """Участок трассы; длительность и ошибка записываются при выходе"""
+
+    __slots__ = ('trace', 'record', 'start')
+
+    def __init__(self, trace, name, data):
+        self.trace = trace
+        self.record = {
+            'id': len(trace.spans),
+            'parent': trace.stack[-1] if trace.stack else None,
+            'name': name,
+            'data': data,
+        }
+        trace.spans.append(self.record)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.record['offset_ms'] = (self.start - self.trace.origin) * 1000
+        self.trace.stack.append(self.record['id'])
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record['duration_ms'] = (time.perf_counter() - self.start) * 1000
+        if exc_type is not None:
+            self.record['error'] = exc_type.__name__
+        self.trace.stack.pop()
+        return False
+
+
+class _NoopSpan:
+    """Span без трассы: ничего не делает"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, **data):
+    """Контекстный менеджер участка трассы (no-op без активной трассы)"""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return _Span(trace, name, data)
+
+
+def event(name, **data):
+    """Мгновенное событие в текущей трассе (например, решение маршрутизатора)"""
+    trace = _current.get()
+    if trace is None:
+        return
+    trace.spans.append({
+        'id': len(trace.spans),
+        'parent': trace.stack[-1] if trace.stack else None,
+        'name': name,
+        'data': data,
+        'offset_ms': (time.perf_counter() - trace.origin) * 1000,
+    })
+
+
+# ============================================================================
+# ХРАНЕНИЕ ЗАВЕРШЁННЫХ ТРАСС
+# ============================================================================
+
+_buffer = None
+_writer_queue = None
+_writer_lock = threading.Lock()
+dropped_traces = 0
+
+
+def _buffer_size():
+    return getattr(settings, 'TRACING_BUFFER_SIZE', DEFAULT_BUFFER_SIZE)
+
+
+def _write_loop(path, pending):
+    """Фоновый поток: дописывает трассы из очереди в файл JSON Lines"""
+    while True:
+        record = pending.get()
+        batch = [record]
+        # Забираем всё, что успело накопиться, и пишем одним вызовом
+        while True:
+            try:
+                batch.append(pending.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(item, default=str) + '\n' for item in batch)
+        except OSError:
+            pass
+
+
+def _get_writer_queue():
+    """Очередь фонового писателя; поток запускается при первой трассе"""
+    global _writer_queue
+    path = getattr(settings, 'TRACING_LOG_FILE', None)
+    if not path:
+        return None
+    if _writer_queue is None:
+        with _writer_lock:
+            if _writer_queue is None:
+                pending = queue.Queue(maxsize=_buffer_size())
+                threading.Thread(
+                    target=_write_loop, args=(path, pending), name='trace-writer', daemon=True
+                ).start()
+                _writer_queue = pending
+    return _writer_queue
+
+
+def _store(trace):
+    global _buffer, dropped_traces
+    record = trace.as_dict()
+    if _buffer is None:
+        _buffer = deque(maxlen=_buffer_size())
+    # deque.append потокобезопасен, блокировка не нужна
+    _buffer.append(record)
+    pending = _get_writer_queue()
+    if pending is not None:
+        try:
+            pending.put_nowait(record)
+        except queue.Full:
+            # Писатель не успевает: лучше потерять трассу, чем ждать диск
+            dropped_traces += 1
+
+
+def recent_traces(limit=None):
+    """Последние завершённые трассы, новые первыми"""
+    traces = list(reversed(_buffer or ()))
+    return traces[:limit] if limit else traces
+
+
+class traced:
+    """
+    Контекстный менеджер трассы: активирует её на время блока и сохраняет
+    по завершении. Подходит и для management-команд.
+    """
+
+    def __init__(self, name, **data):
+        self.trace = Trace(name)
+        self.data = data
+        self.stack = ExitStack()
+
+    def __enter__(self):
+        self.token = _current.set(self.trace)
+        self.stack.enter_context(_Span(self.trace, self.trace.name, self.data))
+        for alias in connections:
+            self.stack.enter_context(connections[alias].execute_wrapper(_QueryTracer(alias)))
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.stack.__exit__(exc_type, exc, tb)
+        finally:
+            _current.reset(self.token)
+            _store(self.trace)
+        return False
+
+
+class _QueryTracer:
+    """execute_wrapper, записывающий каждый SQL-запрос как span"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __call__(self, execute, sql, params, many, context):
+        trace = _current.get()
+        if trace is None:
+            return execute(sql, params, many, context)
+        with _Span(trace, 'db.query', {'db': self.alias, 'sql': sql[:MAX_SQL_LENGTH], 'many': many}):
+            return execute(sql, params, many, context)
+
+
+# ============================================================================
+# MIDDLEWARE
+# ============================================================================
+
+class TracingMiddleware:
+    """
+    Трассирует долю запросов TRACING_SAMPLE_RATE.
+
+    При TRACING_ENABLED = False Django исключает middleware из цепочки.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'TRACING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'TRACING_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        with traced(f'{request.method} {request.path}') as trace:
+            response = self.get_response(request)
+            trace.spans[0]['data']['status'] = response.status_code
+        response['X-Trace-Id'] = trace.trace_id
+        return response
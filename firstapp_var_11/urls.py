@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views, views_crud
+from . import views, views_api, views_crud
 
 # app_name убран, чтобы главная страница была доступна без префикса
 # Если нужно использовать пространство имен, используйте 'clothing_app:' в шаблонах
@@ -18,6 +18,7 @@ urlpatterns = [
     path('buyers/', views_crud.BuyerListView.as_view(), name='buyer_list'),
     path('buyers/new/', views_crud.BuyerCreateView.as_view(), name='buyer_create'),
     path('buyers/<int:pk>/', views_crud.BuyerDetailView.as_view(), name='buyer_detail'),
+    path('buyers/<int:pk>/purchases/', views_crud.BuyerPurchasesView.as_view(), name='buyer_purchase_history'),
     path('buyers/<int:pk>/edit/', views_crud.BuyerUpdateView.as_view(), name='buyer_update'),
     path('buyers/<int:pk>/delete/', views_crud.BuyerDeleteView.as_view(), name='buyer_delete'),
 
@@ -74,6 +75,17 @@ urlpatterns = [
     path('analytics/inventory-status/', views.inventory_status, name='inventory_status'),
     path('analytics/top-products/', views.top_products, name='top_products'),
     path('analytics/purchase-trends/', views.purchase_trends, name='purchase_trends'),
+    path('analytics/purchase-trends/json/', views.purchase_trends_json, name='purchase_trends_json'),
+    path('analytics/cache-stats/', views.analytics_cache_stats, name='analytics_cache_stats'),
+    path('analytics/traces/', views.analytics_traces, name='analytics_traces'),
+
+    # JSON API каталога (только чтение, ETag и 304 Not Modified)
+    path('api/assortment/', views_api.assortment_list, name='api_assortment_list'),
+    path('api/assortment/<int:pk>/', views_api.assortment_detail, name='api_assortment_detail'),
+    path('api/availability/', views_api.availability, name='api_availability'),
+    path('api/clothes-types/', views_api.clothes_types, name='api_clothes_types'),
+    path('api/sizes/', views_api.sizes, name='api_sizes'),
+    path('api/delivery-methods/', views_api.delivery_methods, name='api_delivery_methods'),
 
     # ============================================================================
     # ЗАДАЧА 3: CRUD ДЛЯ POSTGRESQL МОДЕЛЕЙ
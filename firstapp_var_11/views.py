@@ -1,22 +1,24 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, Http404, JsonResponse
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 import os
 from openpyxl import load_workbook
 from .forms import BuyerForm, ClothesSearchForm, PurchaseForm
 from .models import Buyer, Purchase, Assortment, AssortmentSize, ClothesType, Size, Seller
-from django.db.models import Count, Sum, Q
+from django.db.models import Count, F, Sum, Q
 from datetime import datetime, timedelta
 
 
 def index(request):
+    from .analytics import sales_totals
+
     # Собираем статистику для главной страницы
+    totals = sales_totals()
     context = {
         'total_customers': Buyer.objects.count(),
-        'total_purchases': Purchase.objects.count(),
-        'total_revenue': Purchase.objects.aggregate(
-            total=Sum('total_amount')
-        )['total'] or 0,
+        'total_purchases': totals['count'],
+        'total_revenue': totals['revenue'],
         'total_items': Assortment.objects.count(),
     }
     return render(request, 'index.html', context)
@@ -105,16 +107,31 @@ def purchase_year(request, year):
 
 
 def search_assortment(request):
-    """Поиск ассортимента с параметрами строки запроса"""
-    name = request.GET.get('name', '')
-    min_price = request.GET.get('min_price', '0')
-    max_price = request.GET.get('max_price', '100000')
+    """Полнотекстовый поиск по ассортименту с фильтрами из строки запроса"""
+    from .catalog import attach_size_summary, search_catalog
+    from .forms import AssortmentSearchForm
+    from .pagination import EstimatedCountPaginator
+    from . import tracing
+
+    form = AssortmentSearchForm(request.GET)
+    filters = form.cleaned_data if form.is_valid() else {}
+    name = filters.get('name', '')
+
+    with tracing.span('search.assortment', query=name):
+        paginator = EstimatedCountPaginator(search_catalog(name, filters), 20)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        results = attach_size_summary(page_obj)
 
     context = {
+        'form': form,
         'search_name': name,
-        'min_price': min_price,
-        'max_price': max_price,
-        'message': f'Поиск: "{name}", цена от {min_price} до {max_price} руб.'
+        'min_price': filters.get('min_price'),
+        'max_price': filters.get('max_price'),
+        'message': f'Поиск: "{name}", найдено товаров: {paginator.count}',
+        'results': results,
+        'page_obj': page_obj,
+        'paginator': paginator,
+        'is_paginated': page_obj.has_other_pages(),
     }
     return render(request, 'search_result.html', context)
 
@@ -245,8 +262,26 @@ def clothes_search_view(request):
     if request.method == 'GET':
         form = ClothesSearchForm(request.GET)
         if form.is_valid():
+            from .catalog import attach_size_summary, search_catalog
+
             search_data = form.cleaned_data
-            return render(request, 'search_results.html', {'form': form, 'search_data': search_data})
+            # Тип одежды ищется по названию типа в поисковом индексе
+            type_name = dict(ClothesSearchForm.CLOTHES_TYPES)[search_data['clothes_type']]
+            results = attach_size_summary(search_catalog(type_name, {
+                'size_values': search_data['size'],
+                'min_price': search_data['min_price'],
+                'max_price': search_data['max_price'],
+            })[:50])
+            context = {
+                'form': form,
+                'search_data': search_data,
+                'search_name': type_name,
+                'min_price': search_data['min_price'],
+                'max_price': search_data['max_price'],
+                'message': f'Поиск: "{type_name}", найдено товаров: {len(results)}',
+                'results': results,
+            }
+            return render(request, 'search_result.html', context)
     else:
         form = ClothesSearchForm()
 
@@ -289,11 +324,12 @@ def clothes_sizes(request, clothes_id):
     """Демонстрация связи M:M"""
     try:
         clothes = Assortment.objects.get(id=clothes_id)
-        sizes = clothes.available_sizes.all()
+        # Один запрос: размеры вместе с остатками, количество - длина списка
+        sizes = list(clothes.available_sizes.annotate(quantity=F('assortmentsize__quantity')))
         context = {
             'clothes': clothes,
             'sizes': sizes,
-            'count': sizes.count()
+            'count': len(sizes)
         }
         return render(request, 'clothes_sizes.html', context)
     except Assortment.DoesNotExist:
@@ -316,49 +352,27 @@ def handler500(request):
 
 def sales_stats(request):
     """Общая статистика продаж"""
-    from django.db.models import Sum, Avg, Count
-    from datetime import datetime, timedelta
-    import json
-    
-    # #region agent log
-    log_path = r'c:\Users\kiril\PycharmProjects\PythonProject_Kursovaya\.cursor\debug.log'
-    try:
-        with open(log_path, 'a', encoding='utf-8') as f:
-            f.write(json.dumps({'location': 'views.py:317', 'message': 'sales_stats entry', 'data': {'hypothesisId': 'C'}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-    except: pass
-    # #endregion
-    
-    try:
-        total_revenue = Purchase.objects.aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-        avg_purchase = Purchase.objects.aggregate(Avg('total_amount'))['total_amount__avg'] or 0
-        total_purchases = Purchase.objects.count()
-        
-        # Статистика за последние 30 дней
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        recent_purchases = Purchase.objects.filter(purchase_date__gte=thirty_days_ago)
-        recent_revenue = recent_purchases.aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-        
-        # #region agent log
-        try:
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({'location': 'views.py:330', 'message': 'sales_stats calculations successful', 'data': {'hypothesisId': 'C', 'total_revenue': float(total_revenue), 'total_purchases': total_purchases}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-        except: pass
-        # #endregion
-    except Exception as e:
-        # #region agent log
-        try:
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({'location': 'views.py:332', 'message': 'sales_stats failed', 'data': {'hypothesisId': 'C', 'error': str(e), 'error_type': type(e).__name__}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-        except: pass
-        # #endregion
-        raise
-    
+    from django.utils import timezone
+    from . import tracing
+    from .analytics import sales_totals
+
+    with tracing.span('sales_stats.totals'):
+        totals = sales_totals()
+        total_revenue = totals['revenue']
+        avg_purchase = totals['average']
+        total_purchases = totals['count']
+
+    # Статистика за последние 30 дней
+    with tracing.span('sales_stats.recent'):
+        recent = sales_totals(since=timezone.localdate() - timedelta(days=29))
+        recent_revenue = recent['revenue']
+
     context = {
         'total_revenue': total_revenue,
         'avg_purchase': avg_purchase,
         'total_purchases': total_purchases,
         'recent_revenue': recent_revenue,
-        'recent_purchases_count': recent_purchases.count(),
+        'recent_purchases_count': recent['count'],
     }
     return render(request, 'analytics/sales_stats.html', context)
 
@@ -380,63 +394,23 @@ def sales_by_customer(request):
 
 def sales_by_type(request):
     """Продажи по типам одежды"""
-    from django.db.models import Sum, Count
-    
-    # Здесь нужно будет добавить связь Purchase с Assortment через промежуточную модель
-    # Пока используем данные из Assortment
-    type_stats = ClothesType.objects.annotate(
-        items_count=Count('assortments'),
-        total_value=Sum('assortments__price')
-    ).order_by('-items_count')
-    
-    context = {
-        'type_stats': type_stats,
-    }
+    from .analytics import sales_by_type as build_sales_by_type
+
+    context = build_sales_by_type()
     return render(request, 'analytics/sales_by_type.html', context)
 
 
 def assortment_by_size(request):
     """Ассортимент по размерам"""
     from django.db.models import Count, Sum
-    import json
-    import os
-    
-    # #region agent log
-    log_path = r'c:\Users\kiril\PycharmProjects\PythonProject_Kursovaya\.cursor\debug.log'
-    try:
-        with open(log_path, 'a', encoding='utf-8') as f:
-            f.write(json.dumps({'location': 'views.py:373', 'message': 'assortment_by_size entry', 'data': {'hypothesisId': 'A'}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-    except: pass
-    # #endregion
-    
-    try:
-        # #region agent log
-        try:
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({'location': 'views.py:378', 'message': 'Before query execution', 'data': {'hypothesisId': 'A', 'query_field': 'assortmentsize__assortment'}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-        except: pass
-        # #endregion
-        
-        size_stats = Size.objects.annotate(
+    from . import tracing
+
+    with tracing.span('assortment_by_size.query'):
+        size_stats = list(Size.objects.annotate(
             items_count=Count('assortmentsize__assortment'),
             total_quantity=Sum('assortmentsize__quantity')
-        ).order_by('-items_count')
-        
-        # #region agent log
-        try:
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({'location': 'views.py:385', 'message': 'Query executed successfully', 'data': {'hypothesisId': 'A', 'result_count': len(list(size_stats))}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-        except: pass
-        # #endregion
-    except Exception as e:
-        # #region agent log
-        try:
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({'location': 'views.py:387', 'message': 'Query failed', 'data': {'hypothesisId': 'A', 'error': str(e), 'error_type': type(e).__name__}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-        except: pass
-        # #endregion
-        raise
-    
+        ).order_by('-items_count'))
+
     context = {
         'size_stats': size_stats,
     }
@@ -445,159 +419,113 @@ def assortment_by_size(request):
 
 def seller_performance(request):
     """Эффективность продавцов"""
-    import json
-    import os
-    
-    # #region agent log
-    log_path = r'c:\Users\kiril\PycharmProjects\PythonProject_Kursovaya\.cursor\debug.log'
-    try:
-        with open(log_path, 'a', encoding='utf-8') as f:
-            f.write(json.dumps({'location': 'views.py:388', 'message': 'seller_performance entry', 'data': {'hypothesisId': 'B'}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-    except: pass
-    # #endregion
-    
-    # Пока продавцы не связаны с покупками, возвращаем базовую информацию
-    try:
-        # #region agent log
-        try:
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({'location': 'views.py:391', 'message': 'Before Seller.objects.all()', 'data': {'hypothesisId': 'B'}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-        except: pass
-        # #endregion
-        
-        sellers = Seller.objects.all()
-        
-        # #region agent log
-        try:
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({'location': 'views.py:393', 'message': 'Seller query successful', 'data': {'hypothesisId': 'B', 'sellers_count': sellers.count()}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-        except: pass
-        # #endregion
-    except Exception as e:
-        # #region agent log
-        try:
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({'location': 'views.py:395', 'message': 'Seller query failed', 'data': {'hypothesisId': 'B', 'error': str(e), 'error_type': type(e).__name__}, 'timestamp': __import__('time').time() * 1000, 'sessionId': 'debug-session', 'runId': 'run1'}) + '\n')
-        except: pass
-        # #endregion
-        raise
-    
+    from . import tracing
+    from .analytics import parse_seller_period, seller_performance as build_performance, SELLER_PERFORMANCE_PERIODS
+
+    days = parse_seller_period(request.GET)
+    with tracing.span('seller_performance.query', days=days):
+        sellers = build_performance(days)
+
     context = {
         'sellers': sellers,
+        'days': days,
+        'periods': SELLER_PERFORMANCE_PERIODS,
     }
     return render(request, 'analytics/seller_performance.html', context)
 
 
 def daily_sales_report(request):
-    """Ежедневный отчет по продажам"""
-    from django.db.models import Sum, Count
-    from django.utils import timezone
-    from datetime import timedelta
-    
-    today = timezone.now().date()
-    week_ago = today - timedelta(days=7)
-    
-    daily_stats = []
-    for i in range(7):
-        date = week_ago + timedelta(days=i)
-        purchases = Purchase.objects.filter(purchase_date__date=date)
-        daily_stats.append({
-            'date': date,
-            'count': purchases.count(),
-            'revenue': purchases.aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-        })
-    
+    """Отчет по продажам за период (по часам, дням или неделям)"""
+    from .analytics import parse_report_window, sales_series, SALES_GRANULARITIES
+
+    start, end, granularity = parse_report_window(request.GET)
+    daily_stats = sales_series(start, end, granularity)
+
     context = {
         'daily_stats': daily_stats,
+        'date_from': start,
+        'date_to': end,
+        'granularity': granularity,
+        'granularities': list(SALES_GRANULARITIES),
+        'total_count': sum(stat['count'] for stat in daily_stats),
+        'total_revenue': sum(stat['revenue'] for stat in daily_stats),
     }
     return render(request, 'analytics/daily_sales.html', context)
 
 
 def customer_segments(request):
     """Сегментация покупателей"""
-    from django.db.models import Sum, Count, Avg
-    
-    vip_customers = Buyer.objects.filter(is_vip=True).count()
-    regular_customers = Buyer.objects.filter(is_vip=False).count()
-    
-    customers_with_purchases = Buyer.objects.annotate(
-        purchase_count=Count('purchases'),
-        total_spent=Sum('purchases__total_amount')
-    ).filter(purchase_count__gt=0)
-    
-    high_value = customers_with_purchases.filter(total_spent__gte=10000).count()
-    medium_value = customers_with_purchases.filter(
-        total_spent__gte=5000, total_spent__lt=10000
-    ).count()
-    low_value = customers_with_purchases.filter(total_spent__lt=5000).count()
-    
-    context = {
-        'vip_customers': vip_customers,
-        'regular_customers': regular_customers,
-        'high_value': high_value,
-        'medium_value': medium_value,
-        'low_value': low_value,
-    }
+    from .analytics import segment_thresholds, customer_segments as build_segments
+
+    context = build_segments(segment_thresholds(request.GET))
     return render(request, 'analytics/customer_segments.html', context)
 
 
 def inventory_status(request):
     """Статус склада"""
-    from django.db.models import Sum, Count
-    
-    total_items = Assortment.objects.count()
-    in_stock = Assortment.objects.filter(stock_quantity__gt=0).count()
-    out_of_stock = Assortment.objects.filter(stock_quantity=0).count()
-    low_stock = Assortment.objects.filter(stock_quantity__lte=5, stock_quantity__gt=0).count()
-    
-    total_value = Assortment.objects.aggregate(
-        total=Sum('price')
-    )['total'] or 0
-    
-    context = {
-        'total_items': total_items,
-        'in_stock': in_stock,
-        'out_of_stock': out_of_stock,
-        'low_stock': low_stock,
-        'total_value': total_value,
-    }
+    from .analytics import low_stock_threshold, inventory_status as build_inventory
+
+    context = build_inventory(low_stock_threshold(request.GET))
     return render(request, 'analytics/inventory_status.html', context)
 
 
 def top_products(request):
     """Топ товаров"""
-    from django.db.models import Count
-    
-    # Пока просто сортируем по количеству на складе
-    top_products = Assortment.objects.order_by('-stock_quantity')[:10]
-    
+    from .analytics import parse_top_products_params, top_products as build_top, TOP_PRODUCT_WINDOWS
+
+    window, metric = parse_top_products_params(request.GET)
     context = {
-        'top_products': top_products,
+        'top_products': build_top(window, metric),
+        'window': window,
+        'metric': metric,
+        'windows': TOP_PRODUCT_WINDOWS,
     }
     return render(request, 'analytics/top_products.html', context)
 
 
 def purchase_trends(request):
     """Тренды покупок"""
-    from django.db.models import Count
-    from django.utils import timezone
-    from datetime import timedelta
-    from collections import defaultdict
-    
-    # Статистика по способам оплаты
-    payment_stats = Purchase.objects.values('payment_method').annotate(
-        count=Count('id')
-    ).order_by('-count')
-    
-    # Статистика по месяцам
-    monthly_stats = defaultdict(int)
-    purchases = Purchase.objects.all()
-    for purchase in purchases:
-        month_key = purchase.purchase_date.strftime('%Y-%m')
-        monthly_stats[month_key] += 1
-    
+    from .analytics import (
+        parse_trend_params, payment_method_stats, purchase_trends as build_trends, TREND_GRANULARITIES,
+    )
+
+    granularity, periods, by_payment = parse_trend_params(request.GET)
+    trends = build_trends(granularity, periods, by_payment)
+
     context = {
-        'payment_stats': payment_stats,
-        'monthly_stats': dict(sorted(monthly_stats.items())),
+        'payment_stats': payment_method_stats(),
+        'trends': trends,
+        'periods': periods,
+        'by_payment': by_payment,
+        'granularities': list(TREND_GRANULARITIES),
     }
-    return render(request, 'analytics/purchase_trends.html', context)
\ No newline at end of file
+    return render(request, 'analytics/purchase_trends.html', context)
+
+
+def purchase_trends_json(request):
+    """Тренды покупок в формате JSON"""
+    from .analytics import parse_trend_params, purchase_trends as build_trends
+
+    granularity, periods, by_payment = parse_trend_params(request.GET)
+    return JsonResponse(build_trends(granularity, periods, by_payment))
+
+
+def analytics_cache_stats(request):
+    """Попадания и промахи кэша аналитики в формате JSON"""
+    from . import analytics  # noqa: F401  (регистрирует кэшируемые отчёты)
+    from .analytics_cache import cache_stats
+
+    return JsonResponse({'reports': cache_stats()})
+
+
+@staff_member_required
+def analytics_traces(request):
+    """Последние трассы запросов в формате JSON (только для персонала)"""
+    from . import tracing
+
+    limit = request.GET.get('limit')
+    return JsonResponse({
+        'enabled': getattr(settings, 'TRACING_ENABLED', False),
+        'dropped': tracing.dropped_traces,
+        'traces': tracing.recent_traces(int(limit) if limit and limit.isdigit() else 50),
+    })
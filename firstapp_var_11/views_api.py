@@ -0,0 +1,249 @@
+"""
+JSON API каталога только для чтения.
+
+Ответы компактные (без пробелов в JSON, только нужные клиенту поля) и
+снабжены сильным ETag и заголовком Cache-Control. ETag строится из версий
+таблиц, общих для всех процессов (analytics_cache.table_versions), а для
+карточки товара - ещё из updated_at, поэтому запрос с If-None-Match
+проверяется одним запросом к таблице версий, без чтения каталога, и
+получает 304 Not Modified, пока таблицы не менялись.
+
+Изменения мимо сигналов (update(), bulk_create(), сырой SQL) версии не
+меняют - после них нужно вызвать analytics_cache.bump_version().
+"""
+import functools
+import hashlib
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_safe
+
+from . import inventory
+from .analytics_cache import table_versions
+from .catalog import search_catalog
+from .forms import AssortmentSearchForm
+from .models import Assortment, AssortmentSize, ClothesType, DeliveryMethod, Size
+from .pagination import EstimatedCountPaginator
+
+
+# Меняется при изменении формата ответов, чтобы старые ETag перестали совпадать
+API_VERSION = 1
+
+DEFAULT_CATALOG_API_MAX_AGE = 60
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Сколько пар «товар:размер» можно проверить одним запросом наличия
+MAX_AVAILABILITY_ITEMS = 200
+
+# Таблицы, из которых собираются ответы
+ASSORTMENT_MODELS = (Assortment, AssortmentSize)
+# Поиск ?name= ищет и по названиям типов одежды
+ASSORTMENT_LIST_MODELS = (*ASSORTMENT_MODELS, ClothesType)
+ASSORTMENT_DETAIL_MODELS = (AssortmentSize, ClothesType, Size)
+
+
+def _json(payload, status=200):
+    return JsonResponse(
+        payload, status=status,
+        json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False},
+    )
+
+
+def _error(message, status, **extra):
+    return _json({'error': message, **extra}, status=status)
+
+
+def _digest(*parts):
+    return hashlib.md5(repr((API_VERSION, *parts)).encode('utf-8')).hexdigest()
+
+
+def versions_etag(*models):
+    """
+    etag_func для condition(): версии таблиц models, путь и параметры запроса.
+    Порядок параметров в строке запроса на ETag не влияет.
+    """
+    def etag(request, *args, **kwargs):
+        params = sorted((key, sorted(values)) for key, values in request.GET.lists())
+        return _digest(request.path, params, table_versions(models))
+    return etag
+
+
+def api_view(etag_func):
+    """
+    Декоратор представления API: только GET/HEAD, ETag и ответ 304
+    по If-None-Match, Cache-Control для браузеров и промежуточных кэшей.
+    """
+    def decorator(view):
+        conditional = require_safe(condition(etag_func=etag_func)(view))
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                max_age = getattr(settings, 'CATALOG_API_MAX_AGE', DEFAULT_CATALOG_API_MAX_AGE)
+                patch_cache_control(response, public=True, max_age=max_age, must_revalidate=True)
+            else:
+                patch_cache_control(response, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+# ============================================================================
+# СПРАВОЧНИКИ
+# ============================================================================
+
+@api_view(versions_etag(ClothesType))
+def clothes_types(request):
+    """Типы одежды"""
+    return _json({'results': list(ClothesType.objects.order_by('name').values('id', 'name'))})
+
+
+@api_view(versions_etag(Size))
+def sizes(request):
+    """Размеры"""
+    rows = Size.objects.order_by('system', 'id').values_list('id', 'size_value', 'system')
+    return _json({
+        'results': [{'id': pk, 'value': value, 'system': system} for pk, value, system in rows],
+    })
+
+
+@api_view(versions_etag(DeliveryMethod))
+def delivery_methods(request):
+    """Активные способы доставки"""
+    rows = (
+        DeliveryMethod.objects.filter(is_active=True).order_by('name')
+        .values_list('id', 'name', 'cost', 'delivery_time_days')
+    )
+    return _json({
+        'results': [
+            {'id': pk, 'name': name, 'cost': cost, 'days': days}
+            for pk, name, cost, days in rows
+        ],
+    })
+
+
+# ============================================================================
+# АССОРТИМЕНТ
+# ============================================================================
+
+def _page_size(request):
+    value = request.GET.get('page_size', '')
+    if not value.isdigit() or int(value) < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(int(value), MAX_PAGE_SIZE)
+
+
+@api_view(versions_etag(*ASSORTMENT_LIST_MODELS))
+def assortment_list(request):
+    """
+    Товары каталога постранично. Фильтры те же, что у поиска
+    (name, category, clothes_type, size, min_price, max_price,
+    price_range, sort), плюс page и page_size.
+    sizes - id размеров, которые есть в наличии.
+    """
+    form = AssortmentSearchForm(request.GET)
+    if not form.is_valid():
+        return _error('Неверные параметры запроса', 400, fields=form.errors.get_json_data())
+    filters = form.cleaned_data
+
+    paginator = EstimatedCountPaginator(search_catalog(filters.get('name', ''), filters), _page_size(request))
+    page_obj = paginator.get_page(request.GET.get('page'))
+    items = list(page_obj)
+
+    in_stock = {}
+    sized = AssortmentSize.objects.filter(
+        assortment_id__in=[item.pk for item in items], quantity__gt=0,
+    ).values_list('assortment_id', 'size_id').order_by('size_id')
+    for assortment_id, size_id in sized:
+        in_stock.setdefault(assortment_id, []).append(size_id)
+
+    return _json({
+        'count': paginator.count,
+        'count_is_estimate': paginator.count_is_estimate,
+        'page': page_obj.number,
+        'pages': paginator.num_pages,
+        'next': page_obj.next_page_number() if page_obj.has_next() else None,
+        'results': [
+            {
+                'id': item.pk,
+                'name': item.name,
+                'type': item.clothes_type_id,
+                'category': item.category,
+                'price': item.price,
+                'stock': item.stock_quantity,
+                'sizes': in_stock.get(item.pk, []),
+            }
+            for item in items
+        ],
+    })
+
+
+def assortment_detail_etag(request, pk):
+    """updated_at товара и версии таблиц размеров и типов; None - товара нет"""
+    updated_at = Assortment.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    return _digest(request.path, updated_at.isoformat(), table_versions(ASSORTMENT_DETAIL_MODELS))
+
+
+@api_view(assortment_detail_etag)
+def assortment_detail(request, pk):
+    """Карточка товара с остатками по размерам"""
+    item = Assortment.objects.select_related('clothes_type').filter(pk=pk).first()
+    if item is None:
+        return _error('Товар не найден', 404)
+    rows = (
+        AssortmentSize.objects.filter(assortment=item)
+        .order_by('size__system', 'size_id')
+        .values_list('size_id', 'size__size_value', 'quantity')
+    )
+    return _json({
+        'id': item.pk,
+        'name': item.name,
+        'type': {'id': item.clothes_type_id, 'name': item.clothes_type.name},
+        'category': item.category,
+        'description': item.description,
+        'price': item.price,
+        'stock': item.stock_quantity,
+        'updated_at': item.updated_at,
+        'sizes': [
+            {'id': size_id, 'value': value, 'quantity': quantity}
+            for size_id, value, quantity in rows
+        ],
+    })
+
+
+def _parse_items(value):
+    """'12:3,12:4,15' -> [(12, 3), (12, 4), (15, None)]; None - неверный формат"""
+    pairs = []
+    for token in value.split(','):
+        pk, _, size_id = token.strip().partition(':')
+        if not pk.isdigit() or (size_id and not size_id.isdigit()):
+            return None
+        pairs.append((int(pk), int(size_id) if size_id else None))
+    return pairs
+
+
+@api_view(versions_etag(*ASSORTMENT_MODELS))
+def availability(request):
+    """
+    Остатки сразу для многих товаров (корзина, значки наличия):
+    items=12:3,12:4,15 - товар:размер или товар без размера (общий остаток).
+    Ответ: {"results": {"12:3": 5, "12:4": 0, "15": 7}}.
+    """
+    pairs = _parse_items(request.GET.get('items', ''))
+    if not pairs:
+        return _error('Укажите items в формате товар:размер через запятую', 400)
+    if len(pairs) > MAX_AVAILABILITY_ITEMS:
+        return _error(f'Не больше {MAX_AVAILABILITY_ITEMS} позиций за запрос', 400)
+    stock = inventory.availability(pairs)
+    return _json({
+        'results': {
+            (f'{pk}:{size_id}' if size_id is not None else str(pk)): stock[pk, size_id]
+            for pk, size_id in pairs
+        },
+    })
@@ -1,10 +1,17 @@
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from .models import *
+from . import inventory
+from .catalog import catalog_queryset, filter_catalog
+from .crossdb import prefetch_crossdb
+from .facets import catalog_facets
+from .pagination import CURSOR_PARAM, EstimatedCountPaginator, KeysetPaginationMixin, keyset_paginate
 from .forms import (
-    DeliveryMethodForm, BuyerProfileForm, OrderForm, OrderItemForm
+    AssortmentFilterForm, DeliveryMethodForm, BuyerProfileForm, OrderForm, OrderItemForm
 )
 
 
@@ -17,6 +24,7 @@ class ClothesTypeListView(ListView):
     template_name = 'crud/clothestype_list.html'
     context_object_name = 'clothestypes'
     paginate_by = 10
+    paginator_class = EstimatedCountPaginator
 
 
 class ClothesTypeDetailView(DetailView):
@@ -54,6 +62,12 @@ class BuyerListView(ListView):
     template_name = 'crud/buyer_list.html'
     context_object_name = 'buyers'
     paginate_by = 15
+    paginator_class = EstimatedCountPaginator
+
+
+# Размер порции истории покупок на странице покупателя
+BUYER_PURCHASES_PAGE_SIZE = 20
+BUYER_PURCHASES_ORDERING = ['-purchase_date', '-id']
 
 
 class BuyerDetailView(DetailView):
@@ -62,8 +76,33 @@ class BuyerDetailView(DetailView):
     context_object_name = 'buyer'
 
     def get_context_data(self, **kwargs):
+        from .analytics import buyer_purchase_summary
+
         context = super().get_context_data(**kwargs)
-        context['purchases'] = self.object.purchases.all()
+        context['summary'] = buyer_purchase_summary(self.object.pk)
+        # Первая порция истории; следующие подгружаются BuyerPurchasesView
+        context['page_obj'] = keyset_paginate(
+            self.object.purchases.all(), BUYER_PURCHASES_ORDERING,
+            BUYER_PURCHASES_PAGE_SIZE, self.request.GET.get(CURSOR_PARAM),
+        )
+        context['purchases'] = context['page_obj'].object_list
+        return context
+
+
+class BuyerPurchasesView(KeysetPaginationMixin, ListView):
+    """Порция истории покупок покупателя (HTML-фрагмент для подгрузки)"""
+    model = Purchase
+    template_name = 'crud/buyer_purchase_rows.html'
+    context_object_name = 'purchases'
+    paginate_by = BUYER_PURCHASES_PAGE_SIZE
+    keyset_ordering = BUYER_PURCHASES_ORDERING
+
+    def get_queryset(self):
+        return Purchase.objects.filter(buyer_id=self.kwargs['pk'])
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['buyer_id'] = self.kwargs['pk']
         return context
 
 
@@ -123,6 +162,37 @@ class AssortmentListView(ListView):
     template_name = 'crud/assortment_list.html'
     context_object_name = 'assortments'
     paginate_by = 12
+    paginator_class = EstimatedCountPaginator
+
+    def get_queryset(self):
+        self.filter_form = AssortmentFilterForm(self.request.GET or None)
+        self.filters = self.filter_form.cleaned_data if self.filter_form.is_valid() else {}
+        return catalog_queryset(self.filters)
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        # Количество строк - по фильтрам, без сводки по размерам
+        kwargs['count_queryset'] = filter_catalog(Assortment.objects.all(), self.filters)
+        return super().get_paginator(queryset, per_page, **kwargs)
+
+    def get_facets(self):
+        """Счётчики фасетов из индекса в памяти со ссылками выбора/сброса значения"""
+        facets = catalog_facets(self.filters)
+        for facet in facets['facets']:
+            for value in facet['values']:
+                params = self.request.GET.copy()
+                params.pop('page', None)
+                if value['selected']:
+                    params.pop(facet['name'], None)
+                else:
+                    params[facet['name']] = value['value']
+                value['url'] = f'?{params.urlencode()}'
+        return facets
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['filter_form'] = self.filter_form
+        context['facets'] = self.get_facets()
+        return context
 
 
 class AssortmentDetailView(DetailView):
@@ -132,7 +202,7 @@ class AssortmentDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['sizes_available'] = self.object.assortmentsize_set.all()
+        context['sizes_available'] = list(self.object.assortmentsize_set.select_related('size'))
         return context
 
 
@@ -149,6 +219,13 @@ class AssortmentUpdateView(UpdateView):
     fields = ['name', 'clothes_type', 'category', 'description', 'price', 'stock_quantity']
     success_url = reverse_lazy('assortment_list')
 
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        # Остаток товара с размерами - сумма по размерам, вручную не меняется
+        if self.object.assortmentsize_set.exists():
+            form.fields['stock_quantity'].disabled = True
+        return form
+
 
 class AssortmentDeleteView(DeleteView):
     model = Assortment
@@ -165,6 +242,7 @@ class SellerListView(ListView):
     template_name = 'crud/seller_list.html'
     context_object_name = 'sellers'
     paginate_by = 10
+    paginator_class = EstimatedCountPaginator
 
 
 class SellerDetailView(DetailView):
@@ -202,6 +280,7 @@ class SizeListView(ListView):
     template_name = 'crud/size_list.html'
     context_object_name = 'sizes'
     paginate_by = 15
+    paginator_class = EstimatedCountPaginator
 
 
 class SizeDetailView(DetailView):
@@ -234,12 +313,16 @@ class SizeDeleteView(DeleteView):
 # Дополнительные CRUD для Purchase (полный список и детали)
 # ============================================================================
 
-class PurchaseListView(ListView):
+class PurchaseListView(KeysetPaginationMixin, ListView):
     model = Purchase
     template_name = 'crud/purchase_list.html'
     context_object_name = 'purchases'
     paginate_by = 20
     ordering = ['-purchase_date']
+    keyset_ordering = ['-purchase_date', '-id']
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('buyer')
 
 
 class PurchaseDetailView(DetailView):
@@ -276,6 +359,7 @@ class DeliveryMethodListView(ListView):
     template_name = 'crud/deliverymethod_list.html'
     context_object_name = 'delivery_methods'
     paginate_by = 10
+    paginator_class = EstimatedCountPaginator
 
 
 class DeliveryMethodDetailView(DetailView):
@@ -310,6 +394,7 @@ class BuyerProfileListView(ListView):
     template_name = 'crud/buyerprofile_list.html'
     context_object_name = 'profiles'
     paginate_by = 15
+    paginator_class = EstimatedCountPaginator
 
 
 class BuyerProfileDetailView(DetailView):
@@ -339,12 +424,23 @@ class BuyerProfileDeleteView(DeleteView):
 
 
 # Order CRUD
-class OrderListView(ListView):
+class OrderListView(KeysetPaginationMixin, ListView):
     model = Order
     template_name = 'crud/order_list.html'
     context_object_name = 'orders'
     paginate_by = 20
     ordering = ['-order_date', '-order_time']
+    keyset_ordering = ['-order_date', '-order_time', '-id']
+
+    def get_queryset(self):
+        # Продавец и способ доставки в той же базе, что и заказ - JOIN
+        return super().get_queryset().select_related('seller', 'delivery_method').with_totals()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Покупатели в SQLite: один запрос на страницу
+        prefetch_crossdb(context['object_list'], 'buyer')
+        return context
 
 
 class OrderDetailView(DetailView):
@@ -352,9 +448,20 @@ class OrderDetailView(DetailView):
     template_name = 'crud/order_detail.html'
     context_object_name = 'order'
 
+    def get_queryset(self):
+        return super().get_queryset().select_related('seller', 'delivery_method').with_totals()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['order_items'] = self.object.order_items.all()
+        prefetch_crossdb([self.object], 'buyer')
+        # Суммы позиций считает БД; товары и размеры из SQLite - по запросу на модель
+        order_items = prefetch_crossdb(
+            self.object.order_items.with_amounts(), 'assortment', 'size'
+        )
+        context['order_items'] = order_items
+        context['items_gross'] = sum(item.line_gross for item in order_items)
+        context['items_discount'] = sum(item.line_discount for item in order_items)
+        context['items_subtotal'] = sum(item.line_subtotal for item in order_items)
         return context
 
 
@@ -371,6 +478,16 @@ class OrderUpdateView(UpdateView):
     form_class = OrderForm
     success_url = reverse_lazy('order_list')
 
+    def form_valid(self, form):
+        # Возврат из отмены заново резервирует товар; если его не хватает,
+        # сигнал бросает ValidationError и смена статуса откатывается
+        try:
+            with inventory.release_on_rollback(), transaction.atomic(using=router.db_for_write(Order)):
+                return super().form_valid(form)
+        except ValidationError as error:
+            form.add_error('status', error)
+            return self.form_invalid(form)
+
 
 class OrderDeleteView(DeleteView):
     model = Order
@@ -379,16 +496,47 @@ class OrderDeleteView(DeleteView):
 
 
 # OrderItem CRUD
-class OrderItemCreateView(CreateView):
+class OrderItemReservationMixin:
+    """
+    Позиция заказа резервирует товар на складе до сохранения: прежний
+    резерв изменяемой позиции возвращается, новый берётся одним условным
+    UPDATE (inventory.reserve_items), и позиция отмечается флагом reserved.
+    Если сохранить позицию не удалось (любое исключение), склад
+    возвращается в прежнее состояние.
+    """
+
+    def form_valid(self, form):
+        # Позиция и пересчёт суммы заказа (сигнал) - одной транзакцией
+        with inventory.release_on_rollback(), transaction.atomic(using=router.db_for_write(OrderItem)):
+            if not inventory.reserve_items([form.instance]):
+                form.add_error('quantity', 'Недостаточно товара на складе')
+                return self.form_invalid(form)
+            return super().form_valid(form)
+
+
+class OrderItemCreateView(OrderItemReservationMixin, CreateView):
     model = OrderItem
     template_name = 'crud/orderitem_form.html'
     form_class = OrderItemForm
+
+    def dispatch(self, request, *args, **kwargs):
+        # Позиция добавляется в заказ по ссылке с его страницы: ?order=<id>
+        order_id = request.GET.get('order', '')
+        if not order_id.isdigit():
+            return redirect('order_list')
+        self.order = get_object_or_404(Order, pk=order_id)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['instance'] = OrderItem(order=self.order)
+        return kwargs
     
     def get_success_url(self):
         return reverse_lazy('order_detail', args=[self.object.order.id])
 
 
-class OrderItemUpdateView(UpdateView):
+class OrderItemUpdateView(OrderItemReservationMixin, UpdateView):
     model = OrderItem
     template_name = 'crud/orderitem_form.html'
     form_class = OrderItemForm
@@ -37,6 +37,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'firstapp_var_11.tracing.TracingMiddleware',
 ]
 
 ROOT_URLCONF = 'web_Hello_var_11.urls'
@@ -85,6 +86,39 @@ DATABASES = {
 # Database Router для задачи 2.4 (PostgreSQL для Seller и SellerProfile)
 DATABASE_ROUTERS = ['firstapp_var_11.database_routers.PostgresRouter']
 
+# Пороги сегментации покупателей по сумме покупок (руб.)
+CUSTOMER_SEGMENT_THRESHOLDS = [5000, 10000]
+
+# Остаток на складе, при котором товар считается заканчивающимся
+LOW_STOCK_THRESHOLD = 5
+
+# Время жизни кэшированных результатов аналитики (секунды); при изменении
+# данных результаты сбрасываются раньше через версии таблиц
+ANALYTICS_CACHE_TIMEOUT = 3600
+
+# Время жизни кэша карты товар -> тип/категория для межбазовых отчётов (секунды)
+ASSORTMENT_MAP_CACHE_TIMEOUT = 300
+
+# Трассировка запросов (firstapp_var_11.tracing). При выключенной трассировке
+# middleware не подключается. Доля трассируемых запросов, размер кольцевого
+# буфера последних трасс и файл JSON Lines для фоновой записи (None - не писать)
+TRACING_ENABLED = False
+TRACING_SAMPLE_RATE = 0.01
+TRACING_BUFFER_SIZE = 200
+TRACING_LOG_FILE = None
+
+# С какого числа строк списки и админка показывают оценку количества
+# по статистике БД вместо точного COUNT(*)
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Фасетный индекс каталога в памяти процесса перестраивается не реже,
+# чем раз в столько секунд (изменения мимо сигналов: update(), сырой SQL)
+FACET_INDEX_MAX_AGE = 300
+
+# Сколько секунд клиенты и промежуточные кэши могут использовать ответ
+# JSON API каталога без перепроверки по ETag
+CATALOG_API_MAX_AGE = 60
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
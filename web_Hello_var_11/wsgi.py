@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'web_Hello_var_11.settings')
 
 application = get_wsgi_application()
+
+# Фасетный индекс каталога строится сразу, а не на первом запросе
+from firstapp_var_11.facets import warm_up  # noqa: E402
+
+warm_up()